@@ -0,0 +1,331 @@
+import argparse
+from time import perf_counter
+
+from numpy import array, zeros, concatenate, abs as np_abs
+
+import JitKernels
+import Swarm
+from Obstacles import spread_meshes
+from Parallel import SwarmSpec, SwarmPool, SlabPool, build_swarms
+from Parameters import DP, SP, load_config
+
+"""
+Run the swarm simulation without a window (or MIDI)
+Steps the swarms on a fixed timestep as fast as possible and reports how fast that was
+
+Usage (from src):
+    python -m Headless --ticks 1000
+    python -m Headless --seconds 30 --boids 500 --followers 2
+    python -m Headless --ticks 1000 --boids 1000 --followers 3 --workers 4
+    python -m Headless --ticks 100 --boids 20000 --slabs 4
+    python -m Headless --ticks 1000 --boids 500 --predators 1
+    python -m Headless --ticks 1000 --boids 500 --obstacles monkey.obj,uv_sphere.obj
+    python -m Headless --ticks 1000 --validate-precision    # how far float32 drifts from float64
+    python -m Headless --ticks 100 --validate-backend       # check the numba kernels against NumPy
+"""
+
+# how far apart (as a ratio of edge length) the two backends' boids can be and still count as the same, by PRECISION
+BACKEND_TOLERANCE = {64: 1e-9, 32: 1e-4}
+
+# boids in each predator swarm
+PREDATOR_BOIDS = 3
+
+# same bounding box as SwarmMain
+CUBE_MIN = array([10, 50, 7, 0, 0])
+EDGE_LENGTH = 40
+
+
+def make_specs(num_boids=13, num_attractors=6, num_followers=0, follower_boids=None, edge_length=EDGE_LENGTH,
+               num_predators=0, predator_boids=PREDATOR_BOIDS, obstacle_models=()):
+    """
+    Describe a lead swarm and its stigmergy followers, all in the same cube
+    :param num_boids:      int   boids in the lead swarm
+    :param num_attractors: int   attractors in the lead swarm
+    :param num_followers:  int   follower swarms that use the lead boids as attractors
+    :param follower_boids: int   boids in each follower swarm (defaults to num_boids)
+    :param edge_length:    float edge length of the bounding cube
+    :param num_predators:  int   predator swarms that chase the lead boids (which flee from them)
+    :param predator_boids: int   boids in each predator swarm
+    :param obstacle_models: list of str obj files to put in the cube as obstacles (spread along its x axis)
+    :return: list of SwarmSpec, lead swarm first
+    """
+    if follower_boids is None:
+        follower_boids = num_boids
+    # any dimensions beyond the usual five start at 0
+    cube_min = zeros(Swarm.DIMS)
+    shared = min(len(CUBE_MIN), Swarm.DIMS)
+    cube_min[:shared] = CUBE_MIN[:shared]
+    obstacles = spread_meshes(cube_min, edge_length, obstacle_models) if obstacle_models else None
+    cube = Swarm.Cube(cube_min, edge_length, obstacles)
+    specs = [SwarmSpec(num_boids, cube, num_attractors)]
+    for _ in range(num_followers):
+        specs.append(SwarmSpec(follower_boids, cube, follow=num_boids))
+    for _ in range(num_predators):
+        specs.append(SwarmSpec(predator_boids, cube, hunts=0))
+    return specs
+
+
+def make_swarms(*args, **kwargs):
+    """
+    Build a lead swarm and its stigmergy followers (same arguments as make_specs)
+    :return: list of Swarm, lead swarm first
+    """
+    return build_swarms(make_specs(*args, **kwargs))
+
+
+class Runner(object):
+    """
+    Steps a world of swarms with no rendering
+    Every tick stands for 1/UPDATE_RATE seconds of simulated time, however long it takes to compute
+    """
+    def __init__(self, swarms, step=Swarm.step_world):
+        """
+        :param swarms: list of Swarm (or proxies), lead swarm first
+        :param step: function that steps them all by one tick
+        """
+        self.swarms = swarms
+        self.step_swarms = step
+        self.ticks = 0
+        self.elapsed = 0.0  # wall-clock seconds spent stepping
+
+    def step(self):
+        """ advance the world by one tick """
+        start = perf_counter()
+        self.step_swarms(self.swarms)
+        self.elapsed += perf_counter() - start
+        self.ticks += 1
+
+    def run(self, ticks=None, seconds=None):
+        """
+        Step as fast as possible until either limit is reached
+        :param ticks:   int   number of ticks to run for
+        :param seconds: float wall-clock seconds to run for
+        """
+        if ticks is None and seconds is None:
+            raise ValueError("give a number of ticks or seconds to run for")
+        end_tick = self.ticks + ticks if ticks is not None else None
+        deadline = perf_counter() + seconds if seconds is not None else None
+        while True:
+            if end_tick is not None and self.ticks >= end_tick:
+                break
+            if deadline is not None and perf_counter() >= deadline:
+                break
+            self.step()
+
+    @property
+    def ticks_per_second(self):
+        return self.ticks / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        """
+        :return: str summary of the run so far
+        """
+        lines = ["{0} ticks in {1:.3f}s: {2:.1f} ticks/s ({3:.1f}x real time at {4} Hz)".format(
+            self.ticks, self.elapsed, self.ticks_per_second, self.ticks_per_second / DP.UPDATE_RATE, DP.UPDATE_RATE)]
+        for i, swarm in enumerate(self.swarms):
+            if isinstance(swarm, Swarm.Predators):
+                lines.append("  swarm {0}: {1}".format(i, swarm))
+                continue
+            # swarms in worker processes keep their counters to themselves
+            counters = [str(getattr(swarm, key)) for key in ('neighbours', 'tiles', 'attractor_index') if hasattr(swarm, key)]
+            if hasattr(swarm, 'describe'):
+                counters.insert(0, swarm.describe())
+            lines.append("  swarm {0}: {1} boids, {2} attractors, {3}".format(
+                i, swarm.num_boids, swarm.num_attractors, ", ".join(counters) or "in a worker process"))
+        return "\n".join(lines)
+
+
+def note_values(swarms):
+    """
+    :return: array of the 7-bit (0-127) values the interpreters would get from every boid's position
+    """
+    return concatenate([(swarm.get_loc_ratios() * 128).astype(int).ravel() for swarm in swarms])
+
+
+def validate_precision(build, ticks, seed):
+    """
+    Run the same world in float64 and float32 side by side (with the same random streams)
+    and see how far apart their note values end up
+    :param build: function that makes the list of swarms
+    :param ticks: int   how many ticks to run for
+    :param seed:  int
+    :return: (float64 Runner, float32 Runner, list of (proportion of values that differ, largest difference) per tick)
+    """
+    old_precision = SP.PRECISION
+    runners = []
+    for precision in (64, 32):
+        SP.PRECISION = precision
+        Swarm.seed_streams(seed)
+        runners.append(Runner(build()))
+    SP.PRECISION = old_precision
+
+    divergence = []
+    for _ in range(ticks):
+        for runner in runners:
+            runner.step()
+        diff = np_abs(note_values(runners[0].swarms) - note_values(runners[1].swarms))
+        divergence.append(((diff > 0).mean() if len(diff) else 0.0, diff.max(initial=0)))
+    return runners[0], runners[1], divergence
+
+
+def precision_report(double, single, divergence):
+    """
+    :return: str summary of validate_precision
+    """
+    lines = ["float64: {0:.1f} ticks/s, float32: {1:.1f} ticks/s".format(
+        double.ticks_per_second, single.ticks_per_second)]
+    first = next((tick for tick, (differ, _) in enumerate(divergence, 1) if differ), None)
+    lines.append("note values first differ at tick {0}".format(first) if first else "note values never differ")
+    if divergence:
+        lines.append("{0} of {1} ticks differ, {2:.2%} of values on average".format(
+            sum(1 for differ, _ in divergence if differ), len(divergence),
+            sum(differ for differ, _ in divergence) / len(divergence)))
+    lines.append("{0:>8} {1:>10} {2:>9}".format("tick", "differing", "max diff"))
+    tick = 1
+    while tick <= len(divergence):
+        differ, largest = divergence[tick - 1]
+        lines.append("{0:>8} {1:>10.2%} {2:>9}".format(tick, differ, largest))
+        tick *= 10
+    if len(divergence) and tick // 10 != len(divergence):
+        differ, largest = divergence[-1]
+        lines.append("{0:>8} {1:>10.2%} {2:>9}".format(len(divergence), differ, largest))
+    return "\n".join(lines)
+
+
+def validate_backend(build, ticks, seed):
+    """
+    Run the same world through the NumPy engine and the compiled kernels side by side (with the same random streams)
+    They add things up in a different order, so only agree to within rounding (which can grow over many ticks)
+    :param build: function that makes the list of swarms
+    :param ticks: int   how many ticks to run for
+    :param seed:  int
+    :return: (NumPy Runner, numba Runner, list of the largest difference in any boid's location per tick,
+              as a ratio of the edge length)
+    """
+    old_jit = SP.JIT
+    runners = []
+    for jit in (0, 1):
+        SP.JIT = jit
+        Swarm.seed_streams(seed)
+        runners.append(Runner(build()))
+
+    divergence = []
+    try:
+        for _ in range(ticks):
+            for jit, runner in enumerate(runners):
+                SP.JIT = jit
+                runner.step()
+            divergence.append(max((np_abs(numpy_swarm.locations - jit_swarm.locations).max(initial=0)
+                                   / numpy_swarm.cube.edge_length
+                                   for numpy_swarm, jit_swarm in zip(*(runner.swarms for runner in runners))),
+                                  default=0.0))
+    finally:
+        SP.JIT = old_jit
+    return runners[0], runners[1], divergence
+
+
+def backend_report(numpy_runner, jit_runner, divergence, tolerance=None):
+    """
+    :param tolerance: float largest difference that counts as the same (defaults to BACKEND_TOLERANCE for PRECISION)
+    :return: str summary of validate_backend
+    """
+    if tolerance is None:
+        tolerance = BACKEND_TOLERANCE[SP.PRECISION]
+    lines = ["NumPy: {0:.1f} ticks/s, numba: {1:.1f} ticks/s".format(
+        numpy_runner.ticks_per_second, jit_runner.ticks_per_second)]
+    first = next((tick for tick, diff in enumerate(divergence, 1) if diff > tolerance), None)
+    lines.append("largest difference in any location: {0:.3g} of the edge length".format(max(divergence, default=0.0)))
+    lines.append("first beyond {0:g} at tick {1}".format(tolerance, first) if first else
+                 "within {0:g} throughout".format(tolerance))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the swarm simulation headless and report ticks per second")
+    limit = parser.add_mutually_exclusive_group(required=True)
+    limit.add_argument('--ticks', type=int, help="number of ticks to run for")
+    limit.add_argument('--seconds', type=float, help="wall-clock seconds to run for")
+    parser.add_argument('--boids', type=int, default=13, help="boids in the lead swarm")
+    parser.add_argument('--attractors', type=int, default=6, help="attractors in the lead swarm")
+    parser.add_argument('--followers', type=int, default=0, help="stigmergy follower swarms")
+    parser.add_argument('--follower-boids', type=int, default=None, help="boids in each follower swarm")
+    parser.add_argument('--edge', type=float, default=EDGE_LENGTH, help="edge length of the bounding cube")
+    parser.add_argument('--predators', type=int, default=0, help="predator swarms chasing the lead swarm")
+    parser.add_argument('--predator-boids', type=int, default=PREDATOR_BOIDS, help="boids in each predator swarm")
+    parser.add_argument('--obstacles', type=lambda text: text.split(','), default=[],
+                        help="comma separated obj files (from obj) to put in the cube as obstacles")
+    parser.add_argument('--config', default='config.ini', help="config file to load parameters from")
+    parser.add_argument('--seed', type=int, default=None, help="random seed (overrides RANDOM_SEED)")
+    parser.add_argument('--workers', type=int, default=None, help="processes to step the swarms in (overrides WORKERS)")
+    parser.add_argument('--slabs', type=int, default=None,
+                        help="processes to split the lead swarm between (overrides SLAB_WORKERS)")
+    parser.add_argument('--precision', type=int, choices=(32, 64), default=None, help="overrides PRECISION")
+    parser.add_argument('--validate-precision', action='store_true',
+                        help="run float64 and float32 side by side and compare their note values")
+    parser.add_argument('--jit', type=int, choices=(0, 1), default=None, help="overrides JIT")
+    parser.add_argument('--validate-backend', action='store_true',
+                        help="run the NumPy engine and the numba kernels side by side and compare their boids")
+    args = parser.parse_args(argv)
+
+    load_config(args.config)
+    if args.seed is not None:
+        SP.RANDOM_SEED = args.seed
+    Swarm.seed_streams()
+    print("Random seed: {0}".format(SP.RANDOM_SEED))
+
+    if args.precision is not None:
+        SP.PRECISION = args.precision
+    if args.workers is not None:
+        SP.WORKERS = args.workers
+    if args.slabs is not None:
+        SP.SLAB_WORKERS = args.slabs
+    if args.jit is not None:
+        SP.JIT = args.jit
+    print(JitKernels.describe())
+    specs = make_specs(args.boids, args.attractors, args.followers, args.follower_boids, args.edge,
+                       args.predators, args.predator_boids, args.obstacles)
+    if specs[0].cube.field is not None:
+        print(specs[0].cube.field)
+
+    def build():
+        return build_swarms(specs)
+
+    if args.validate_precision:
+        if args.ticks is None:
+            parser.error("--validate-precision needs --ticks")
+        double, single, divergence = validate_precision(build, args.ticks, SP.RANDOM_SEED)
+        print(precision_report(double, single, divergence))
+        return double, single
+
+    if args.validate_backend:
+        if args.ticks is None:
+            parser.error("--validate-backend needs --ticks")
+        if JitKernels.numba is None:
+            parser.error("--validate-backend needs numba to be installed")
+        numpy_runner, jit_runner, divergence = validate_backend(build, args.ticks, SP.RANDOM_SEED)
+        print(backend_report(numpy_runner, jit_runner, divergence))
+        return numpy_runner, jit_runner
+
+    if SP.WORKERS and args.predators:
+        parser.error("--predators need every swarm in the same process (no --workers)")
+    if SP.WORKERS:
+        with SwarmPool(specs, SP.WORKERS) as pool:
+            print(pool)
+            runner = Runner(pool.swarms, pool.step)
+            runner.run(ticks=args.ticks, seconds=args.seconds)
+            print(runner.report())
+        return runner
+
+    runner = Runner(build())
+    if SP.SLAB_WORKERS:
+        with SlabPool(runner.swarms[0], SP.SLAB_WORKERS) as pool:
+            runner.run(ticks=args.ticks, seconds=args.seconds)
+            print(pool)
+    else:
+        runner.run(ticks=args.ticks, seconds=args.seconds)
+    print(runner.report())
+    return runner
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ import csv
 from Parameters import IP, SP
 import Scales
 import Instruments
-import random
+from Swarm import spawn_rng
 from heapq import (heappush, heappop)
 from rtmidi.midiconstants import (ALL_SOUND_OFF, BANK_SELECT_MSB, CONTROL_CHANGE,
                                   NOTE_ON, NOTE_OFF, PROGRAM_CHANGE, PAN)
@@ -17,15 +17,14 @@ from rtmidi.midiconstants import (ALL_SOUND_OFF, BANK_SELECT_MSB, CONTROL_CHANGE
 
 # FIXME in interactive mode, recorded midis tend to have a long period of silence at the end
 
-# TODO TEMP
-# random.seed(SP.RANDOM_SEED)
-
 dynam_axis = 0
 pitch_axis = 1
 time_axis = 2
 length_axis = 3
 pan_axis = 4
-vel_axis = -1  # velocity data sits at the end
+vel_axis = -1  # velocity data sits at the end (the last dimension's, as a fraction of max speed)
+
+CHANCE_BUFFER = 1024  # how many random numbers an interpreter draws at once
 
 
 class PolyInterpreter(threading.Thread):
@@ -86,6 +85,11 @@ class PolyInterpreter(threading.Thread):
             i = Instruments.insts["RHODES EP"][1]
             self.send_midi([PROGRAM_CHANGE | self.human_channel, i & 0x7F])  # set input sound
 
+        # own random stream, drawn from in bulk
+        self.rng = spawn_rng()
+        self.chances = self.rng.random(CHANCE_BUFFER)
+        self.chance_index = 0
+
         self.activate_instrument()
 
         self.done = False
@@ -203,9 +207,19 @@ class PolyInterpreter(threading.Thread):
         :param vol: 0-127 volume
         :param duration: time until midi event ends (optional)
         """
-        if random.random() < self.probability:
+        if self.chance() < self.probability:
             self.send_midi([self.note_on, pitch, vol], duration=duration)
 
+    def chance(self):
+        """
+        :return: the next random number between 0 and 1 from this interpreter's stream
+        """
+        if self.chance_index == CHANCE_BUFFER:
+            self.chances = self.rng.random(CHANCE_BUFFER)
+            self.chance_index = 0
+        self.chance_index += 1
+        return self.chances[self.chance_index - 1]
+
     def stop_note(self, pitch):
         """ stop a note playing """
         if self.do_note_offs:
@@ -403,10 +417,26 @@ class PolyInterpreter(threading.Thread):
 
     def setup_priority_queue(self, boid_heap, time_elapsed):
         """ Initialise a queue with the sound agents we will use """
-        for boid in self.swarm.boids:
-            next_data = self.interpret(boid.get_loc_ratios())
+        self.scheduled = set()  # ids of the boids in the queue
+        self.population = None
+        self.schedule_spawned(boid_heap, time_elapsed)
+
+    def schedule_spawned(self, boid_heap, time_elapsed):
+        """ Add any boids that have joined the swarm since last time to the queue """
+        # boids are read from the swarm's latest snapshot, never from the live swarm the renderer is stepping
+        if self.swarm.snapshots.population() == self.population:
+            return
+        self.population, alive = self.swarm.snapshots.alive()
+        for boid in alive:
+            if boid in self.scheduled:
+                continue
+            state = self.swarm.snapshots.boid(boid)
+            if state is None:
+                continue  # gone again already
+            next_data = self.interpret(state[0])
             heappush(boid_heap, (time_elapsed + next_data[length_axis], (self.EVENT_OFF, next_data, boid)))
             heappush(boid_heap, (time_elapsed + next_data[time_axis], (self.EVENT_START, next_data, boid)))
+            self.scheduled.add(boid)
 
     def parse_priority_queue(self, boid_heap, time_elapsed):
         """ Parse the data from the head of the queue """
@@ -417,8 +447,14 @@ class PolyInterpreter(threading.Thread):
             self.stop_note(data[pitch_axis])
         elif tag == self.EVENT_START:
             # interpret next data
-            next_data = self.interpret(boid.get_loc_ratios())
-            if boid.feeding or not SP.FEEDING:
+            state = self.swarm.snapshots.boid(boid)
+            if state is None:
+                # the boid has left the swarm, so stops playing
+                self.scheduled.discard(boid)
+                return
+            ratios, feeding = state
+            next_data = self.interpret(ratios)
+            if feeding or not SP.FEEDING:
                 self.pan_note(data[pan_axis])
                 self.play_note(data[pitch_axis], data[dynam_axis], duration=data[length_axis])
             # schedule next events
@@ -444,7 +480,8 @@ class PolyInterpreter(threading.Thread):
 
             time_this_loop = timenow()
 
-            while boid_heap[0][0] <= self.time_elapsed:
+            self.schedule_spawned(boid_heap, self.time_elapsed)
+            while boid_heap and boid_heap[0][0] <= self.time_elapsed:
                 self.parse_priority_queue(boid_heap, self.time_elapsed)
 
             time_this_loop = timenow() - time_this_loop
@@ -473,14 +510,18 @@ class MonoInterpreter(PolyInterpreter):
 
     def setup_priority_queue(self, boid_heap, time_elapsed):
         """ Initialise a queue with the sound agents we will use """
-        com = self.swarm.get_COM()
-        data = self.interpret(com.get_loc_ratios())
+        com = 0  # the centre of mass is read from the swarm's latest snapshot
+        data = self.interpret(self.swarm.snapshots.centre())
         self.pan_note(data[pan_axis])
         self.play_note(data[pitch_axis], data[dynam_axis], duration=data[length_axis])
         # self.send_midi([self.note_on, data[pitch_axis], data[dynam_axis]])
         heappush(boid_heap, (time_elapsed + data[length_axis], (self.EVENT_OFF, data, com)))
         heappush(boid_heap, (time_elapsed + data[time_axis], (self.EVENT_START, data, com)))
 
+    def schedule_spawned(self, boid_heap, time_elapsed):
+        """ (only the centre of mass is played, however many boids there are) """
+        pass
+
     def parse_priority_queue(self, boid_heap, time_elapsed):
         """ Parse the data from the head of the queue """
         tag, data, com = heappop(boid_heap)[1]
@@ -491,7 +532,7 @@ class MonoInterpreter(PolyInterpreter):
             pass
         elif tag == self.EVENT_START:
             # interpret next data
-            next_data = self.interpret(com.get_loc_ratios())
+            next_data = self.interpret(self.swarm.snapshots.centre())
             self.pan_note(data[pan_axis])
             self.play_note(data[pitch_axis], data[dynam_axis], duration=data[length_axis])
             # schedule next events
@@ -525,10 +566,10 @@ class RandomNotes(PolyInterpreter):
             time_this_loop = timenow()
 
             # random chance to add a new event
-            if random.random() < chance:
-                note = random.randrange(0, 127)
-                length = random.random() * 2
-                volume = random.randrange(0, 127)
+            if self.chance() < chance:
+                note = int(self.rng.integers(0, 127))
+                length = self.chance() * 2
+                volume = int(self.rng.integers(0, 127))
                 # print(note)
                 self.send_midi([self.note_on, note, volume], duration=length)
                 heappush(priority_queue, (self.time_elapsed + length, (note, length)))
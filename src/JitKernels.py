@@ -0,0 +1,101 @@
+"""
+Compiled kernel for the swarming rules, used when numba is installed (and SP.JIT is on)
+One pass over every pair of boids works out all of the rules' sums at once, like the old Cython loop did,
+without building any pair lists or distance matrices
+Without numba the rules go through the NumPy engine (Neighbours) instead
+"""
+
+from numpy import array, zeros, int64
+
+from Parameters import SP
+
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:
+    numba = None
+    prange = range
+
+# backends (see backend())
+NUMPY = 'numpy'
+NUMBA = 'numba'
+
+# what a rule sums over the boids in its neighbourhood (Rule.kernel)
+SEPARATE = 0        # inverse square repulsion from each of them
+LOCATIONS = 1       # their locations
+VELOCITIES = 2      # their velocities
+
+
+def rule_sums(locations, velocities, sq_radii, kinds, change, num):
+    """
+    Add every rule's sum and count over each boid's neighbours to change and num
+    Each boid goes through every other boid itself (rather than each pair once) so the boids can run in parallel
+    :param locations: (N, DIMS) array
+    :param velocities: (N, DIMS) array
+    :param sq_radii: (R,) array of each rule's neighbourhood, squared
+    :param kinds: (R,) array of what each rule sums (SEPARATE, LOCATIONS or VELOCITIES)
+    :param change: (R, N, DIMS) array to add the sums to
+    :param num: (R, N) array to add the counts to
+    """
+    num_boids, dims = locations.shape
+    for i in prange(num_boids):
+        for j in range(num_boids):
+            if i == j:
+                continue
+            sq_dist = 0.0
+            for d in range(dims):
+                diff = locations[i, d] - locations[j, d]
+                sq_dist += diff * diff
+            for r in range(len(kinds)):
+                if sq_dist >= sq_radii[r]:
+                    continue
+                num[r, i] += 1
+                if kinds[r] == SEPARATE:
+                    # boids on top of each other count but don't push
+                    if sq_dist > 0:
+                        for d in range(dims):
+                            change[r, i, d] += (locations[i, d] - locations[j, d]) / sq_dist
+                elif kinds[r] == LOCATIONS:
+                    for d in range(dims):
+                        change[r, i, d] += locations[j, d]
+                else:
+                    for d in range(dims):
+                        change[r, i, d] += velocities[j, d]
+
+
+if numba is not None:
+    rule_sums = njit(parallel=True, cache=True)(rule_sums)
+
+
+def backend():
+    """
+    :return: which backend the rules are run on (NUMBA if it is installed and SP.JIT is on, otherwise NUMPY)
+    """
+    return NUMBA if numba is not None and SP.JIT else NUMPY
+
+
+def describe():
+    """
+    :return: str for reporting the backend at startup
+    """
+    if backend() == NUMBA:
+        return "Rule kernels: numba {0} (JIT)".format(numba.__version__)
+    reason = "numba is not installed" if numba is None else "JIT is off"
+    return "Rule kernels: NumPy ({0})".format(reason)
+
+
+def accumulate(swarm, rules):
+    """
+    Fill every rule's aggregators for the whole swarm with one call to the compiled kernel
+    :param swarm: Swarm
+    :param rules: list of Rule (each with a kernel)
+    """
+    locations = swarm.locations
+    change = zeros((len(rules),) + locations.shape, dtype=locations.dtype)
+    num = zeros((len(rules), len(locations)), dtype=locations.dtype)
+    sq_radii = array([rule.radius(swarm)**2 for rule in rules], dtype=locations.dtype)
+    kinds = array([rule.kernel for rule in rules], dtype=int64)
+    rule_sums(locations, swarm.velocities, sq_radii, kinds, change, num)
+    for r, rule in enumerate(rules):
+        rule.change += change[r]
+        rule.num += num[r]
@@ -0,0 +1,627 @@
+"""
+Neighbour search for the swarming rules
+Finds every pair of boids within a radius of each other, either by brute force or with a spatial hash
+(or, for big or crowded swarms, goes through the distance matrix a tile at a time instead of listing pairs)
+"""
+
+from itertools import product
+from math import ceil
+from numpy import (array, arange, argsort, argpartition, take_along_axis, broadcast_to, cumsum, einsum, empty,
+                   empty_like, floor, repeat, searchsorted, unique, clip, nonzero, triu, fill_diagonal, maximum, minimum,
+                   sqrt, zeros, ones, full, flatnonzero, inf, int64)
+
+from Parameters import SP
+
+# neighbourhoods (SP.RULE_MODE)
+METRIC = 0          # every boid within a radius
+TOPOLOGICAL = 1     # the k nearest boids
+
+# ways of finding neighbours (SP.NEIGHBOUR_SEARCH)
+AUTO = 0
+BRUTE_FORCE = 1
+SPATIAL_HASH = 2
+TILED = 3
+SEARCH_NAMES = {BRUTE_FORCE: "brute force", SPATIAL_HASH: "spatial hash", TILED: "dense tiles"}
+
+# rough costs of the spatial hash in terms of brute-force pairs (found by timing the two against each other)
+CANDIDATE_COST = 3      # each pair of boids in adjacent cells (gathered rather than a matrix product)
+CELL_OVERHEAD = 2       # each adjacent cell it has to look up
+
+
+# above this proportion of pairs being neighbours, summing over dense tiles beats gathering every pair
+DENSE_PAIRS = 0.05
+# memory needed for each neighbouring pair on its way through the rules (indices, distance, gathered rows and
+# the scatter, measured at about 230 bytes for Separation in 5 dimensions)
+PAIR_BYTES = 256
+# arrays the size of a tile that are alive at once (distances, masks and weights)
+TILE_ARRAYS = 4
+
+# fewest attractors it is worth indexing rather than checking every one
+ATTRACTOR_INDEX_MIN = 1024
+# extra attractors the index keeps for each boid beyond the ones it pays attention to
+ATTRACTOR_SPARES = 6
+# proportion of the attractors, the ones that moved furthest in a tick, that are measured against every boid
+# rather than bounded (so it costs at most this much of checking every attractor)
+ATTRACTOR_JUMPS = 1 / 16
+# if more than this proportion of boids need looking up again, the attractors are moving too fast to bother
+ATTRACTOR_STALE_MAX = 0.25
+# ticks to wait before trying again
+ATTRACTOR_INDEX_REST = 30
+
+# most neighbours worth picking one at a time rather than with a partial sort
+FEW = 3
+
+# most distances to work out at once when going through the distance matrix a block of rows at a time
+BLOCK_SIZE = 1 << 22
+
+
+def cross_sq_distances(points, others, centre=None):
+    """
+    Squared distance between every point and every other point, in a single broadcast (and one matrix product)
+    (the rules only ever compare against a radius or divide by distance squared, so no sqrt is needed)
+    :param points: (N, DIMS) array
+    :param others: (M, DIMS) array
+    :param centre: somewhere near all the points (found if not given)
+    :return: (N, M) array
+    """
+    # |a - b|^2 = |a|^2 + |b|^2 - 2a.b, centred first so the subtraction doesn't lose precision
+    if centre is None:
+        centre = others.mean(axis=0)
+    points, others = points - centre, others - centre
+    sq_dists = einsum('ij,ij->i', points, points)[:, None] + einsum('ij,ij->i', others, others)[None, :]
+    sq_dists -= 2 * (points @ others.T)
+    return maximum(sq_dists, 0, out=sq_dists)
+
+
+def sq_distances(points):
+    """
+    Squared distance between every pair of points
+    :param points: (N, DIMS) array
+    :return: (N, N) symmetric array
+    """
+    sq_dists = cross_sq_distances(points, points)
+    fill_diagonal(sq_dists, 0)
+    return sq_dists
+
+
+def pair_sq_distances(points, i, j):
+    """
+    :return: squared distance between points[i] and points[j] for each pair (i, j)
+    """
+    diff = points[i] - points[j]
+    return einsum('ij,ij->i', diff, diff)
+
+
+def nearest_between(points, others, k, centre=None):
+    """
+    The k nearest of others to each point, by brute force
+    :param points: (N, DIMS) array
+    :param others: (M, DIMS) array (M >= k)
+    :param k: int
+    :return: ((N, k) indices into others, (N, k) squared distances), in no particular order
+    """
+    if k >= len(others):
+        indices = broadcast_to(arange(len(others)), (len(points), len(others)))
+    else:
+        # |p - o|^2 = |p|^2 + |o|^2 - 2p.o, but |p|^2 is the same along each row so it can't change the order
+        if centre is None:
+            centre = others.mean(axis=0)
+        points, others_c = points - centre, others - centre
+        score = points @ others_c.T
+        score *= -2
+        score += einsum('ij,ij->i', others_c, others_c)[None, :]
+        if k <= FEW:
+            # picking the smallest a few times over is much quicker than partitioning every row
+            rows = arange(len(points))
+            indices = empty((len(points), k), dtype=int64)
+            for n in range(k):
+                indices[:, n] = score.argmin(axis=1)
+                score[rows, indices[:, n]] = inf
+        else:
+            indices = argpartition(score, k - 1, axis=1)[:, :k]
+        points = points + centre
+    # exact distances for the ones that were picked
+    diff = others[indices] - points[:, None, :]
+    return indices, einsum('ijk,ijk->ij', diff, diff)
+
+
+def nearest(locations, k, num_rows=None):
+    """
+    Topological neighbours: the k nearest other boids to each boid, however far away they are
+    Uses a partial sort of each row of the distance matrix (a block of rows at a time), never a full sort
+    :param locations: (N, DIMS) array
+    :param k: int   number of neighbours
+    :param num_rows: int    only find them for the first this many boids (defaults to all of them)
+    :return: ((N, k) indices, (N, k) squared distances) of each boid's neighbours, in no particular order
+    """
+    num_boids = len(locations)
+    if num_rows is None:
+        num_rows = num_boids
+    k = min(k, num_boids - 1)
+    indices = empty((num_rows, k), dtype=int64)
+    if k <= 0:
+        return indices, empty((num_rows, k), dtype=locations.dtype)
+
+    centre = locations.mean(axis=0)
+    rows = max(1, BLOCK_SIZE // num_boids)
+    for start in range(0, num_rows, rows):
+        stop = min(start + rows, num_rows)
+        block = cross_sq_distances(locations[start:stop], locations, centre)
+        block[arange(stop - start), arange(start, stop)] = inf  # nobody is their own neighbour
+        indices[start:stop] = argpartition(block, k - 1, axis=1)[:, :k]
+    # exact distances for the ones that were picked
+    diff = locations[indices] - locations[:num_rows, None, :]
+    sq_dists = einsum('ijk,ijk->ij', diff, diff)
+    return indices, sq_dists
+
+
+class BruteForce(object):
+    """
+    Check every boid against every other boid
+    Best for small swarms, where the spatial hash costs more than it saves
+    """
+
+    @staticmethod
+    def pairs(locations, radius):
+        """
+        :param locations: (N, DIMS) array
+        :param radius: float    neighbourhood to search
+        :return: (i, j, sq_dist) arrays of every pair of boids within radius of each other (each pair once, i < j)
+        """
+        sq_dists = sq_distances(locations)
+        # only the upper triangle, so each pair comes up once (and nobody is paired with themselves)
+        i, j = nonzero(triu(sq_dists < radius**2, 1))
+        # worked out again directly, as the matrix loses precision for very close pairs, especially in float32
+        return i, j, pair_sq_distances(locations, i, j)
+
+
+class SpatialHash(object):
+    """
+    Uniform grid of cells (at least) the size of the search radius, so neighbours can only be in adjacent cells
+    Works in any number of dimensions, but there are 3^DIMS adjacent cells to look at (well, half that)
+    """
+
+    def __init__(self, cube, cell_size, dims):
+        """
+        :param cube: Cube           bounding box to lay the grid over
+        :param cell_size: float     edge length of each cell (the largest radius that can be searched)
+        :param dims: int            number of dimensions
+        """
+        self.cube = cube
+        self.cell_size = cell_size
+        self.dims = dims
+        self.cells_per_dim = int(ceil(cube.edge_length / cell_size))
+
+        # boids that stray outside the cube are piled into an extra layer of cells around it,
+        # and there is one more layer of empty cells outside that so that adjacent keys never wrap around
+        side = self.cells_per_dim + 4
+        self.strides = array([side**d for d in range(dims)], dtype=int64)
+        # only half the adjacent cells are needed: if cell b is ahead of cell a then a is behind b,
+        # so every pair of cells is only looked at once (pairs within a cell are halved separately)
+        offsets = array(list(product((-1, 0, 1), repeat=dims)), dtype=int64) @ self.strides
+        self.offsets = offsets[offsets >= 0]
+
+        self.keys = None    # cell key of each boid
+        self.order = None   # boid indices sorted by cell key
+        self.cell_keys = self.cell_starts = self.cell_counts = None
+
+    def __repr__(self):
+        return "Spatial hash with {0}^{1} cells of size {2}".format(self.cells_per_dim, self.dims, self.cell_size)
+
+    def cell_coords(self, locations):
+        """
+        :return: (N, DIMS) integer coordinates of the cell each location falls in (including the padding)
+        """
+        coords = floor((locations - self.cube.v_min) / self.cell_size).astype(int64) + 2
+        return clip(coords, 1, self.cells_per_dim + 2)
+
+    def rebuild(self, locations):
+        """
+        Re-bin every boid
+        Boids rarely change cell between ticks, so the last order is only nudged back into place
+        """
+        keys = self.cell_coords(locations) @ self.strides
+        if self.order is None or len(self.order) != len(keys):
+            self.order = argsort(keys, kind='stable')
+        elif (keys != self.keys).any():
+            # the last order is almost sorted, which the stable sort is very quick at
+            self.order = self.order[argsort(keys[self.order], kind='stable')]
+        else:
+            return  # nobody has changed cell
+        self.keys = keys
+        self.cell_keys, self.cell_starts, self.cell_counts = unique(keys[self.order], return_index=True,
+                                                                    return_counts=True)
+
+    def pairs(self, locations, radius):
+        """
+        :param locations: (N, DIMS) array
+        :param radius: float    neighbourhood to search (no bigger than the cell size)
+        :return: (i, j, sq_dist) arrays of every pair of boids within radius of each other (each pair once, i < j)
+        """
+        self.rebuild(locations)
+
+        # look up every (occupied cell, adjacent cell) combination at once
+        neighbour_keys = (self.cell_keys[:, None] + self.offsets[None, :]).ravel()
+        found = searchsorted(self.cell_keys, neighbour_keys)
+        found[found == len(self.cell_keys)] = 0
+        hit = self.cell_keys[found] == neighbour_keys
+        cell_a = repeat(arange(len(self.cell_keys)), len(self.offsets))[hit]
+        cell_b = found[hit]
+
+        # every boid in cell a paired with every boid in cell b
+        count_a, count_b = self.cell_counts[cell_a], self.cell_counts[cell_b]
+        sizes = count_a * count_b
+        combo = repeat(arange(len(sizes)), sizes)
+        local = arange(sizes.sum()) - repeat(cumsum(sizes) - sizes, sizes)
+        i = self.order[self.cell_starts[cell_a][combo] + local // count_b[combo]]
+        j = self.order[self.cell_starts[cell_b][combo] + local % count_b[combo]]
+
+        sq_dists = pair_sq_distances(locations, i, j)
+        near = (sq_dists < radius**2) & ((cell_a != cell_b)[combo] | (i < j))
+        i, j = i[near], j[near]
+        # keep i < j for pairs across cells too
+        swap = i > j
+        i[swap], j[swap] = j[swap], i[swap]
+        return i, j, sq_dists[near]
+
+
+class NeighbourSearch(object):
+    """
+    Finds every pair of boids within a radius for one swarm
+    Switches between brute force and a spatial hash depending on which should be cheaper
+    """
+
+    def __init__(self, cube):
+        """
+        :param cube: Cube   bounding box of the swarm
+        """
+        self.cube = cube
+        self.brute_force = BruteForce()
+        self.spatial_hash = None
+        self.method = None
+
+    def __repr__(self):
+        return "Neighbour search ({0})".format(SEARCH_NAMES.get(self.method, "not run yet"))
+
+    def forget(self):
+        """ (nothing is kept from one tick to the next) """
+        pass
+
+    def choose(self, num_boids, dims, radius):
+        """
+        The hash needs at least three cells across the cube, and in 5 dimensions it only pays off from about
+        a thousand boids with three cells or a few hundred with four. The widest shipped neighbourhood is 0.3 of
+        the edge and VERLET_SKIN adds 0.1 to it, which leaves 2.5 cells: the hash is only ever picked for smaller
+        neighbourhoods or with the skin turned off
+        :return: which method to use (BRUTE_FORCE or SPATIAL_HASH) for this many boids, dimensions and radius
+        """
+        if SP.NEIGHBOUR_SEARCH != AUTO:
+            return SP.NEIGHBOUR_SEARCH
+        cells_per_dim = self.cube.edge_length / radius
+        if cells_per_dim < 3:
+            return BRUTE_FORCE  # every cell is next to every other cell anyway
+        # pairs the brute force checks vs pairs the hash checks plus its per-cell overhead (assuming an even spread)
+        occupied = min(num_boids, cells_per_dim**dims)
+        adjacent = (3**dims + 1) / 2  # only half of them are looked at
+        hashed = adjacent * (CANDIDATE_COST * num_boids**2 / cells_per_dim**dims + CELL_OVERHEAD * occupied)
+        return SPATIAL_HASH if hashed < num_boids**2 else BRUTE_FORCE
+
+    def pairs(self, locations, radius):
+        """
+        :param locations: (N, DIMS) array
+        :param radius: float    neighbourhood to search
+        :return: (i, j, sq_dist) arrays of every pair of boids within radius of each other (each pair once, i < j)
+        """
+        num_boids, dims = locations.shape
+        self.method = self.choose(num_boids, dims, radius)
+        if self.method == SPATIAL_HASH:
+            if self.spatial_hash is None or self.spatial_hash.cell_size != radius:
+                self.spatial_hash = SpatialHash(self.cube, radius, dims)
+            return self.spatial_hash.pairs(locations, radius)
+        return self.brute_force.pairs(locations, radius)
+
+
+class VerletList(object):
+    """
+    Neighbour pairs found within radius + skin, then reused for as many ticks as possible
+    Two boids can't cross the skin until one of them has moved more than skin/2 relative to the swarm,
+    so until then the only pairs that can be in range are the ones already in the list
+    """
+
+    def __init__(self, search, skin):
+        """
+        :param search: NeighbourSearch  used whenever the list needs rebuilding
+        :param skin: float              extra distance to search beyond the radius
+        """
+        self.search = search
+        self.skin = skin
+        self.i = self.j = None
+        self.built_at = None    # locations at the last rebuild
+        self.radius = None      # radius at the last rebuild
+
+        # instrumentation
+        self.ticks = 0
+        self.rebuilds = 0
+
+    def __repr__(self):
+        return "Verlet list with skin {0} ({1} rebuilds in {2} ticks)".format(self.skin, self.rebuilds, self.ticks)
+
+    @property
+    def method(self):
+        return self.search.method
+
+    def forget(self):
+        """ throw the list away (e.g. when boids have been added or removed, so the rows mean different boids) """
+        self.built_at = None
+
+    def needs_rebuild(self, locations, radius):
+        """
+        :return: whether any pair could have come within radius without being in the list
+        """
+        if self.built_at is None or self.built_at.shape != locations.shape or radius != self.radius:
+            return True
+        # pair distances don't change if the whole swarm moves together, so only movement relative to that counts
+        moved = locations - self.built_at
+        moved -= moved.mean(axis=0)
+        return einsum('ij,ij->i', moved, moved).max() > (self.skin / 2)**2
+
+    def pairs(self, locations, radius):
+        """
+        :param locations: (N, DIMS) array
+        :param radius: float    neighbourhood to search
+        :return: (i, j, sq_dist) arrays of every pair of boids within radius of each other (each pair once, i < j)
+        """
+        self.ticks += 1
+        if self.needs_rebuild(locations, radius):
+            self.i, self.j, _ = self.search.pairs(locations, radius + self.skin)
+            self.built_at = locations.copy()
+            self.radius = radius
+            self.rebuilds += 1
+
+        sq_dists = pair_sq_distances(locations, self.i, self.j)
+        near = sq_dists < radius**2
+        return self.i[near], self.j[near], sq_dists[near]
+
+
+class DenseTiles(object):
+    """
+    Goes through the distance matrix one tile at a time (only the tiles on or above the diagonal, as it is symmetric)
+    The rules sum over every boid in range of a tile with matrix products instead of gathering pairs,
+    which is quicker once a lot of the pairs are neighbours, and memory stays within a budget however many boids there are
+    """
+
+    def __init__(self):
+        self.pair_density = 1.0     # proportion of pairs that were neighbours last tick (assume the worst at first)
+
+        # instrumentation
+        self.ticks = 0
+
+    def __repr__(self):
+        return "Dense tiles ({0} ticks, {1:.1%} of pairs neighbours)".format(self.ticks, self.pair_density)
+
+    @staticmethod
+    def budget():
+        """ :return: how many bytes the pairwise stage can use (SP.TILE_MEMORY) """
+        return SP.TILE_MEMORY * (1 << 20)
+
+    def wanted(self, num_boids, dtype):
+        """
+        In auto mode this is asked before NeighbourSearch.choose, so tiles take precedence over the hash and the
+        Verlet list whenever the swarm was crowded last tick (and on the first tick, before it has been seen)
+        :return: whether to use tiles rather than a list of neighbouring pairs this tick
+        """
+        if SP.NEIGHBOUR_SEARCH != AUTO:
+            return SP.NEIGHBOUR_SEARCH == TILED
+        all_pairs = num_boids * (num_boids - 1) / 2
+        # brute force's matrix or the pair list wouldn't fit
+        too_big = max(num_boids**2 * dtype.itemsize, self.pair_density * all_pairs * PAIR_BYTES) > self.budget()
+        return too_big or self.pair_density > DENSE_PAIRS
+
+    def seen(self, num_pairs, num_boids):
+        """
+        Keep track of how crowded the swarm is
+        :param num_pairs: int   neighbouring pairs found this tick
+        """
+        self.pair_density = num_pairs / max(1, num_boids * (num_boids - 1) / 2)
+
+    def side(self, num_boids, dtype):
+        """
+        Half the budget goes on the tile's own arrays, and the other half on any pairs gathered from it (pair_rows)
+        :return: how many rows and columns go in a tile
+        """
+        return max(1, min(num_boids, int(sqrt(self.budget() / 2 / (TILE_ARRAYS * dtype.itemsize)))))
+
+    def pair_rows(self, num_cols):
+        """
+        :param num_cols: int    columns in the tile
+        :return: how many rows of a tile can have every one of their pairs gathered at once (e.g. by Separation)
+        """
+        return max(1, int(self.budget() / 2 / (PAIR_BYTES * num_cols)))
+
+    def tiles(self, locations, radius, num_rows=None):
+        """
+        :param locations: (N, DIMS) array
+        :param radius: float    neighbourhood of the widest rule
+        :param num_rows: int    only tile the pairs among the first num_rows boids (defaults to all of them)
+        :return: generator of (rows, cols, sq_dists, diagonal), where rows and cols are slices of the boids,
+                 and a diagonal tile has the same rows as columns (so holds each pair twice, but nobody with themselves)
+        """
+        self.ticks += 1
+        num_boids = len(locations) if num_rows is None else num_rows
+        side = self.side(len(locations), locations.dtype)
+        centre = locations.mean(axis=0)
+        num_pairs = 0
+        for start in range(0, num_boids, side):
+            rows = slice(start, min(start + side, num_boids))
+            for other in range(start, num_boids, side):
+                cols = slice(other, min(other + side, num_boids))
+                sq_dists = cross_sq_distances(locations[rows], locations[cols], centre)
+                diagonal = start == other
+                if diagonal:
+                    fill_diagonal(sq_dists, inf)  # nobody is their own neighbour
+                near = int((sq_dists < radius**2).sum())
+                num_pairs += near // 2 if diagonal else near
+                yield rows, cols, sq_dists, diagonal
+        self.seen(num_pairs, num_boids)
+
+    def row_tiles(self, locations, num_rows):
+        """
+        Tiles of the first num_rows rows of the distance matrix against the columns after them
+        e.g. the boids a worker owns against the halo around them, once tiles has been through the pairs among the
+        owned boids, leaving out any pairs of halo boids
+        :param locations: (N, DIMS) array
+        :param num_rows: int
+        :return: generator of (rows, cols, sq_dists), where rows and cols are slices of the boids
+        """
+        num_boids = len(locations)
+        side = self.side(num_boids, locations.dtype)
+        centre = locations.mean(axis=0)
+        for start in range(0, num_rows, side):
+            rows = slice(start, min(start + side, num_rows))
+            for other in range(num_rows, num_boids, side):
+                cols = slice(other, min(other + side, num_boids))
+                yield rows, cols, cross_sq_distances(locations[rows], locations[cols], centre)
+
+
+class AttractorIndex(object):
+    """
+    Each boid's few nearest attractors, kept from one tick to the next
+    A grid or tree prunes very little in 5 dimensions, but attractors and boids don't move far in a tick
+    Every boid keeps k + spares candidates, and a bound on how near any of the other attractors can have come,
+    which starts at its furthest candidate and comes down as the others move:
+    the few that moved furthest in a tick (e.g. the ones just placed, teleported or switched on) are measured
+    exactly, and the rest can only have come as much closer as the largest of their moves
+    Moves are measured relative to how the attractors moved on average, so a follower swarm flying along with its
+    lead boids doesn't use the bound up
+    A boid is only looked up again once its kth nearest candidate is further away than that bound (less how far
+    the boid has moved), so the index never changes the result
+    Attractors are kept track of by slot, so switching some on or off doesn't throw the candidates away
+    """
+
+    def __init__(self, spares=ATTRACTOR_SPARES):
+        """
+        :param spares: int  how many candidates to keep beyond the k that are needed
+        """
+        self.spares = spares
+        self.candidates = None  # each boid's k + spares nearest attractor slots when it was last looked up
+        self.reach = None       # how near any other attractor can be to each boid, before the boid's own move
+        self.anchor = None      # each boid's location when it was last looked up, less the shift by then
+        self.shift = None       # how far the attractors have moved on average since the index was built
+        self.attractors = None  # attractor locations last tick
+        self.active = None      # which of them were active last tick
+        self.resting = 0        # ticks until the index is tried again
+
+        # instrumentation
+        self.lookups = 0    # boids looked up again
+        self.ticks = 0
+
+    def __repr__(self):
+        return "Attractor index ({0} lookups in {1} ticks)".format(self.lookups, self.ticks)
+
+    def forget(self):
+        """ throw the candidates away (e.g. when boids have been added or removed) """
+        self.candidates = None
+
+    def look_up(self, rows, locations, attractors, slots, k):
+        """
+        Find the candidates for some of the boids by brute force
+        :param slots: array of the active attractors' slots
+        """
+        candidates, sq_dists = nearest_between(locations[rows], attractors[slots], k + self.spares)
+        self.candidates[rows] = slots[candidates]
+        # every other attractor is at least as far away as the furthest candidate
+        self.reach[rows] = sqrt(sq_dists.max(axis=1))
+        self.anchor[rows] = locations[rows] - self.shift
+        self.lookups += len(candidates)
+
+    def moved(self, locations):
+        """
+        :return: (N,) how far each boid has moved since it was last looked up, relative to the attractors' shift
+        """
+        moved = locations - self.shift - self.anchor
+        return sqrt(einsum('ij,ij->i', moved, moved))
+
+    def follow(self, locations, attractors, active):
+        """
+        Bring every boid's reach down by however near the attractors that aren't its candidates can have come
+        """
+        kept = active & self.active
+        moved = attractors[kept] - self.attractors[kept]
+        switched_on = active & ~self.active
+        if not moved.any() and not switched_on.any():
+            return
+        shift = moved.mean(axis=0) if len(moved) else 0
+        self.shift += shift
+        moved -= shift
+        steps = zeros(len(attractors), dtype=locations.dtype)
+        steps[kept] = sqrt(einsum('ij,ij->i', moved, moved))
+        # one switched on could have come from anywhere (and one switched off can't come near)
+        steps[switched_on] = inf
+        num_jumped = max(1, int(len(steps) * ATTRACTOR_JUMPS))
+        order = argpartition(steps, len(steps) - num_jumped)
+        jumped, rest = order[-num_jumped:], steps[order[:-num_jumped]].max(initial=0)
+        self.reach -= rest
+        # the ones that moved furthest are measured exactly (unless they are a boid's candidates anyway)
+        jumped = jumped[active[jumped]]
+        if not len(jumped):
+            return
+        sq_dists = cross_sq_distances(locations, attractors[jumped])
+        column = full(len(attractors), -1)
+        column[jumped] = arange(len(jumped))
+        column = column[self.candidates]
+        rows, cols = nonzero(column >= 0)
+        sq_dists[rows, column[rows, cols]] = inf
+        self.reach = minimum(self.reach, sqrt(sq_dists.min(axis=1)) - self.moved(locations))
+
+    def nearest(self, locations, attractors, k, active=None):
+        """
+        The k nearest active attractors to each boid
+        :param locations: (N, DIMS) array of boids
+        :param attractors: (A, DIMS) array of every attractor slot
+        :param k: int
+        :param active: (A,) bool array of which attractors to look at (at least k of them, defaults to all)
+        :return: ((N, k) indices into attractors, (N, k) squared distances), in no particular order
+        """
+        self.ticks += 1
+        if active is None:
+            active = ones(len(attractors), dtype=bool)
+        slots = flatnonzero(active)
+        if len(slots) < max(ATTRACTOR_INDEX_MIN, k + self.spares) or self.resting:
+            self.resting = max(0, self.resting - 1)
+            nearest_atts, sq_dists = nearest_between(locations, attractors[slots], k)
+            return slots[nearest_atts], sq_dists
+
+        fresh = self.candidates is None or self.candidates.shape != (len(locations), k + self.spares) \
+            or self.attractors.shape != attractors.shape
+        if fresh:
+            num_boids = len(locations)
+            self.candidates = empty((num_boids, k + self.spares), dtype=int64)
+            self.reach = empty(num_boids, dtype=locations.dtype)
+            self.anchor = empty_like(locations)
+            self.shift = zeros(locations.shape[1], dtype=locations.dtype)
+            self.look_up(slice(None), locations, attractors, slots, k)
+        else:
+            self.follow(locations, attractors, active)
+
+        # pick the k nearest of the candidates
+        diff = attractors[self.candidates] - locations[:, None, :]
+        sq_dists = einsum('ijk,ijk->ij', diff, diff)
+        sq_dists[~active[self.candidates]] = inf
+        picked = argpartition(sq_dists, k - 1, axis=1)[:, :k]
+        if not fresh:
+            kth = take_along_axis(sq_dists, picked, axis=1).max(axis=1)
+            stale = nonzero(sqrt(kth) > self.reach - self.moved(locations))[0]
+            if len(stale) > ATTRACTOR_STALE_MAX * len(locations):
+                # it'd be quicker to check every attractor for a while
+                self.candidates = None
+                self.resting = ATTRACTOR_INDEX_REST
+                nearest_atts, sq_dists = nearest_between(locations, attractors[slots], k)
+                return slots[nearest_atts], sq_dists
+            if len(stale):
+                self.look_up(stale, locations, attractors, slots, k)
+                diff = attractors[self.candidates[stale]] - locations[stale, None, :]
+                sq_dists[stale] = einsum('ijk,ijk->ij', diff, diff)
+                picked[stale] = argpartition(sq_dists[stale], k - 1, axis=1)[:, :k]
+        self.attractors = attractors.copy()
+        self.active = active.copy()
+        return take_along_axis(self.candidates, picked, axis=1), take_along_axis(sq_dists, picked, axis=1)
@@ -0,0 +1,300 @@
+"""
+Static obstacles inside a cube, that the boids steer around (see Swarm.Avoidance)
+Obstacles are primitives (Sphere, Box) or meshes loaded from the obj files, placed in the first three dimensions
+They are all baked once into a grid of signed distances (negative inside) and their gradients, which is cached on
+disk, so each tick costs one trilinear lookup per boid however many obstacles (or triangles) there are
+"""
+
+import hashlib
+import os
+from numpy import (array, asarray, arange, stack, meshgrid, gradient, minimum, maximum, floor, clip, einsum, sqrt,
+                   arctan2, cross, abs as np_abs, full, zeros, where, nonzero, flatnonzero, take, inf, int64, float64,
+                   load, savez, pi)
+from numpy.linalg import norm
+
+from Parameters import SP
+from Neighbours import cross_sq_distances
+
+OBJ_DIR = 'obj'
+
+# grid points worked out against every triangle of a mesh at once (bounds the memory while baking)
+BLOCK_PAIRS = 1 << 18
+# margin on every cull, so rounding in the distance matrices can't cull the nearest triangle
+CULL_SLACK = 1.001
+
+# where each of the 8 corners of a grid cell is, as offsets in cells (in the same order as ObstacleField.sample)
+CORNERS = array([[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)], dtype=int64)
+
+
+class Sphere(object):
+    """
+    Ball obstacle
+    """
+
+    model = 'uv_sphere.obj'  # radius 1
+
+    def __init__(self, centre, radius):
+        """
+        :param centre: array-like 3 coordinates
+        :param radius: float
+        """
+        self.centre = asarray(centre, dtype=float64)
+        self.radius = float(radius)
+        self.scale = self.radius
+
+    def signed_distance(self, points):
+        """
+        :param points: (N, 3) array
+        :return: (N,) array of distances to the surface (negative inside)
+        """
+        return norm(points - self.centre, axis=1) - self.radius
+
+    def key(self):
+        """ :return: str that changes whenever the obstacle's shape does (for the cache) """
+        return "sphere {0} {1!r}".format(self.centre.tolist(), self.radius)
+
+
+class Box(object):
+    """
+    Axis aligned cube obstacle
+    """
+
+    model = 'box.obj'  # half size 1
+
+    def __init__(self, centre, half_size):
+        """
+        :param centre: array-like 3 coordinates
+        :param half_size: float distance from the centre to each face
+        """
+        self.centre = asarray(centre, dtype=float64)
+        self.half_size = float(half_size)
+        self.scale = self.half_size
+
+    def signed_distance(self, points):
+        """
+        :param points: (N, 3) array
+        :return: (N,) array of distances to the surface (negative inside)
+        """
+        outside = np_abs(points - self.centre) - self.half_size
+        return norm(maximum(outside, 0), axis=1) + minimum(outside.max(axis=1), 0)
+
+    def key(self):
+        """ :return: str that changes whenever the obstacle's shape does (for the cache) """
+        return "box {0} {1!r}".format(self.centre.tolist(), self.half_size)
+
+
+class Mesh(object):
+    """
+    Obstacle from an obj file (any polygons are split into triangles)
+    """
+
+    def __init__(self, name, centre, scale=1.0, obj_dir=OBJ_DIR):
+        """
+        :param name: str file name in obj_dir (e.g. 'monkey.obj')
+        :param centre: array-like 3 coordinates to put the model's origin at
+        :param scale: float to multiply the model's coordinates by
+        """
+        self.model = name
+        self.path = os.path.join(obj_dir, name)
+        self.centre = asarray(centre, dtype=float64)
+        self.scale = float(scale)
+        with open(self.path, 'rb') as obj_file:
+            contents = obj_file.read()
+        self.digest = hashlib.sha1(contents).hexdigest()
+
+        vertices = []
+        triangles = []
+        for line in contents.decode().splitlines():
+            data = line.split()
+            if not data:
+                continue
+            if data[0] == 'v':
+                vertices.append([float(x) for x in data[1:4]])
+            elif data[0] == 'f':
+                # indices start at 1, and can be followed by /texture/normal indices
+                face = [int(f.split('/')[0]) - 1 for f in data[1:]]
+                triangles.extend([face[0], face[i], face[i + 1]] for i in range(1, len(face) - 1))
+        # a row of 3 corners with 3 coordinates each for every triangle
+        self.triangles = array(vertices, dtype=float64)[array(triangles, dtype=int64)] * self.scale + self.centre
+
+    def signed_distance(self, points):
+        """
+        Distance to the nearest triangle, negative where the triangles wind around the point
+        (the winding number still works for meshes that aren't quite closed, like the monkey's eyes)
+        :param points: (N, 3) array
+        :return: (N,) array of distances to the surface (negative inside)
+        """
+        distances = sqrt(self.sq_distances(points))
+        # anything outside the mesh's bounding box can't be inside it
+        boxed = flatnonzero(((points >= self.triangles.min(axis=(0, 1)))
+                             & (points <= self.triangles.max(axis=(0, 1)))).all(axis=1))
+        inside = boxed[np_abs(self.winding(points[boxed])) > 0.5]
+        distances[inside] *= -1
+        return distances
+
+    def sq_distances(self, points):
+        """
+        Squared distance from each point to its nearest triangle
+        Each triangle's bounding sphere rules most of them out before any exact distances are worked out
+        :param points: (N, 3) array
+        :return: (N,) array
+        """
+        centres = self.triangles.mean(axis=1)
+        radii = norm(self.triangles - centres[:, None], axis=2).max(axis=1)
+        vertices = self.triangles.reshape(-1, 3)
+        sq_dists = full(len(points), inf)
+        rows = max(1, BLOCK_PAIRS // len(centres))
+        for start in range(0, len(points), rows):
+            block = points[start:start + rows]
+            to_centres = sqrt(cross_sq_distances(block, centres))
+            # no triangle is further away than its nearest vertex, and none is nearer than its sphere's near side
+            furthest = sqrt(cross_sq_distances(block, vertices).min(axis=1))
+            furthest = furthest * CULL_SLACK + (CULL_SLACK - 1) * radii.max()
+            p, t = nonzero(to_centres - radii <= furthest[:, None])
+            minimum.at(sq_dists, start + p, triangle_sq_distances(block[p], self.triangles[t]))
+        return sq_dists
+
+    def winding(self, points):
+        """
+        How many times the triangles wind around each point (from each one's solid angle, Van Oosterom and Strackee)
+        :param points: (N, 3) array
+        :return: (N,) array (about 1 or -1 inside a closed mesh, depending on which way its faces turn, 0 outside)
+        """
+        winding = zeros(len(points))
+        rows = max(1, BLOCK_PAIRS // len(self.triangles))
+        for start in range(0, len(points), rows):
+            block = points[start:start + rows, None, :]
+            pa, pb, pc = (self.triangles[:, k] - block for k in range(3))
+            la, lb, lc = norm(pa, axis=2), norm(pb, axis=2), norm(pc, axis=2)
+            triple = einsum('ptd,ptd->pt', pa, cross(pb, pc))
+            below = (la*lb*lc + einsum('ptd,ptd->pt', pa, pb)*lc + einsum('ptd,ptd->pt', pb, pc)*la
+                     + einsum('ptd,ptd->pt', pc, pa)*lb)
+            winding[start:start + rows] = arctan2(triple, below).sum(axis=1) / (2*pi)
+        return winding
+
+    def key(self):
+        """ :return: str that changes whenever the obstacle's shape does (for the cache) """
+        return "mesh {0} {1} {2} {3!r}".format(self.model, self.digest, self.centre.tolist(), self.scale)
+
+
+def triangle_sq_distances(points, triangles):
+    """
+    :param points: (K, 3) array
+    :param triangles: (K, 3, 3) array of the triangle to measure each point against
+    :return: (K,) array of squared distances from each point to the nearest point of its triangle
+    """
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    normals = cross(b - a, c - a)
+    areas = norm(normals, axis=1)
+    normals /= maximum(areas, 1e-300)[:, None]
+    # straight down to the plane, if that lands inside the triangle (degenerate triangles have no inside)
+    height = einsum('kd,kd->k', points - a, normals)
+    foot = points - height[:, None] * normals
+    over = areas > 0
+    for u, v in ((a, b), (b, c), (c, a)):
+        over &= einsum('kd,kd->k', cross(v - u, foot - u), normals) >= 0
+    sq_dists = where(over, height * height, inf)
+    # otherwise to the nearest edge
+    for u, v in ((a, b), (b, c), (c, a)):
+        along = v - u
+        t = clip(einsum('kd,kd->k', points - u, along) / maximum(einsum('kd,kd->k', along, along), 1e-300), 0, 1)
+        offset = points - u - t[:, None] * along
+        sq_dists = minimum(sq_dists, einsum('kd,kd->k', offset, offset))
+    return sq_dists
+
+
+class ObstacleField(object):
+    """
+    Signed distance to the nearest obstacle (and its gradient) on a grid over a cube's first three dimensions
+    """
+
+    def __init__(self, cube, obstacles, resolution=None, cache_dir=None):
+        """
+        Bake the grid, or load it from the cache if these obstacles have been baked for this cube before
+        :param cube: Cube the obstacles are in
+        :param obstacles: list of Sphere, Box or Mesh
+        :param resolution: int grid points along each edge (defaults to SP.OBSTACLE_RESOLUTION)
+        :param cache_dir: str where baked grids are kept (defaults to SP.OBSTACLE_CACHE, '' for no cache)
+        """
+        self.obstacles = list(obstacles)
+        self.resolution = SP.OBSTACLE_RESOLUTION if resolution is None else resolution
+        cache_dir = SP.OBSTACLE_CACHE if cache_dir is None else cache_dir
+        self.origin = array(cube.v_min[:3], dtype=float64)
+        self.spacing = cube.edge_length / (self.resolution - 1)
+
+        key = "{0} {1!r} {2}\n".format(self.origin.tolist(), cube.edge_length, self.resolution)
+        key += "\n".join(obstacle.key() for obstacle in self.obstacles)
+        self.hash = hashlib.sha1(key.encode()).hexdigest()
+        path = os.path.join(cache_dir, self.hash + '.npz') if cache_dir else None
+
+        if path and os.path.exists(path):
+            with load(path) as cached:
+                self.values = cached['values']
+            self.cached = True
+        else:
+            self.values = self.bake()
+            self.cached = False
+            if path:
+                os.makedirs(cache_dir, exist_ok=True)
+                savez(path, values=self.values)
+        # a row of distance and gradient per grid point, so one gather fetches all 8 corners' worth
+        self.flat_values = self.values.reshape(-1, 4)
+        self.corner_offsets = CORNERS @ array([self.resolution**2, self.resolution, 1], dtype=int64)
+
+    def __repr__(self):
+        return "{0} obstacles in a {1}^3 distance grid ({2})".format(
+            len(self.obstacles), self.resolution, "from the cache" if self.cached else "baked")
+
+    def bake(self):
+        """
+        :return: (R, R, R, 4) array of the distance and its gradient at every grid point
+        """
+        axis = self.origin[:, None] + arange(self.resolution) * self.spacing
+        points = stack(meshgrid(*axis, indexing='ij'), axis=-1).reshape(-1, 3)
+        distances = self.obstacles[0].signed_distance(points)
+        for obstacle in self.obstacles[1:]:
+            distances = minimum(distances, obstacle.signed_distance(points))
+        distances = distances.reshape((self.resolution,) * 3)
+        return stack([distances] + list(gradient(distances, self.spacing)), axis=-1)
+
+    def sample(self, locations):
+        """
+        Trilinear interpolation of the grid (anything outside it gets the nearest edge of the grid)
+        :param locations: (N, DIMS) array (only the first three dimensions are used)
+        :return: (N,) array of distances and (N, 3) array of gradients
+        """
+        cells = clip((locations[:, :3] - self.origin) / self.spacing, 0, self.resolution - 1)
+        corner = minimum(floor(cells).astype(int64), self.resolution - 2)
+        frac = cells - corner
+        # weight of each corner: the product of (1 - frac) or frac along each axis
+        x = stack([1 - frac, frac], axis=1)
+        weights = (x[:, :, None, None, 0] * x[:, None, :, None, 1] * x[:, None, None, :, 2]).reshape(-1, 8)
+        index = (corner[:, 0]*self.resolution + corner[:, 1])*self.resolution + corner[:, 2]
+        values = einsum('nc,ncv->nv', weights, take(self.flat_values, index[:, None] + self.corner_offsets, axis=0))
+        return values[:, 0], values[:, 1:]
+
+    def models(self):
+        """
+        :return: list of (obj file name, centre, scale) to draw each obstacle with
+        """
+        return [(obstacle.model, obstacle.centre, obstacle.scale) for obstacle in self.obstacles]
+
+
+def spread_meshes(v_min, edge_length, names, scale=None, obj_dir=OBJ_DIR):
+    """
+    Put meshes evenly along a cube's x axis, through its centre
+    :param v_min: array the minimum vertex of the cube
+    :param edge_length: float
+    :param names: list of str obj file names
+    :param scale: float for every mesh (defaults to a quarter of its share of the edge, for models about 2 across)
+    :return: list of Mesh
+    """
+    share = edge_length / len(names)
+    if scale is None:
+        scale = share / 4
+    meshes = []
+    for i, name in enumerate(names):
+        centre = array(v_min[:3], dtype=float64) + 0.5 * edge_length
+        centre[0] = v_min[0] + share * (i + 0.5)
+        meshes.append(Mesh(name, centre, scale, obj_dir))
+    return meshes
@@ -0,0 +1,566 @@
+"""
+Step swarms in worker processes
+Each swarm's state lives in shared memory, so the render and interpreter side can read it without any pickling
+Swarms only interact through stigmergy, which happens at the start of a tick, so within a tick they are independent
+(SwarmPool), and one very large swarm can have its rules split between workers by slabs of its cube (SlabPool)
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+from queue import SimpleQueue, Empty
+
+from numpy import (ndarray, array, arange, float64, zeros, zeros_like, prod, quantile, linspace, flatnonzero, concatenate,
+                   diff, inf)
+
+import Swarm
+from Neighbours import nearest, TOPOLOGICAL
+from Parameters import SP
+
+# how SlabPool splits the rules between its workers
+SLABS = 0   # slabs of the cube along its first axis, each with the halo of boids around it
+ROWS = 1    # blocks of boids by row, each against the whole swarm
+
+
+class SwarmSpec(object):
+    """
+    Everything needed to build a swarm (in whichever process it is going to live in)
+    """
+
+    def __init__(self, num_boids, cube, num_attractors=None, follow=None, hunts=None):
+        """
+        Same arguments as Swarm
+        :param hunts: int   which swarm (in the same list of specs) this one is a predator of
+        """
+        self.num_boids = num_boids
+        self.cube = cube
+        self.num_attractors = num_attractors
+        self.follow = follow
+        self.hunts = hunts
+
+    def __repr__(self):
+        return "Spec for a swarm of {0} boids in cube with min vertex {1}".format(self.num_boids, self.cube.v_min)
+
+    @property
+    def attractor_count(self):
+        return self.follow if self.num_attractors is None else self.num_attractors
+
+    def build(self, prey=None):
+        """
+        :param prey: Swarm  the swarm it hunts, if it is a predator
+        :return: Swarm
+        """
+        if self.hunts is not None:
+            return Swarm.Predators(self.num_boids, self.cube, prey)
+        return Swarm.Swarm(self.num_boids, self.cube, self.num_attractors, self.follow)
+
+
+def build_swarms(specs):
+    """
+    Build every swarm in this process, with its predators
+    :param specs: list of SwarmSpec, lead swarm first
+    :return: list of Swarm
+    """
+    swarms = []
+    for spec in specs:
+        # a predator's prey has to come before it
+        swarms.append(spec.build(swarms[spec.hunts] if spec.hunts is not None else None))
+    return swarms
+
+
+class SharedState(object):
+    """
+    One swarm's arrays, laid out in a single block of shared memory
+    """
+
+    def __init__(self, spec, dims, dtype, name=None):
+        """
+        :param spec: SwarmSpec
+        :param dims: int
+        :param dtype: numpy float type of the swarm
+        :param name: str    name of an existing block to attach to (a new one is made if not given)
+        """
+        n, a = spec.num_boids, spec.attractor_count
+        layout = [
+            ('locations', (n, dims), dtype),
+            ('velocities', (n, dims), dtype),
+            ('adjustments', (n, dims), dtype),
+            ('turning', (n,), bool),
+            ('feeding', (n,), bool),
+            ('attractors', (a, dims), float64),
+            ('active', (a,), bool),
+            ('c_o_m', (2, dims), dtype),    # location and velocity
+        ]
+        offsets = []
+        size = 0
+        for _, shape, array_type in layout:
+            offsets.append(size)
+            nbytes = max(1, int(prod(shape))) * zeros(0, dtype=array_type).itemsize
+            size += -(-nbytes // 8) * 8  # kept 8-byte aligned
+
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.keys = [key for key, _, _ in layout]
+        for (key, shape, array_type), offset in zip(layout, offsets):
+            setattr(self, key, ndarray(shape, dtype=array_type, buffer=self.memory.buf, offset=offset))
+
+    def adopt(self, swarm):
+        """
+        Move a swarm's state into shared memory (the engine only ever updates its arrays in place)
+        """
+        for key in ('locations', 'velocities', 'adjustments', 'turning', 'feeding'):
+            getattr(self, key)[:] = getattr(swarm, key)
+            setattr(swarm, key, getattr(self, key))
+        swarm.shared = True
+        self.publish(swarm)
+
+    def publish(self, swarm):
+        """
+        Copy what isn't already shared (the attractors and the centre of mass) into shared memory
+        """
+        self.attractors[:] = swarm.attractor_set.locations
+        self.active[:] = swarm.attractor_set.active
+        self.c_o_m[0] = swarm.c_o_m.location
+        self.c_o_m[1] = swarm.c_o_m.velocity
+
+    def close(self, unlink=False):
+        for key in self.keys:
+            setattr(self, key, None)
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+def run_worker(specs, names, seeds, dims, parameters, conn):
+    """
+    Worker process: build its swarms in shared memory then step them whenever told to
+    :param specs: list of SwarmSpec
+    :param names: list of str   shared memory block for each swarm
+    :param seeds: list of SeedSequence  random streams for each swarm (see Swarm.fork_streams)
+    :param dims: int    Swarm.DIMS in the main process
+    :param parameters: dict of SP as it was in the main process
+    :param conn: Connection to the main process
+    """
+    for key, value in parameters.items():
+        setattr(SP, key, value)
+    Swarm.DIMS = dims
+
+    swarms, states = [], []
+    for spec, name, seed in zip(specs, names, seeds):
+        Swarm.streams = seed
+        swarm = spec.build()
+        state = SharedState(spec, dims, swarm.dtype, name)
+        state.adopt(swarm)
+        swarms.append(swarm)
+        states.append(state)
+    conn.send(True)
+
+    while True:
+        placements = conn.recv()
+        if placements is None:
+            break
+        for swarm, state, (placed, leads) in zip(swarms, states, placements):
+            for ratios in placed:
+                swarm.place_attractor(ratios)
+            if leads is not None:
+                swarm.place_attractors(leads)
+            swarm.update()
+            state.publish(swarm)
+        conn.send(True)
+
+    for swarm in swarms:
+        swarm.locations = swarm.velocities = swarm.adjustments = swarm.turning = swarm.feeding = None
+    for state in states:
+        state.close()
+
+
+class AttractorView(object):
+    """
+    An attractor living in a worker process, as seen from the main process
+    """
+
+    def __init__(self, state, id):
+        self.state = state
+        self.id = id
+
+    @property
+    def location(self):
+        return self.state.attractors[self.id]
+
+    @property
+    def is_active(self):
+        return bool(self.state.active[self.id])
+
+
+class SwarmProxy(object):
+    """
+    A swarm living in a worker process, as seen from the main process
+    Has the parts of Swarm the renderer and interpreters use, read straight from shared memory
+    """
+
+    def __init__(self, spec, state, dims, dtype):
+        self.spec = spec
+        self.state = state
+        self.dims = dims
+        self.num_boids = spec.num_boids
+        self.num_attractors = spec.attractor_count
+        self.cube = spec.cube
+        self.v_min = array(spec.cube.v_min, dtype=dtype)
+        # swarms in worker processes can't change size, so every boid stays in its first row
+        self.rows = arange(spec.num_boids)
+        self.population = 0
+        self.boids = [Swarm.Boid(self, i) for i in range(spec.num_boids)]
+        self.attractors = [AttractorView(state, i) for i in range(self.num_attractors)]
+        self.c_o_m = Swarm.CentOfMass(spec.cube.centre, zeros(dims), spec.cube.v_min, spec.cube.edge_length)
+        self.placed = SimpleQueue()  # attractors to place at the start of the next tick (e.g. from MIDI input)
+        self.frame = 0
+        self.ratios = zeros((spec.num_boids, 2*dims), dtype=dtype)
+        self.ratios_frame = None
+        self.ratios_min = array([0.0] * dims + [-0.99] * dims, dtype=dtype)  # see Swarm.get_ratios
+        self.snapshots = Swarm.Snapshots(spec.num_boids, dims, dtype)  # published by the pool
+
+    def __repr__(self):
+        return "Proxy for a swarm of {0} boids in cube with min vertex {1}".format(self.num_boids, self.cube.v_min)
+
+    @property
+    def locations(self):
+        return self.state.locations
+
+    @property
+    def velocities(self):
+        return self.state.velocities
+
+    @property
+    def turning(self):
+        return self.state.turning
+
+    @property
+    def feeding(self):
+        return self.state.feeding
+
+    def place_attractor(self, ratios):
+        """
+        Place an attractor given "ratios" (passed on to the worker at the start of the next tick)
+        """
+        self.placed.put(ratios)
+
+    def take_placed(self):
+        """
+        :return: list of every attractor placed since the last tick
+        """
+        placed = []
+        while True:
+            try:
+                placed.append(self.placed.get_nowait())
+            except Empty:
+                return placed
+
+    def get_ratios(self):
+        """
+        :return: (N, 2*DIMS) array of each boid's location ratios then velocity ratios (see Swarm.get_ratios)
+        """
+        return Swarm.Swarm.get_ratios(self)
+
+    def get_loc_ratios(self):
+        """
+        :return: (N, DIMS) array of 0-1 proportions of how far each boid is along each axis
+        """
+        return Swarm.Swarm.get_loc_ratios(self)
+
+    def get_COM(self):
+        return self.c_o_m
+
+
+class SwarmPool(object):
+    """
+    Steps a world of swarms (lead swarm first, then its followers) across worker processes
+    """
+
+    def __init__(self, specs, workers=None):
+        """
+        :param specs: list of SwarmSpec, lead swarm first
+        :param workers: int number of worker processes (defaults to one per swarm, up to the number of cores)
+        """
+        if any(spec.hunts is not None for spec in specs):
+            raise ValueError("predators need to be in the same process as their prey")
+        if workers is None:
+            workers = min(len(specs), multiprocessing.cpu_count())
+        workers = max(1, min(workers, len(specs)))
+        dims, dtype = Swarm.DIMS, Swarm.float_type()
+        parameters = {key: value for key, value in vars(SP).items() if not key.startswith('_')}
+        seeds = Swarm.fork_streams(len(specs))
+
+        self.states = [SharedState(spec, dims, dtype) for spec in specs]
+        self.swarms = [SwarmProxy(spec, state, dims, dtype) for spec, state in zip(specs, self.states)]
+        # swarm i lives in worker i % workers
+        self.hosted = [list(range(w, len(specs), workers)) for w in range(workers)]
+        self.connections = []
+        self.processes = []
+        for hosted in self.hosted:
+            conn, worker_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_worker, daemon=True, args=(
+                [specs[i] for i in hosted], [self.states[i].name for i in hosted], [seeds[i] for i in hosted],
+                dims, parameters, worker_conn))
+            process.start()
+            self.connections.append(conn)
+            self.processes.append(process)
+        for conn in self.connections:
+            conn.recv()  # wait until every swarm is built
+        self.read_c_o_m()
+        self.publish()
+
+    def __repr__(self):
+        return "Pool of {0} workers stepping {1} swarms".format(len(self.processes), len(self.swarms))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_c_o_m(self):
+        for swarm in self.swarms:
+            swarm.c_o_m.set(swarm.state.c_o_m[0].copy(), swarm.state.c_o_m[1].copy())
+
+    def publish(self):
+        """ snapshot every swarm for the interpreters, now the workers have finished with the shared state """
+        for swarm in self.swarms:
+            swarm.snapshots.publish(swarm, swarm.frame)
+
+    def step(self, swarms=None):
+        """
+        Update every swarm by one tick (see Swarm.step_world)
+        :param swarms: ignored, for the same signature as step_world
+        """
+        # stigmergy happens before anything moves, so the workers don't need to talk to each other
+        leads = self.swarms[0].get_loc_ratios()
+        placements = [(swarm.take_placed(), leads if i > 0 else None) for i, swarm in enumerate(self.swarms)]
+        for conn, hosted in zip(self.connections, self.hosted):
+            conn.send([placements[i] for i in hosted])
+        for conn in self.connections:
+            conn.recv()
+        self.read_c_o_m()
+        for swarm in self.swarms:
+            swarm.frame += 1
+        self.publish()
+
+    def close(self):
+        """ Stop the workers and free the shared memory """
+        for conn in self.connections:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+        for swarm in self.swarms:
+            swarm.boids = swarm.attractors = []
+        for state in self.states:
+            state.close(unlink=True)
+        self.connections = self.processes = self.states = []
+
+
+class Slab(Swarm.Swarm):
+    """
+    The boids a worker owns in a shared swarm, followed by the halo of boids around them, as seen by the worker
+    Only used to run the rules on them (calc_v)
+    """
+
+    def __init__(self, cube, state):
+        """
+        :param cube: Cube   bounding box of the whole swarm
+        :param state: SharedState   of the whole swarm
+        """
+        super().__init__(0, cube, 0)
+        self.state = state
+        self.num_owned = 0
+
+    def load(self, owned, halo):
+        """
+        Take a copy of some of the shared swarm's boids
+        :param owned: array of rows of the shared swarm to work out adjustments for
+        :param halo: array of rows of the shared swarm that are only there as their neighbours
+        """
+        state = self.state
+        rows = concatenate([owned, halo])
+        self.num_owned = len(owned)
+        self.num_boids = len(rows)
+        self.locations = state.locations[rows]
+        self.velocities = state.velocities[rows]
+        self.adjustments = zeros_like(self.locations)
+        self.turning = state.turning[rows]
+        self.feeding = zeros(len(rows), dtype=bool)
+        self.ratios = zeros((len(rows), 2*self.dims), dtype=self.dtype)
+        self.ratios_frame = None
+
+    def get_attractors(self):
+        return self.state.attractors.astype(self.dtype), self.state.active
+
+    def calc_v(self):
+        """
+        Calculate the velocity adjustments of just the owned boids
+        The halo is only there to be their neighbours, so no pairs of halo boids are looked at,
+        and the bonus rules are only applied to the owned boids
+        Pairs of owned boids are tiled once each, as in Swarm.calc_v, and pairs with the halo just push the owned boid
+        """
+        rules = self.active_rules()
+        for rule in rules:
+            rule.reset(self)
+        if SP.RULE_MODE == TOPOLOGICAL:
+            nearest_boids, sq_dists = nearest(self.locations, SP.NEAREST_NEIGHBOURS, self.num_owned)
+            for rule in rules:
+                rule.accumulate_nearest(self, nearest_boids, sq_dists)
+        else:
+            radius = max(rule.radius(self) for rule in rules)
+            for rows, cols, sq_dists, diagonal in self.tiles.tiles(self.locations, radius, self.num_owned):
+                for rule in rules:
+                    rule.accumulate_tile(self, rows, cols, sq_dists, diagonal)
+            for rows, cols, sq_dists in self.tiles.row_tiles(self.locations, self.num_owned):
+                for rule in rules:
+                    rule.accumulate_rows(self, rows, cols, sq_dists)
+
+        # from here on the halo is dropped
+        owned = slice(0, self.num_owned)
+        self.num_boids = self.num_owned
+        for key in ('locations', 'velocities', 'adjustments', 'turning', 'feeding', 'ratios'):
+            setattr(self, key, getattr(self, key)[owned])
+        for rule in rules:
+            rule.change, rule.num = rule.change[owned], rule.num[owned]
+        self.add_adjustments(rules)
+
+
+def run_slab_worker(spec, name, dims, parameters, conn):
+    """
+    Worker process: work out the adjustments for the boids in a slab (or block of rows) of a shared swarm
+    whenever told to
+    :param spec: SwarmSpec  of the whole swarm
+    :param name: str    its shared memory block
+    :param dims: int    Swarm.DIMS in the main process
+    :param parameters: dict of SP as it was in the main process
+    :param conn: Connection to the main process
+    """
+    for key, value in parameters.items():
+        setattr(SP, key, value)
+    Swarm.DIMS = dims
+
+    state = SharedState(spec, dims, Swarm.float_type(), name)
+    slab = Slab(spec.cube, state)
+    conn.send(True)
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        split, low, high = job
+        if split == ROWS:
+            owned = arange(low, high)
+            halo = concatenate([arange(low), arange(high, len(state.locations))])
+        else:
+            x = state.locations[:, 0]
+            owned = (x >= low) & (x < high)
+            # anyone close enough to a boid in the slab for any rule to care about
+            reach = max(rule.radius(slab) for rule in slab.active_rules())
+            halo = flatnonzero((x >= low - reach) & (x < high + reach) & ~owned)
+            owned = flatnonzero(owned)
+        slab.load(owned, halo)
+        slab.calc_v()
+        state.adjustments[owned] = slab.adjustments
+        state.feeding[owned] = slab.feeding
+        conn.send(True)
+
+    slab.locations = slab.velocities = slab.turning = None
+    state.close()
+
+
+class SlabPool(object):
+    """
+    Splits the rules of a single (very large) swarm between worker processes
+    The cube is cut into slabs along its first axis, with the same number of boids in each (so they move every tick)
+    Each worker reads its slab and the halo around it from shared memory and writes back adjustments for its own boids
+    Moving the boids and the attractors is cheap, so that stays with the swarm in the main process
+
+    Every worker goes through the pairs among its own boids once, as the swarm on its own does, and only the pairs
+    that reach into its halo are gone through again by the worker on the other side, so the extra work is the band
+    of pairs across each slab edge
+    If the slabs are narrower than the widest neighbourhood, their halos would be most of the swarm, so the boids are
+    split into blocks of rows instead, each against the whole swarm (as they are for topological neighbours)
+    """
+
+    def __init__(self, swarm, workers=None):
+        """
+        :param swarm: Swarm
+        :param workers: int number of worker processes (defaults to the number of cores)
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.swarm = swarm
+        dims = swarm.locations.shape[1]
+        spec = SwarmSpec(swarm.num_boids, swarm.cube, len(swarm.attractors))
+        parameters = {key: value for key, value in vars(SP).items() if not key.startswith('_')}
+
+        self.state = SharedState(spec, dims, swarm.dtype)
+        self.state.adopt(swarm)
+        self.connections = []
+        self.processes = []
+        self.split = None   # how the rules were split last tick (SLABS or ROWS)
+        for _ in range(max(1, workers)):
+            conn, worker_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_slab_worker, daemon=True, args=(
+                spec, self.state.name, dims, parameters, worker_conn))
+            process.start()
+            self.connections.append(conn)
+            self.processes.append(process)
+        for conn in self.connections:
+            conn.recv()
+        # the swarm's rule stage is now done by the workers
+        swarm.calc_v = self.calc_v
+
+    def __repr__(self):
+        names = {SLABS: "by slabs", ROWS: "by rows"}
+        return "Pool of {0} workers splitting a swarm of {1} boids ({2})".format(
+            len(self.processes), self.swarm.num_boids, names.get(self.split, "not run yet"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def calc_v(self):
+        """
+        Calculate every boid's velocity adjustment for the next tick across the workers (see Swarm.calc_v)
+        """
+        swarm = self.swarm
+        self.state.attractors[:] = swarm.attractor_set.locations
+        self.state.active[:] = swarm.attractor_set.active
+        workers = len(self.connections)
+        # slab edges at quantiles of the first axis, so every worker gets the same number of boids
+        edges = quantile(swarm.locations[:, 0], linspace(0, 1, workers + 1))
+        reach = max(rule.radius(swarm) for rule in swarm.active_rules())
+        if SP.RULE_MODE == TOPOLOGICAL or diff(edges).min() < reach:
+            # the nearest neighbours could be anywhere, or the halos would cover most of the swarm
+            self.split = ROWS
+            edges = linspace(0, swarm.num_boids, workers + 1).astype(int)
+        else:
+            self.split = SLABS
+            edges[0], edges[-1] = -inf, inf
+        for conn, low, high in zip(self.connections, edges[:-1], edges[1:]):
+            conn.send((self.split, low, high))
+        for conn in self.connections:
+            conn.recv()
+        # the slabs don't know about any predators, but fleeing them doesn't depend on the other boids anyway
+        Swarm.Flee.add_adjustment(swarm)
+
+    def close(self):
+        """ Stop the workers and give the swarm its arrays (and rule stage) back """
+        for conn in self.connections:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+        swarm = self.swarm
+        for key in ('locations', 'velocities', 'adjustments', 'turning', 'feeding'):
+            swarm.slots[key][:swarm.num_boids] = getattr(swarm, key)
+        swarm.view_slots()
+        swarm.shared = False
+        del swarm.calc_v
+        self.state.close(unlink=True)
+        self.connections = self.processes = []
@@ -4,6 +4,9 @@ Changed in config.ini
 Except for IP, which is changed in JSON files for individual interpreters
 """
 
+import configparser
+import random
+
 
 class DP:
     """
@@ -18,7 +21,7 @@ class SP:
     Swarm parameters
     """
     TRUE_RANDOM = -1                    # sets standard for below (not changeable from config.ini)
-    RANDOM_SEED = TRUE_RANDOM           # seed for random throughout program TODO doesn't seem to affect Swarm...
+    RANDOM_SEED = TRUE_RANDOM           # seed for every swarm, attractor set and interpreter random stream
     IS_FLOCK = False                    # flock or swarm
     FEEDING = False
     FEED_DIST = 15
@@ -31,14 +34,41 @@ class SP:
     COHESION_MULTIPLIER = 0.0006        # 0.0006
     ALIGNMENT_MULTIPLIER = 0.03         # 0.03
     SEPARATION_MULTIPLIER = 0.09        # 0.05 - seems to be a sweet spot (TODO find out why)
+    PREDATOR_NEIGHBOURHOOD = 0.15       # how close a predator has to come before boids flee (ratio of edge_length)
+    FLEE_MULTIPLIER = 0.5
+    CHASE_MULTIPLIER = 0.1              # how quickly predators turn towards their prey
+    OBSTACLE_NEIGHBOURHOOD = 0.1        # how close to an obstacle's surface boids start to steer away (ratio of edge_length)
+    OBSTACLE_MULTIPLIER = 0.05
+    OBSTACLE_RESOLUTION = 32            # grid points along each edge of the obstacle distance grid
+    OBSTACLE_CACHE = 'obstacle_cache'   # directory baked obstacle grids are kept in ('' = bake them every run)
     ATTRACTION_MULTIPLIER = 0.005       # 0.005 - larger means more clumping
     CONSTRAINT_MULTIPLIER = 0.001       # 0.001
     TURNING_RATIO = 0.80                # 0.80 - turning if boid is <this>*radius of bounding 'sphere' away from centre
-    ATTRACTOR_MODE = 0                  # 0 = teleportation, 1 = paths
+    ATTRACTOR_MODE = 0                  # 0 = teleportation, 1 = paths, 2 = MIDI input
+                                        # with over Neighbours.ATTRACTOR_INDEX_MIN attractors the nearest ones are indexed,
+                                        # which pays off when they move less than the gaps between them (MIDI, slow lead boids)
     RAND_ATTRACTOR_CHANGE = 0.035       # 0.05
     ATTRACTORS_NOTICED = 2              # How many attractors to be attracted to at once
+    PATH_TABLE = 0                      # ticks of attractor path to work out in one go (0 = one tick at a time)
+    STIGMERGY_SAMPLING = 0              # leads a follower with fewer attractors uses: 0 = last, 1 = evenly, 2 = random
     MOTION_CONSTANT = 0.035             # Add a bit of speed to keep them going (optional)
     BOUNDING_SPHERE = 1                 # 0 = BOX, 1 = SPHERE to keep the boids inside
+    RULE_MODE = 0                       # 0 = metric (neighbourhood radii), 1 = topological (nearest neighbours)
+    NEAREST_NEIGHBOURS = 7              # how many neighbours each boid pays attention to in topological mode
+    NEIGHBOUR_SEARCH = 0                # 0 = auto, 1 = brute force, 2 = spatial hash, 3 = dense tiles (auto picks the cheapest)
+                                        # in auto, dense tiles take precedence whenever over Neighbours.DENSE_PAIRS of
+                                        # pairs were neighbours last tick, which a flock usually is
+                                        # auto only picks the hash once the widest neighbourhood plus VERLET_SKIN is
+                                        # under a third of the edge (see NeighbourSearch.choose)
+    VERLET_SKIN = 0.1                   # ratio of edge_length added to the neighbourhood so pairs can be reused (0 = off)
+    TILE_MEMORY = 64                    # MB the pairwise rule stage can use, however many boids there are
+    PRECISION = 64                      # 64 or 32 bit floats for the swarm state (32 halves the memory traffic)
+    WORKERS = 0                         # processes to step the swarms in (0 = all in the main process)
+    SLAB_WORKERS = 0                    # processes to split the lead swarm's rules between, by slabs (0 = off)
+                                        # only the pairs across the slab edges are gone through twice, and slabs
+                                        # narrower than the widest neighbourhood are split by rows instead (see Parallel.SlabPool)
+    JIT = 1                             # run the rules through numba-compiled kernels if numba is installed (0 = off)
+    SPARE_BOIDS = 0                     # free slots each swarm keeps so boids can be added while it runs
 
 
 class IP:
@@ -56,3 +86,59 @@ class IP:
     ARTIC_MIN = 1
     ARTIC_RANGE = 0
     PROBABILITY = 0.75  # 0.75 - prob of playing a note
+
+
+def load_config(path='config.ini'):
+    """
+    Load the user-tweakable parameters from config.ini into DP and SP
+    :param path: path to the config file
+    """
+    config = configparser.ConfigParser()
+    # TODO error catching
+    config.read(path)
+
+    DP.UPDATE_RATE = int(config['DEFAULT']['UPDATE_RATE'])
+
+    seed = int(config['SWARM']['RANDOM_SEED'])
+    if seed == -1:
+        seed = random.randint(1, 1000000)
+    SP.RANDOM_SEED = seed
+    SP.IS_FLOCK = int(config['SWARM']['IS_FLOCK'])
+    SP.FEEDING = int(config['SWARM']['FEEDING'])
+    SP.FEED_DIST = float(config['SWARM']['FEED_DIST'])
+    SP.MAX_SPEED = float(config['SWARM']['MAX_SPEED'])
+    SP.RAND_POINT_SD = float(config['SWARM']['RAND_POINT_SD'])
+    SP.REPULSION_POINT = float(config['SWARM']['REPULSION_POINT'])
+    SP.COHESION_NEIGHBOURHOOD = float(config['SWARM']['COHESION_NEIGHBOURHOOD'])
+    SP.ALIGNMENT_NEIGHBOURHOOD = float(config['SWARM']['ALIGNMENT_NEIGHBOURHOOD'])
+    SP.SEPARATION_NEIGHBOURHOOD = float(config['SWARM']['SEPARATION_NEIGHBOURHOOD'])
+    SP.COHESION_MULTIPLIER = float(config['SWARM']['COHESION_MULTIPLIER'])
+    SP.ALIGNMENT_MULTIPLIER = float(config['SWARM']['ALIGNMENT_MULTIPLIER'])
+    SP.SEPARATION_MULTIPLIER = float(config['SWARM']['SEPARATION_MULTIPLIER'])
+    SP.PREDATOR_NEIGHBOURHOOD = float(config['SWARM']['PREDATOR_NEIGHBOURHOOD'])
+    SP.FLEE_MULTIPLIER = float(config['SWARM']['FLEE_MULTIPLIER'])
+    SP.CHASE_MULTIPLIER = float(config['SWARM']['CHASE_MULTIPLIER'])
+    SP.OBSTACLE_NEIGHBOURHOOD = float(config['SWARM']['OBSTACLE_NEIGHBOURHOOD'])
+    SP.OBSTACLE_MULTIPLIER = float(config['SWARM']['OBSTACLE_MULTIPLIER'])
+    SP.OBSTACLE_RESOLUTION = int(config['SWARM']['OBSTACLE_RESOLUTION'])
+    SP.OBSTACLE_CACHE = config['SWARM']['OBSTACLE_CACHE']
+    SP.ATTRACTION_MULTIPLIER = float(config['SWARM']['ATTRACTION_MULTIPLIER'])
+    SP.CONSTRAINT_MULTIPLIER = float(config['SWARM']['CONSTRAINT_MULTIPLIER'])
+    SP.TURNING_RATIO = float(config['SWARM']['TURNING_RATIO'])
+    SP.RAND_ATTRACTOR_CHANGE = float(config['SWARM']['RAND_ATTRACTOR_CHANGE'])
+    SP.ATTRACTOR_MODE = int(config['SWARM']['ATTRACTOR_MODE'])
+    SP.ATTRACTORS_NOTICED = int(config['SWARM']['ATTRACTORS_NOTICED'])
+    SP.PATH_TABLE = int(config['SWARM']['PATH_TABLE'])
+    SP.STIGMERGY_SAMPLING = int(config['SWARM']['STIGMERGY_SAMPLING'])
+    SP.MOTION_CONSTANT = float(config['SWARM']['MOTION_CONSTANT'])
+    SP.BOUNDING_SPHERE = int(config['SWARM']['BOUNDING_SPHERE'])
+    SP.RULE_MODE = int(config['SWARM']['RULE_MODE'])
+    SP.NEAREST_NEIGHBOURS = int(config['SWARM']['NEAREST_NEIGHBOURS'])
+    SP.NEIGHBOUR_SEARCH = int(config['SWARM']['NEIGHBOUR_SEARCH'])
+    SP.VERLET_SKIN = float(config['SWARM']['VERLET_SKIN'])
+    SP.TILE_MEMORY = float(config['SWARM']['TILE_MEMORY'])
+    SP.PRECISION = int(config['SWARM']['PRECISION'])
+    SP.WORKERS = int(config['SWARM']['WORKERS'])
+    SP.SLAB_WORKERS = int(config['SWARM']['SLAB_WORKERS'])
+    SP.JIT = int(config['SWARM']['JIT'])
+    SP.SPARE_BOIDS = int(config['SWARM']['SPARE_BOIDS'])
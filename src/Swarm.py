@@ -1,57 +1,139 @@
 # Adapted from code by Tom Marble
 # https://github.com/tmarble/pyboids/blob/master/boids.py
 
-import random
-from numpy import array, zeros, float64, nditer, append
+from numpy import (array, zeros, zeros_like, float32, float64, newaxis, where, bincount, concatenate,
+                   einsum, sqrt, abs as np_abs, flatnonzero, nonzero, triu, ones, arange, sin, pi, asarray,
+                   sort, less, maximum, minimum, finfo)
 from numpy.linalg import norm
+from numpy.random import SeedSequence, default_rng
 from Parameters import SP
-from heapq import (heappush, heappop)
-from math import (cos, sin, pi)
-
-# TODO TEMP
-# random.seed(SP.RANDOM_SEED)
+from Neighbours import (NeighbourSearch, VerletList, AttractorIndex, DenseTiles, nearest, pair_sq_distances,
+                        TOPOLOGICAL, TILED, SEARCH_NAMES)
+from Obstacles import ObstacleField
+import JitKernels
 
 DIMS = 5  # for when dimensions must be hardcoded
 
-def random_range(lower=0.0, upper=1.0):
+# every swarm, attractor set and interpreter spawns its own generator from here (see seed_streams)
+streams = SeedSequence(None if SP.RANDOM_SEED == SP.TRUE_RANDOM else SP.RANDOM_SEED)
+STREAMS_PER_SWARM = 2  # its boids and its attractors
+
+# which lead boids a follower swarm uses when it has fewer attractors than there are leads (SP.STIGMERGY_SAMPLING)
+LATEST = 0      # the last ones (what placing them one at a time would have left)
+EVENLY = 1      # evenly spaced through the lead swarm
+RANDOM = 2      # a different random set every tick
+
+
+def seed_streams(seed=None):
+    """
+    Start a new tree of random streams
+    Generators spawned after this (in the same order) give the same numbers on every run with the same seed
+    :param seed: int (defaults to SP.RANDOM_SEED)
+    """
+    global streams
+    if seed is None:
+        seed = SP.RANDOM_SEED
+    streams = SeedSequence(None if seed == SP.TRUE_RANDOM else seed)
+
+
+def float_type():
+    """
+    :return: the numpy float type the engine runs in (SP.PRECISION)
+    """
+    return float32 if SP.PRECISION == 32 else float64
+
+
+def spawn_rng():
     """
-    :return: a random number between lower and upper
+    :return: numpy Generator with its own independent stream
     """
-    return lower + (random.random() * (upper - lower))
+    return default_rng(streams.spawn(1)[0])
 
 
-def random_vector(dims, lower=0.0, upper=1.0):
+def fork_streams(num_swarms):
     """
-    :param dims: number of dimensions of resultant vector
-    :param lower: float lower bound for random_range
-    :param upper: float upper bound for random_range
+    Streams for swarms that are going to be built somewhere else (e.g. in another process)
+    Each swarm gets exactly the generators it would have got if they had all been built here, in order
+    :param num_swarms: int
+    :return: list of SeedSequence, one to set as streams before building each swarm
+    """
+    start = streams.n_children_spawned
+    forks = [SeedSequence(streams.entropy, spawn_key=streams.spawn_key, pool_size=streams.pool_size,
+                          n_children_spawned=start + STREAMS_PER_SWARM*i) for i in range(num_swarms)]
+    streams.spawn(STREAMS_PER_SWARM*num_swarms)  # skip past them here
+    return forks
+
+
+def random_vector(rng, dims, lower=0.0, upper=1.0):
+    """
+    :param rng: numpy Generator to draw from
+    :param dims: number of dimensions of resultant vector (or a shape, for many vectors at once)
+    :param lower: float lower bound
+    :param upper: float upper bound
     :return: a vector with <dims> random elements between lower and upper
     """
-    data = [random_range(lower, upper) for _ in range(dims)]
-    return array(data)
+    return lower + (rng.random(dims) * (upper - lower))
 
 
-def rand_point_in_cube(cube, dims):
+def rand_points_in_cube(rng, cube, num_points, dims):
     """
-    done with gauss for n dims
+    done with gauss for n dims (truncated to the cube by redrawing anything outside it)
+    :param rng: numpy Generator to draw from
     :param cube: Cube object
+    :param num_points: how many points to make
     :param dims: number of dimensions
-    :return:
+    :return: (num_points, dims) array
     """
     edge = cube.edge_length
     sd = edge/SP.RAND_POINT_SD
 
-    points = []
+    points = rng.normal(edge/2, sd, (num_points, dims))
+    outside = (points <= 0) | (points >= edge)
+    while outside.any():
+        points[outside] = rng.normal(edge/2, sd, outside.sum())
+        outside = (points <= 0) | (points >= edge)
 
-    for i in range(dims):
-        p = 0
-        while True:
-            p = random.gauss(edge/2, sd)
-            if max(0, min(p, edge)) not in [0, edge]:
-                break
-        points.append(p + cube.v_min[i])
+    return points + cube.v_min[:dims]
 
-    return array(points, dtype=float64)
+
+def scatter_add(out, index, values):
+    """
+    out[index[k]] += values[k] for every k
+    (unlike out[index] += values, repeated indices all get added)
+    :param out: (N, DIMS) array
+    :param index: (P,) array of rows of out
+    :param values: (P, DIMS) array
+    """
+    for dim in range(out.shape[1]):
+        out[:, dim] += bincount(index, weights=values[:, dim], minlength=len(out))
+
+
+def scatter_pairs(out, i, j, to_i, to_j):
+    """
+    Scatter the contributions of each pair of boids to both of them
+    :param out: (N, DIMS) array
+    :param i, j: (P,) arrays of the boids in each pair
+    :param to_i, to_j: (P, DIMS) arrays to add to rows i and j respectively
+    """
+    scatter_add(out, concatenate((i, j)), concatenate((to_i, to_j)))
+
+
+def pair_counts(i, j, num_boids):
+    """
+    :return: how many of the pairs each boid is in
+    """
+    return bincount(i, minlength=num_boids) + bincount(j, minlength=num_boids)
+
+
+def clamp(values, low, high, out=None):
+    """
+    Same as numpy.clip, but without its overhead, which adds up for small swarms as it's done every tick
+    :param values: array
+    :param low, high: float
+    :param out: array to put the result in (defaults to a new one)
+    :return: array
+    """
+    return minimum(maximum(values, low, out=out), high, out=out)
 
 
 def normalise(vector):
@@ -68,17 +150,20 @@ class Cube(object):
     Bounding box for swarm
     """
 
-    def __init__(self, v_min, edge_length):
+    def __init__(self, v_min, edge_length, obstacles=None):
         """
         Set up a bounding box that constrains the swarm(s)
         :param v_min:       array   the minimum vertex of the cube (closest to origin)
         :param edge_length: float   the length of each edge (currently always a perfect cube)
+        :param obstacles:   list    of Obstacles.Sphere, Box or Mesh inside the cube for the boids to avoid
         """
 
         self.v_min = v_min
         self.edge_length = edge_length
         pos = [j + 0.5 * edge_length for j in v_min]
         self.centre = array(pos, dtype=float64)
+        # obstacles are baked into a distance grid once, here, so avoiding them costs the same whatever they are
+        self.field = ObstacleField(self, obstacles) if obstacles else None
 
     def __repr__(self):
         return "Cube from {0} with edge length {1}".format(self.v_min, self.edge_length)
@@ -87,6 +172,7 @@ class Cube(object):
 class Rule(object):
     """
     Template for rules of flocking
+    Rules are applied to the whole swarm at once, so the aggregators hold one row per boid
     """
 
     def __init__(self):
@@ -94,19 +180,92 @@ class Rule(object):
         Initialise aggregators change and num
         Set potency of rule ('neighbourhood')
         """
-        self.change = zeros(DIMS, dtype=float64)    # velocity correction
-        self.num = 0                    # number of participants
+        self.change = zeros((0, DIMS), dtype=float64)   # velocity correction for each boid
+        self.num = zeros(0, dtype=float64)              # number of participants for each boid
         self.neighbourhood = 0.5        # sphere of view of boid as ratio of cube edge length (overwritten later)
+        self.kernel = None              # what the compiled kernel sums for this rule (see JitKernels)
+
+    def reset(self, swarm):
+        """
+        Clear the aggregators ready for a new tick
+        """
+        self.change = zeros_like(swarm.locations)
+        self.num = zeros(len(swarm.locations), dtype=swarm.dtype)
 
-    def accumulate(self, boid, other, distance):
+    def radius(self, swarm):
         """
-        Save any corrections based on other boid to self.change
+        :return: the neighbourhood as an actual distance
+        """
+        return self.neighbourhood*swarm.cube.edge_length
+
+    def in_range(self, swarm, sq_dists):
+        """
+        :param sq_dists: squared distance between each pair of boids
+        :return: boolean mask of which pairs are within this rule's neighbourhood
+        """
+        return sq_dists < self.radius(swarm)**2
+
+    def accumulate(self, swarm, i, j, sq_dists):
+        """
+        Save any corrections to boids i and j based on each other to self.change
+        Each pair is only given once, so both boids have to be dealt with at the same time
+        :param i, j: arrays of the boids in each neighbouring pair
+        :param sq_dists: array of the squared distance between each pair
+        """
+        pass
+
+    def accumulate_nearest(self, swarm, nearest, sq_dists):
+        """
+        Save any corrections to each boid based on its topological neighbours to self.change
+        :param nearest: (N, k) array of each boid's k nearest neighbours
+        :param sq_dists: (N, k) array of the squared distance to each of them
         """
         pass
 
-    def add_adjustment(self, boid):
+    def accumulate_tile(self, swarm, rows, cols, sq_dists, diagonal):
         """
-        Add the accumulated self.change to boid.adjustment
+        Save any corrections to the boids in one tile of the distance matrix to self.change
+        Unless the tile is on the diagonal, its pairs don't come up again the other way round,
+        so both the rows and the columns have to be dealt with
+        :param rows, cols: slices of the boids the tile covers
+        :param sq_dists: (rows, cols) array of the squared distance between each of them
+        :param diagonal: bool   whether rows and cols are the same boids
+        """
+        pass
+
+    def accumulate_rows(self, swarm, rows, cols, sq_dists):
+        """
+        Save any corrections to just the boids in rows, from the boids in cols, to self.change
+        Unlike accumulate_tile, the boids in cols are left alone: they get their own turn as rows
+        :param rows, cols: slices of the boids the block covers
+        :param sq_dists: (rows, cols) array of the squared distance between each of them, inf for a boid and itself
+        """
+        pass
+
+    def sum_rows(self, swarm, rows, cols, sq_dists, values):
+        """
+        Add up values (e.g. locations) of every boid in range for each boid in rows, with a matrix product
+        :param values: (N, DIMS) array
+        :return: (rows, cols) array of which of them were in range, as weights
+        """
+        near = self.in_range(swarm, sq_dists).astype(swarm.dtype)
+        self.change[rows] += near @ values[cols]
+        self.num[rows] += near.sum(axis=1)
+        return near
+
+    def sum_tile(self, swarm, rows, cols, sq_dists, diagonal, values):
+        """
+        Add up values (e.g. locations) of every boid in range for each boid in a tile, with matrix products
+        :param values: (N, DIMS) array
+        """
+        near = self.sum_rows(swarm, rows, cols, sq_dists, values)
+        if not diagonal:
+            self.change[cols] += near.T @ values[rows]
+            self.num[cols] += near.sum(axis=0)
+
+    def add_adjustment(self, swarm):
+        """
+        Add the accumulated self.change to swarm.adjustments
         """
         pass
 
@@ -117,18 +276,30 @@ class Cohesion(Rule):
     def __init__(self):
         super().__init__()
         self.neighbourhood = SP.COHESION_NEIGHBOURHOOD
+        self.kernel = JitKernels.LOCATIONS
+
+    def accumulate(self, swarm, i, j, sq_dists):
+        near = self.in_range(swarm, sq_dists)
+        i, j = i[near], j[near]
+        scatter_pairs(self.change, i, j, swarm.locations[j], swarm.locations[i])
+        self.num += pair_counts(i, j, len(self.num))
+
+    def accumulate_nearest(self, swarm, nearest, sq_dists):
+        num = len(nearest)
+        self.change[:num] += swarm.locations[nearest].sum(axis=1)
+        self.num[:num] += nearest.shape[1]
+
+    def accumulate_tile(self, swarm, rows, cols, sq_dists, diagonal):
+        self.sum_tile(swarm, rows, cols, sq_dists, diagonal, swarm.locations)
 
-    def accumulate(self, boid, other, distance):
-        if other != boid:
-            self.change += other.location
-            self.num += 1
+    def accumulate_rows(self, swarm, rows, cols, sq_dists):
+        self.sum_rows(swarm, rows, cols, sq_dists, swarm.locations)
 
-    def add_adjustment(self, boid):
-        if self.num > 0:
-            centroid = self.change / self.num
-            desired = centroid - boid.location
-            self.change = (desired - boid.velocity) * SP.COHESION_MULTIPLIER
-        boid.adjustment += self.change
+    def add_adjustment(self, swarm):
+        has = self.num > 0
+        centroid = self.change[has] / self.num[has, newaxis]
+        desired = centroid - swarm.locations[has]
+        swarm.adjustments[has] += (desired - swarm.velocities[has]) * SP.COHESION_MULTIPLIER
 
 
 class Alignment(Rule):
@@ -137,17 +308,29 @@ class Alignment(Rule):
     def __init__(self):
         super().__init__()
         self.neighbourhood = SP.ALIGNMENT_NEIGHBOURHOOD
+        self.kernel = JitKernels.VELOCITIES
 
-    def accumulate(self, boid, other, distance):
-        if other != boid:
-            self.change += other.velocity
-            self.num += 1
+    def accumulate(self, swarm, i, j, sq_dists):
+        near = self.in_range(swarm, sq_dists)
+        i, j = i[near], j[near]
+        scatter_pairs(self.change, i, j, swarm.velocities[j], swarm.velocities[i])
+        self.num += pair_counts(i, j, len(self.num))
 
-    def add_adjustment(self, boid):
-        if self.num > 0:
-            group_velocity = self.change / self.num
-            self.change = (group_velocity - boid.velocity) * SP.ALIGNMENT_MULTIPLIER
-        boid.adjustment += self.change
+    def accumulate_nearest(self, swarm, nearest, sq_dists):
+        num = len(nearest)
+        self.change[:num] += swarm.velocities[nearest].sum(axis=1)
+        self.num[:num] += nearest.shape[1]
+
+    def accumulate_tile(self, swarm, rows, cols, sq_dists, diagonal):
+        self.sum_tile(swarm, rows, cols, sq_dists, diagonal, swarm.velocities)
+
+    def accumulate_rows(self, swarm, rows, cols, sq_dists):
+        self.sum_rows(swarm, rows, cols, sq_dists, swarm.velocities)
+
+    def add_adjustment(self, swarm):
+        has = self.num > 0
+        group_velocity = self.change[has] / self.num[has, newaxis]
+        swarm.adjustments[has] += (group_velocity - swarm.velocities[has]) * SP.ALIGNMENT_MULTIPLIER
 
 
 class Separation(Rule):
@@ -156,91 +339,176 @@ class Separation(Rule):
     def __init__(self):
         super().__init__()
         self.neighbourhood = SP.SEPARATION_NEIGHBOURHOOD
-
-    def accumulate(self, boid, other, distance):
-        # calc vector from boid2 to boid1 (NOT other way round as we want repulsion)
-        repulsion = boid.location - other.location
-        if distance > 0:
-            # this normalises the repulsion vector and makes closer boids repel more
-            self.change += repulsion / distance**2  # makes it an inverse square rule
-        self.num += 1
-
-    def add_adjustment(self, boid):
+        self.kernel = JitKernels.SEPARATE
+
+    def reset(self, swarm):
+        super().reset(swarm)
+        self.num += 1  # every boid is in its own neighbourhood
+
+    def accumulate(self, swarm, i, j, sq_dists):
+        near = self.in_range(swarm, sq_dists)
+        # boids on top of each other count but don't push
+        apart = near & (sq_dists > 0)
+        # calc vector from boid j to boid i (NOT other way round as we want repulsion)
+        repulsion = swarm.locations[i[apart]] - swarm.locations[j[apart]]
+        # dividing by distance squared normalises the repulsion vector and makes closer boids repel more
+        repulsion /= sq_dists[apart, newaxis]  # makes it an inverse square rule
+        # boid j is pushed exactly the opposite way to boid i
+        scatter_pairs(self.change, i[apart], j[apart], repulsion, -repulsion)
+        self.num += pair_counts(i[near], j[near], len(self.num))
+
+    def accumulate_nearest(self, swarm, nearest, sq_dists):
+        # only the nearest neighbours that are also within the neighbourhood push
+        num = len(nearest)
+        near = self.in_range(swarm, sq_dists)
+        weights = zeros_like(sq_dists)
+        apart = near & (sq_dists > 0)
+        weights[apart] = 1 / sq_dists[apart]
+        repulsion = swarm.locations[:num, newaxis, :] - swarm.locations[nearest]
+        self.change[:num] += einsum('ik,ikd->id', weights, repulsion)
+        self.num[:num] += near.sum(axis=1)
+
+    def accumulate_tile(self, swarm, rows, cols, sq_dists, diagonal):
+        # the separation neighbourhood is small, so there are usually few pairs in it and they can go through
+        # accumulate, which also gets their exact distance where the matrix would lose precision for boids very
+        # close together
+        # a clumped swarm can fill a whole tile with them though, so they are gathered a strip of rows at a time
+        near = self.in_range(swarm, sq_dists)
+        if diagonal:
+            near = triu(near, 1)  # each pair once
+        strip = swarm.tiles.pair_rows(near.shape[1])
+        for start in range(0, near.shape[0], strip):
+            i, j = nonzero(near[start:start + strip])
+            i += rows.start + start
+            j += cols.start
+            self.accumulate(swarm, i, j, pair_sq_distances(swarm.locations, i, j))
+
+    def accumulate_rows(self, swarm, rows, cols, sq_dists):
+        # the pairs go through the same exact distances as accumulate_tile, but only boid i is pushed
+        near = self.in_range(swarm, sq_dists)
+        strip = swarm.tiles.pair_rows(near.shape[1])
+        for start in range(0, near.shape[0], strip):
+            i, j = nonzero(near[start:start + strip])
+            i += rows.start + start
+            j += cols.start
+            pair_dists = pair_sq_distances(swarm.locations, i, j)
+            close = self.in_range(swarm, pair_dists)
+            apart = close & (pair_dists > 0)
+            repulsion = swarm.locations[i[apart]] - swarm.locations[j[apart]]
+            repulsion /= pair_dists[apart, newaxis]
+            scatter_add(self.change, i[apart], repulsion)
+            self.num += bincount(i[close], minlength=len(self.num))
+
+    def add_adjustment(self, swarm):
         # here norm is vector magnitude
-        if norm(self.change) > 0:
-            group_separation = self.change / self.num
-            self.change = (group_separation - boid.velocity) * SP.SEPARATION_MULTIPLIER
-        boid.adjustment += self.change
+        has = norm(self.change, axis=1) > 0
+        group_separation = self.change[has] / self.num[has, newaxis]
+        swarm.adjustments[has] += (group_separation - swarm.velocities[has]) * SP.SEPARATION_MULTIPLIER
 
 
 class Attraction:
     """ Bonus Rule: Fly towards the attractor(s) """
 
     @staticmethod
-    def add_adjustment(boid):
-        # priority queue of (distance, change)
-        dist_mat = []
+    def add_adjustment(swarm):
+        locations = swarm.locations
+        attractors, active = swarm.get_attractors()
+        num_active = int(active.sum())
+        if not num_active:
+            swarm.feeding[:] = False
+            return
+
+        # only feel the pull of the nearest <x> attractors
+        attention_span = min(SP.ATTRACTORS_NOTICED, num_active)
+        # the nearest one is looked up even if they pay attention to none, to tell whether they are feeding
+        nearest_atts, sq_dists = swarm.attractor_index.nearest(locations, attractors, max(1, attention_span), active)
+        # if the nearest one is too far away to feed from then they all are
+        swarm.feeding[:] = sq_dists.min(axis=1) < SP.FEED_DIST**2
+        if not attention_span:
+            return
 
         # EXPERIMENTAL: ATTRACTION_MULTIPLIER is a function of its position in the nth dimension
         # this means that when the boid will be attracted to the attractor at the top of d1, and repulsed at the base
-        att_mul = SP.ATTRACTION_MULTIPLIER
-        n = 4  # which dimension to use
-        proportion = boid.get_loc_ratios()[n]
-        if proportion < SP.REPULSION_POINT:
-            att_mul = -SP.ATTRACTION_MULTIPLIER
-
-        f = False
-        for attr in boid.attractors:
-            if attr.is_active:
-                to_attractor = attr.location - boid.location
-                dist = norm(to_attractor)
-                f = f or dist < SP.FEED_DIST
-                # 1/dist makes attraction stronger for closer attractors
-                change = (to_attractor - boid.velocity) * att_mul * (1/dist)
-                heappush(dist_mat, (dist, list(change)))  # needs to be a list as ndarray is 'ambiguous'
-        boid.feeding = f
+        n = min(4, DIMS - 1)  # which dimension to use
+        repulsed = swarm.get_ratios()[:, n] < SP.REPULSION_POINT
+        att_mul = where(repulsed, -SP.ATTRACTION_MULTIPLIER, SP.ATTRACTION_MULTIPLIER).astype(swarm.dtype)
 
-        # only feel the pull of the nearest <x> attractors
-        attention_span = min(SP.ATTRACTORS_NOTICED, len(boid.attractors))
-        for _ in range(attention_span):
-            if dist_mat:
-                boid.adjustment += heappop(dist_mat)[1]
+        to_attractor = attractors[nearest_atts] - locations[:, newaxis, :]
+        dist = sqrt(sq_dists)
+        # 1/dist makes attraction stronger for closer attractors
+        change = (to_attractor - swarm.velocities[:, newaxis, :]) / dist[:, :, newaxis]
+        swarm.adjustments += change.sum(axis=1) * att_mul[:, newaxis]
+
+
+class Flee:
+    """ Bonus Rule: Boids fly away from any predators nearby (see Swarm.predators) """
+
+    @staticmethod
+    def add_adjustment(swarm):
+        predators = swarm.threats
+        if not len(predators):
+            return
+        radius = SP.PREDATOR_NEIGHBOURHOOD * swarm.cube.edge_length
+        sq_dists = swarm.threat_sq_dists    # shared with the chase (see see_predators)
+        near = sq_dists < radius**2
+        num = near.sum(axis=1)
+        if not num.any():
+            return
+        # like separation, an inverse square push directly away from each of them
+        # predators on top of a boid count but don't push, as there is no away from them
+        change = einsum('ij,ijk->ik', near / maximum(sq_dists, finfo(sq_dists.dtype).tiny), swarm.threat_offsets)
+        swarm.adjustments += change / maximum(num, 1)[:, newaxis] * SP.FLEE_MULTIPLIER
+
+
+class Avoidance:
+    """ Bonus Rule: Boids steer away from the surface of any obstacles in the cube (see Cube.field) """
+
+    @staticmethod
+    def add_adjustment(swarm):
+        field = swarm.cube.field
+        if field is None:
+            return
+        margin = SP.OBSTACLE_NEIGHBOURHOOD * swarm.cube.edge_length
+        distances, gradients = field.sample(swarm.locations)
+        near = flatnonzero(distances < margin)
+        # straight out from the nearest surface, harder the further into the margin (or the obstacle) they are
+        push = (margin - distances[near]) * SP.OBSTACLE_MULTIPLIER
+        swarm.adjustments[near, :3] += gradients[near] * push[:, newaxis]
 
 
 class Constraint:
     """ Bonus Rule: Boids must stay within the bounding cube. """
 
     @staticmethod
-    def add_adjustment(boid):
-        change = zeros(DIMS, dtype=float64)
-        if boid.turning:
-            direction = boid.cube.centre - boid.location
-            change = direction * SP.CONSTRAINT_MULTIPLIER
-        boid.adjustment = boid.adjustment + change
+    def add_adjustment(swarm):
+        turning = swarm.turning
+        direction = swarm.centre - swarm.locations[turning]
+        swarm.adjustments[turning] += direction * SP.CONSTRAINT_MULTIPLIER
 
 
 class Boid(object):
     """
     A single swarm agent
+    This is only a view onto its row of its swarm's arrays, which are what the rules work on
+    (the row can change when other boids are removed, but the id stays the same)
     """
 
-    def __init__(self, cube, attractors, id):
+    def __init__(self, swarm, id):
         """
         Make a baby boid
-        :param cube: Cube   bounding box for this boid
-        :param attractors: [Attractor]
+        :param swarm: Swarm     the swarm holding this boid's state
+        :param id:    int       the boid's slot in the swarm
         """
-        self.cube = cube
-        self.attractors = attractors
+        self.swarm = swarm
         self.id = id
 
-        # doesn't matter that much where you start
-        self.location = rand_point_in_cube(cube, DIMS)
+    @property
+    def row(self):
+        return self.swarm.rows[self.id]
 
-        self.velocity = random_vector(DIMS, -1.0, 1.0)  # vx vy vz
-        self.adjustment = zeros(DIMS, dtype=float64)  # to accumulate corrections from rules
-        self.turning = False
-        self.feeding = False
+    @property
+    def alive(self):
+        return self.row < self.swarm.num_boids
 
     def __repr__(self):
         return "Boid - pos:{0}, vel:{1}".format(self.location, self.velocity)
@@ -248,46 +516,43 @@ class Boid(object):
     def __lt__(self, other):
         return (self.location < other.location).all()
 
-    def calc_v(self, all_boids, dist_mat):
-        """
-        Calculate velocity for next tick by applying the swarming rules
-        :param all_boids: List of all boids in the swarm
-        :param dist_mat: most likely incomplete distance matrix between boids
-        """
-        # Apply the rules to each of the boids
-        # flocks use alignment, swarms do not
-        flock = SP.IS_FLOCK
-        rules = [Separation(), Cohesion()]
-        if flock:
-            rules.append(Alignment())
-        # bonus rules don't need the accumulate stage
-        bonus_rules = [Constraint, Attraction]
-
-        # turns out this is the bottleneck of the whole program...
-        for boid in all_boids:
-            key = (min(self.id, boid.id), max(self.id, boid.id))
-            try:
-                distance = dist_mat[key]
-            except KeyError:
-                distance = norm(self.location-boid.location)
-                dist_mat[key] = distance
-            for rule in rules:
-                if distance < rule.neighbourhood*self.cube.edge_length:
-                    rule.accumulate(self, boid, distance)
-        self.adjustment = zeros(DIMS, dtype=float64)  # reset adjustment vector
-        for rule in rules:  # save corrections to the adjustment
-            rule.add_adjustment(self)
-        for rule in bonus_rules:
-            rule.add_adjustment(self)
+    @property
+    def cube(self):
+        return self.swarm.cube
 
-    def limit_speed(self, max_speed):
-        """
-        Ensure the speed does not exceed max_speed
-        :param max_speed: float
-        """
-        # TODO experiment with turning this off. Other than the boids leaving the cube sometimes, it's fine.
-        if norm(self.velocity) > max_speed:
-            self.velocity = normalise(self.velocity) * max_speed
+    @property
+    def attractors(self):
+        return self.swarm.attractors
+
+    @property
+    def location(self):
+        return self.swarm.locations[self.row]
+
+    @location.setter
+    def location(self, value):
+        self.swarm.locations[self.row] = value
+        self.swarm.ratios_frame = None  # the swarm's ratios have to be worked out again
+
+    @property
+    def velocity(self):
+        return self.swarm.velocities[self.row]
+
+    @velocity.setter
+    def velocity(self, value):
+        self.swarm.velocities[self.row] = value
+        self.swarm.ratios_frame = None  # the swarm's ratios have to be worked out again
+
+    @property
+    def adjustment(self):
+        return self.swarm.adjustments[self.row]
+
+    @property
+    def turning(self):
+        return self.swarm.turning[self.row]
+
+    @property
+    def feeding(self):
+        return self.swarm.feeding[self.row]
 
     def get_location(self):
         """
@@ -297,127 +562,164 @@ class Boid(object):
 
     def get_loc_ratios(self):
         """
-        :return: a list of 0-1 proportions of how far the boid is along each axis
+        :return: array of 0-1 proportions of how far the boid is along each axis,
+                 then its velocity as a fraction of max_speed (a row of the swarm's ratios, so don't write to it)
         """
-        loc = self.get_location()
-        # this looks weird but it's just a faster way of iterating over the loc array and clamping values
-        for dim in nditer(loc, op_flags=['readwrite']):
-            dim[...] = min(0.99, max(0.0, dim/self.cube.edge_length))
-
-        # append velocity to the end (as a fraction of max_speed)
-        vel_frac = self.velocity / SP.MAX_SPEED
-        append(loc, vel_frac)
-
-        return loc
-
-    def update(self):
-        """
-        Move to new position using calculated velocity
-        """
-        velocity = self.velocity + self.adjustment
-
-        # Add a constant velocity in whatever direction
-        # they are moving so they don't ever stop.
-        # Now that we have attractors, this is unnecessary
-        if norm(velocity) > 0:
-            velocity += (normalise(velocity) * random_range(0.0, SP.MOTION_CONSTANT))
+        return self.swarm.get_ratios()[self.row]
 
-        self.velocity = velocity
-        self.limit_speed(SP.MAX_SPEED)
-        self.location = self.location + self.velocity
 
-        if SP.BOUNDING_SPHERE:
-            self.turning = (norm(self.location-self.cube.centre) >= self.cube.edge_length*SP.TURNING_RATIO/2)
-        else:
-            self.turning = False
-            for dim in range(len(self.location)):
-                self.turning = self.turning or norm(self.location[dim]-self.cube.centre[dim]) >= self.cube.edge_length*SP.TURNING_RATIO/2
-
-
-class Attractor(object):
+class AttractorSet(object):
     """
-    Attracts boid towards it (by the Attraction rule)
+    Every attractor of a swarm, as arrays: row i of each belongs to attractor i
+    Each attractor can follow a parametric path, one equation per dimension: t -> coeff * sin(freq * p * t + phase)
+    (phase picks sin or cos, and p is pi, or 1 for a dimension that varies less)
+    The coefficients are kept as arrays too, so the whole set steps along its paths at once
     """
-    def __init__(self, location, cube):
-        self.location = location
-        # TODO experimental values used here
+    def __init__(self, num_attractors, cube, rng, paths=True):
+        """
+        :param num_attractors: int
+        :param cube:     Cube       bounding box of the swarm
+        :param rng:      Generator  random stream of the swarm's attractor set
+        :param paths:    bool       whether the attractors will follow paths (if not, none are made up for them)
+        """
         self.cube = cube
-        self.t = random.random()  # start a random way along
-        self.step = random.randrange(50, 250)/100000  # at a random speed too
+        self.rng = rng
+        self.num_attractors = num_attractors
+        self.paths = paths
+        self.locations = zeros((num_attractors, DIMS), dtype=float64)
+
+        # for deciding which attractors teleport each tick, without making new arrays every time
+        self.draws = zeros(num_attractors, dtype=float64)
+        self.moving = zeros(num_attractors, dtype=bool)
 
         # TODO for interactive mode:
-        self.age = 0
+        self.ages = zeros(num_attractors, dtype=int)
         self.max_age = 100
-        self.is_active = True
+        self.active = ones(num_attractors, dtype=bool)
 
-        # make a random parametric path
-        # in this 3d example, the dimension that we leave "pi" out of varies less
-        # so if x is dynamic and x_f is simply cos(4t) then it will move slower and have
-        # less dynamic interest
-        # TODO very inelegant
-        a1, b1, c1, d1, e1 = random.randint(1, 8), random.randint(1, 8), random.randint(1, 8), \
-            random.randint(1, 8), random.randint(1, 8)
-        a2, b2, c2, d2, e2 = self.rand_coeff(), self.rand_coeff(), self.rand_coeff(), \
-                             self.rand_coeff(), self.rand_coeff()
+        # paths
+        self.t = zeros(num_attractors, dtype=float64)
+        self.steps = zeros(num_attractors, dtype=float64)
+        self.coeffs = zeros((num_attractors, DIMS), dtype=float64)
+        self.freqs = zeros((num_attractors, DIMS), dtype=float64)   # freq * p
+        self.phases = zeros((num_attractors, DIMS), dtype=float64)
 
-        t1, t2, t3, t4, t5 = self.rand_trig(), self.rand_trig(), self.rand_trig(), \
-                             self.rand_trig(), self.rand_trig()
+        # lookup table of the next few ticks of every path (SP.PATH_TABLE)
+        self.table = zeros((SP.PATH_TABLE, num_attractors, DIMS), dtype=float64)
+        self.table_tick = SP.PATH_TABLE  # used up, so it is filled in on the first step
 
-        p1, p2, p3, p4, p5 = self.pi_or_no(), self.pi_or_no(), self.pi_or_no(),\
-                             self.pi_or_no(), self.pi_or_no()
+        self.renew(arange(num_attractors))
 
-        self.x_f = lambda t: a2 * t1(a1 * p1 * t)
-        self.y_f = lambda t: b2 * t2(b1 * p2 * t)
-        self.z_f = lambda t: c2 * t3(c1 * p3 * t)
-        self.i_f = lambda t: d2 * t4(d1 * p4 * t)
-        self.j_f = lambda t: e2 * t5(e1 * p5 * t)
+    def __len__(self):
+        return self.num_attractors
 
-    @staticmethod
-    def rand_coeff():
-        """ return coefficient between 0.2 and 1.0 """
-        return 0.2 + 0.8*random.random()
+    def renew(self, rows):
+        """
+        Start some attractors again at random points in the cube, with new random paths
+        :param rows: array of which attractors
+        """
+        num, rng = len(rows), self.rng
+        if SP.PATH_TABLE:
+            # back to where the others are up to, so their table can be worked out again from there
+            self.t -= self.steps*(SP.PATH_TABLE - self.table_tick)
+            self.table_tick = SP.PATH_TABLE
+        self.locations[rows] = rand_points_in_cube(rng, self.cube, num, DIMS)
+        self.ages[rows] = 0
+        self.active[rows] = True
+        if not self.paths:
+            return
+        # TODO experimental values used here
+        self.t[rows] = rng.random(num)  # start a random way along
+        self.steps[rows] = rng.integers(50, 250, num)/100000  # at a random speed too
+        # in this 3d example, the dimension that we leave "pi" out of varies less
+        # so if x is dynamic and its equation is simply cos(4t) then it will move slower and have
+        # less dynamic interest
+        self.coeffs[rows] = 0.2 + 0.8*rng.random((num, DIMS))  # coefficients between 0.2 and 1.0
+        self.phases[rows] = where(rng.random((num, DIMS)) < 0.5, 0.0, pi/2)  # sin or cos
+        self.freqs[rows] = rng.integers(1, 9, (num, DIMS)) * where(rng.random((num, DIMS)) < 0.1, 1.0, pi)
 
-    @staticmethod
-    def rand_trig():
-        """ return sin or cos """
-        if random.random() < 0.5:
-            return sin
-        else:
-            return cos
+    def teleport(self, chance):
+        """
+        Give each attractor a chance of jumping to a random place in the cube (in place)
+        :param chance: float    probability of each one moving
+        """
+        # one draw for the whole set
+        self.rng.random(out=self.draws)
+        less(self.draws, chance, out=self.moving)
+        if self.moving.any():
+            self.renew(flatnonzero(self.moving))
+
+    def set_pos(self, id, new_l):
+        self.locations[id] = new_l
+        # rejuvenate:
+        self.active[id] = True
+        self.ages[id] = 0
 
-    @staticmethod
-    def pi_or_no():
-        if random.random() < 0.1:
-            return 1
+    def path_points(self, t):
+        """
+        :param t: (A,) or (ticks, A) array of how far along each attractor's path
+        :return: (A, DIMS) or (ticks, A, DIMS) array of the points there, in the cube
+        """
+        point = self.coeffs * sin(self.freqs * t[..., newaxis] + self.phases)
+        return point*0.4*self.cube.edge_length + self.cube.centre
+
+    def step_paths(self):
+        """ move every attractor one step along its path """
+        if SP.PATH_TABLE:
+            if self.table_tick == SP.PATH_TABLE:
+                # work out the next stretch of every path in one go
+                ticks = arange(SP.PATH_TABLE)[:, newaxis]
+                self.table[:] = self.path_points(self.t + self.steps*ticks)
+                self.t += self.steps*SP.PATH_TABLE
+                self.table_tick = 0
+            self.locations[:] = self.table[self.table_tick]
+            self.table_tick += 1
         else:
-            return pi
-
-    def set_pos(self, new_l):
-        self.location = new_l
-        # rejuvenate:
-        self.is_active = True
-        self.age = 0
-
-    def step_path_equation(self):
-        # TODO set path in n dimensions
-        # parametric equations:
-        x = self.x_f(self.t)
-        y = self.y_f(self.t)
-        z = self.z_f(self.t)
-        i = self.i_f(self.t)
-        j = self.j_f(self.t)
-        self.t += self.step
-        new_point = array([x, y, z, i, j], dtype=float64)*0.4*self.cube.edge_length + self.cube.centre
-        self.set_pos(new_point)
+            self.locations[:] = self.path_points(self.t)
+            self.t += self.steps
+        self.active[:] = True
+        self.ages[:] = 0
 
     def inc_age(self):
         """
-        In order to keep track of how long the attractor has been here
+        In order to keep track of how long each attractor has been where it is
         (For interactive mode only)
         """
-        self.age += 1
-        if self.age > self.max_age:
-            self.is_active = False
+        self.ages += 1
+        self.active &= self.ages <= self.max_age
+
+
+class Attractor(object):
+    """
+    Attracts boid towards it (by the Attraction rule)
+    This is only a view onto row <id> of its swarm's AttractorSet
+    """
+    def __init__(self, attractors, id):
+        """
+        :param attractors: AttractorSet holding this attractor's state
+        :param id:         int          the attractor's row in its arrays
+        """
+        self.attractors = attractors
+        self.id = id
+
+    @property
+    def cube(self):
+        return self.attractors.cube
+
+    @property
+    def location(self):
+        return self.attractors.locations[self.id]
+
+    @property
+    def is_active(self):
+        return self.attractors.active[self.id]
+
+    @property
+    def age(self):
+        return self.attractors.ages[self.id]
+
+    def set_pos(self, new_l):
+        self.attractors.set_pos(self.id, new_l)
 
 
 class CentOfMass(object):
@@ -458,28 +760,127 @@ class CentOfMass(object):
 
     def get_loc_ratios(self):
         """
-        :return: a list of 0-1 proportions of how far the COM is along each axis
+        :return: array of 0-1 proportions of how far the COM is along each axis,
+                 then its velocity as a fraction of max_speed
+        """
+        return concatenate((clamp(self.get_location() / self.edge_length, 0.0, 0.99),
+                            clamp(self.velocity / SP.MAX_SPEED, -0.99, 0.99)))
+
+
+class Snapshot(object):
+    """
+    One buffer of a swarm's state as the interpreters see it
+    frame is WRITING while it is being filled in
+    """
+    WRITING = -1
+
+    def __init__(self, capacity, dims, dtype):
+        self.frame = Snapshot.WRITING
+        self.population = 0
+        self.num_boids = 0
+        self.rows = zeros(capacity, dtype=int)                  # row of each boid id (alive if < num_boids)
+        self.ratios = zeros((capacity, 2*dims), dtype=dtype)    # see Swarm.get_ratios
+        self.feeding = zeros(capacity, dtype=bool)
+        self.com_ratios = zeros(2*dims, dtype=dtype)
+
+
+class Snapshots(object):
+    """
+    The state of a swarm after each completed tick, for other threads to read without locks (a seqlock)
+    There are two buffers: the swarm fills in the one nobody has been pointed to, then points readers at it
+    A reader notes the frame of the latest buffer, copies what it needs, and checks the frame hasn't changed;
+    if it has, the swarm started reusing that buffer part way through, so the read is tried again
+    """
+
+    def __init__(self, capacity, dims, dtype):
+        self.buffers = [Snapshot(capacity, dims, dtype), Snapshot(capacity, dims, dtype)]
+        self.latest = self.buffers[0]
+        # there's no need to publish a swarm's state every tick until something reads it (e.g. an interpreter)
+        self.wanted = False
+
+    def publish(self, swarm, frame):
+        """
+        Copy the swarm's state into the spare buffer and make it the latest
+        :param swarm: Swarm (or proxy)
+        :param frame: int   ticks the swarm has done
+        """
+        spare = self.buffers[1] if self.latest is self.buffers[0] else self.buffers[0]
+        spare.frame = Snapshot.WRITING
+        num_boids = swarm.num_boids
+        spare.population = swarm.population
+        spare.num_boids = num_boids
+        spare.rows[:] = swarm.rows
+        spare.ratios[:num_boids] = swarm.get_ratios()
+        spare.feeding[:num_boids] = swarm.feeding
+        spare.com_ratios[:] = swarm.get_COM().get_loc_ratios()
+        spare.frame = frame
+        self.latest = spare
+
+    def read(self, copy):
+        """
+        :param copy: function of a Snapshot that copies out what is needed from it
+        :return: (frame, whatever copy returned), all from the same tick
+        """
+        self.wanted = True
+        while True:
+            snapshot = self.latest
+            frame = snapshot.frame
+            if frame == Snapshot.WRITING:
+                continue
+            data = copy(snapshot)
+            if snapshot.frame == frame:
+                return frame, data
+
+    def boid(self, id):
+        """
+        :param id: int  the boid's id
+        :return: (ratios, feeding) of one boid, or None if it isn't alive
+        """
+        def copy(snapshot):
+            row = snapshot.rows[id]
+            if row >= snapshot.num_boids:
+                return None
+            return snapshot.ratios[row].copy(), bool(snapshot.feeding[row])
+        return self.read(copy)[1]
+
+    def population(self):
+        """
+        :return: the latest Swarm.population (cheap enough to check every loop)
         """
-        loc = self.get_location()
-        for dim in nditer(loc, op_flags=['readwrite']):
-            dim[...] = min(0.99, max(0.0, dim/self.edge_length))
+        self.wanted = True
+        return self.latest.population
 
-        # append velocity to the end (as a fraction of max_speed)
-        vel_frac = self.velocity / SP.MAX_SPEED
-        append(loc, vel_frac)
+    def alive(self):
+        """
+        :return: (population, array of the ids of every boid alive) (see Swarm.population)
+        """
+        return self.read(lambda snapshot: (snapshot.population, flatnonzero(snapshot.rows < snapshot.num_boids)))[1]
 
-        return loc
+    def centre(self):
+        """
+        :return: ratios of the centre of mass
+        """
+        return self.read(lambda snapshot: snapshot.com_ratios.copy())[1]
+
+    def swarm(self):
+        """
+        :return: (frame, ratios, feeding) of every boid alive, in row order
+        """
+        frame, (ratios, feeding) = self.read(lambda snapshot: (snapshot.ratios[:snapshot.num_boids].copy(),
+                                                               snapshot.feeding[:snapshot.num_boids].copy()))
+        return frame, ratios, feeding
 
 
 class Swarm(object):
     """
     A swarm of boids
     """
-    def __init__(self, num_boids, cube, num_attractors=None, follow=None):
+    def __init__(self, num_boids, cube, num_attractors=None, follow=None, capacity=None):
         """
         Set up a swarm
         :param num_boids: int   number of boids in the swarm
         :param cube:      Cube  bounding box of swarm (and its boids)
+        :param capacity:  int   most boids it can ever have (defaults to num_boids + SP.SPARE_BOIDS)
         """
         super().__init__()
         self.dims = DIMS  # used by interpreter
@@ -511,70 +912,378 @@ class Swarm(object):
             else:
                 self.num_attractors = follow
 
-        for _ in range(self.num_attractors):
-            self.attractors.append(Attractor(rand_point_in_cube(self.cube, DIMS), cube))
-
-        for i in range(num_boids):
-            self.boids.append(Boid(cube, self.attractors, i))
+        # the boids and the attractors have separate streams, so changing one doesn't reshuffle the other
+        self.rng = spawn_rng()
+        self.attractor_rng = spawn_rng()
+
+        self.attractor_set = AttractorSet(self.num_attractors, cube, self.attractor_rng,
+                                          paths=self.update_attractors == self.ua_path)
+        self.attractors = [Attractor(self.attractor_set, i) for i in range(self.num_attractors)]
+
+        # structure-of-arrays state: row i of each array belongs to the same boid
+        # every array has a slot for as many boids as there could ever be, and the boids alive are the first
+        # num_boids rows (which are what self.locations etc. are views of), so adding or removing one is O(1)
+        self.dtype = float_type()
+        self.capacity = max(num_boids, capacity if capacity is not None else num_boids + SP.SPARE_BOIDS)
+        self.slots = {
+            'locations': zeros((self.capacity, DIMS), dtype=self.dtype),
+            'velocities': zeros((self.capacity, DIMS), dtype=self.dtype),
+            'adjustments': zeros((self.capacity, DIMS), dtype=self.dtype),  # to accumulate corrections from rules
+            'turning': zeros(self.capacity, dtype=bool),
+            'feeding': zeros(self.capacity, dtype=bool),
+            'ratios': zeros((self.capacity, 2*DIMS), dtype=self.dtype),     # see get_ratios
+        }
+        self.ids = arange(self.capacity)    # which boid is in each row (the ones past num_boids are free)
+        self.rows = arange(self.capacity)   # which row each boid is in
+        self.population = 0                 # goes up whenever a boid is added or removed
+        self.shared = False                 # whether its arrays have been moved into shared memory (see Parallel)
+        self.view_slots()
+        # the cube in the same precision, so nothing gets promoted back to float64
+        self.v_min = array(cube.v_min, dtype=self.dtype)
+        self.centre = array(cube.centre, dtype=self.dtype)
+        # doesn't matter that much where you start
+        self.locations[:] = rand_points_in_cube(self.rng, cube, num_boids, DIMS)
+        self.velocities[:] = random_vector(self.rng, (num_boids, DIMS), -1.0, 1.0)
+
+        self.rules = {
+            'separation': Separation(),
+            'cohesion': Cohesion(),
+            'alignment': Alignment()
+        }
+
+        self.neighbours = NeighbourSearch(cube)
+        self.tiles = DenseTiles()
+        self.attractor_index = AttractorIndex()
+        if SP.VERLET_SKIN > 0:
+            self.neighbours = VerletList(self.neighbours, SP.VERLET_SKIN*cube.edge_length)
+        self.search_used = None     # how calc_v found the pairs last tick (TILED, BRUTE_FORCE or SPATIAL_HASH)
+
+        self.boids = [Boid(self, i) for i in range(self.capacity)]
         self.c_o_m = CentOfMass(cube.centre, zeros(DIMS, dtype=float64), cube.v_min, cube.edge_length)
 
+        # what the interpreters read, from another thread (see Snapshots)
+        self.frame = 0
+        self.ratios_frame = None    # frame the ratios were last worked out for
+        # velocities can go either way, so their ratios can be negative
+        self.ratios_min = array([0.0] * self.dims + [-0.99] * self.dims, dtype=self.dtype)
+        self.snapshots = Snapshots(self.capacity, DIMS, self.dtype)
+        self.snapshots.publish(self, self.frame)
+
+        # swarms whose boids this swarm's boids flee from, and where they were at the start of the tick
+        self.predators = []
+        self.threats = zeros((0, DIMS), dtype=self.dtype)
+        self.threat_offsets = zeros((num_boids, 0, DIMS), dtype=self.dtype)   # from every threat to every boid
+        self.threat_sq_dists = zeros((num_boids, 0), dtype=self.dtype)
+
     def __repr__(self):
         return "Swarm of {0} boids in cube with min vertex {1}".format(self.num_boids, self.cube.v_min)
 
+    def describe(self):
+        """
+        :return: str for reporting how the rules found each boid's neighbours last tick
+        """
+        if SP.RULE_MODE == TOPOLOGICAL:
+            return "Neighbour search: {0} nearest (topological)".format(SP.NEAREST_NEIGHBOURS)
+        if JitKernels.backend() == JitKernels.NUMBA:
+            return "Neighbour search: every pair in the numba kernel"
+        if self.search_used is None:
+            return "Neighbour search: not run yet"
+        name = SEARCH_NAMES[self.search_used]
+        if self.search_used != TILED and isinstance(self.neighbours, VerletList):
+            name += " with a Verlet list"
+        chosen = "set by NEIGHBOUR_SEARCH" if SP.NEIGHBOUR_SEARCH else "auto"
+        return "Neighbour search: {0} ({1}, {2:.1%} of pairs neighbours)".format(name, chosen, self.tiles.pair_density)
+
+    def add_predator(self, predator):
+        """
+        Make this swarm's boids flee from another swarm's boids (the Flee rule)
+        :param predator: Swarm
+        """
+        self.predators.append(predator)
+
+    def see_predators(self):
+        """
+        Take note of where every predator is (before anything moves this tick)
+        The distances between them and the boids are worked out once, for both Flee and each predator's chase
+        """
+        if self.predators:
+            threats = concatenate([predator.locations for predator in self.predators])
+            self.threats = threats.astype(self.dtype, copy=False)
+            # there are only ever a few predators, so every boid against every one of them is cheap enough,
+            # and Flee needs the offsets as well as the distances
+            self.threat_offsets = self.locations[:, newaxis, :] - self.threats[newaxis, :, :]
+            self.threat_sq_dists = einsum('ijk,ijk->ij', self.threat_offsets, self.threat_offsets)
+            start = 0
+            for predator in self.predators:
+                if isinstance(predator, Predators):
+                    predator.see_prey(self.locations, self.threat_sq_dists[:, start:start + predator.num_boids].T)
+                start += predator.num_boids
+
+    def view_slots(self):
+        """
+        Point self.locations etc. at the rows of the boids alive
+        """
+        for key, slots in self.slots.items():
+            setattr(self, key, slots[:self.num_boids])
+
+    def population_changed(self):
+        """
+        Catch up with boids having been added or removed
+        """
+        self.view_slots()
+        self.population += 1
+        self.ratios_frame = None
+        # anything kept from one tick to the next refers to rows, which now mean different boids
+        self.neighbours.forget()
+        self.attractor_index.forget()
+        # so do the distances to any predators, which are left out until they are seen again next tick
+        self.threats = self.threats[:0]
+
+    def check_unshared(self):
+        """
+        Raise if the swarm's arrays are in shared memory, where workers would carry on with the old ones
+        """
+        if self.shared:
+            raise RuntimeError("can't add or remove boids while the swarm is shared with worker processes")
+
+    def spawn(self, location=None, velocity=None):
+        """
+        Add a boid in a free slot (nothing is reallocated, so it takes the same time however big the swarm)
+        Swarms in a SwarmPool or SlabPool can't change size
+        :param location: array (defaults to somewhere random in the cube)
+        :param velocity: array (defaults to random)
+        :return: the new Boid, or None if every slot is taken
+        """
+        self.check_unshared()
+        if self.num_boids == self.capacity:
+            return None
+        row = self.num_boids
+        slots = self.slots
+        slots['locations'][row] = (location if location is not None else
+                                   rand_points_in_cube(self.rng, self.cube, 1, DIMS)[0])
+        slots['velocities'][row] = velocity if velocity is not None else random_vector(self.rng, DIMS, -1.0, 1.0)
+        slots['adjustments'][row] = 0
+        slots['turning'][row] = slots['feeding'][row] = False
+        self.num_boids += 1
+        self.population_changed()
+        return self.boids[self.ids[row]]
+
+    def despawn(self, boid):
+        """
+        Remove a boid, freeing its slot (the last boid is moved into its row, so this also takes the same time
+        however big the swarm)
+        :param boid: Boid or int id
+        """
+        self.check_unshared()
+        id = getattr(boid, 'id', boid)
+        row, last = self.rows[id], self.num_boids - 1
+        if row > last:
+            return  # already gone
+        for slots in self.slots.values():
+            slots[row] = slots[last]
+        moved = self.ids[last]
+        self.ids[row], self.ids[last] = moved, id
+        self.rows[moved], self.rows[id] = row, last
+        self.num_boids -= 1
+        self.population_changed()
+
     def place_attractor(self, ratios):
         """
         Place an attractor given "ratios"
         :param ratios: ratio of how far along to place attractor on each axis
         """
         # TODO an interpolated path would be better
-        v_min = self.cube.v_min
-        edge = self.cube.edge_length
-        pos = []
-        for i, dim in enumerate(ratios):
-            pos.append(v_min[i] + dim*edge)
-        # update the attractor that has been still longest with this new position
-        if self.attractors:
-            self.attractors[self.att_index].set_pos(array(pos, dtype=float64))
-            self.att_index = (self.att_index + 1) % self.num_attractors  # TODO div0 risk
-        return
+        self.place_attractors(asarray(ratios, dtype=float64).reshape(1, -1))
+
+    def place_attractors(self, ratios):
+        """
+        Place a batch of attractors given "ratios", in one go
+        (e.g. stigmergy: every boid of the lead swarm becomes one of this swarm's attractors)
+        Ends up as if each had been placed in turn with place_attractor, except that if there are more
+        than there are attractors, SP.STIGMERGY_SAMPLING picks which of them are placed
+        :param ratios: (N, k) array of how far along to place each attractor on each (of the first k) axes
+                       columns past DIMS are left out, so whole rows of get_ratios or a snapshot can be passed
+        """
+        ratios = ratios[:, :self.dims]
+        attractors = self.attractor_set
+        num_attractors, num = len(attractors), len(ratios)
+        if not num_attractors or not num:
+            return
+        if num <= num_attractors:
+            chosen = ratios
+            slots = (self.att_index + arange(num)) % num_attractors
+        else:
+            # only the last of them are placed, as the rest would be overwritten in the same tick
+            chosen = ratios[self.sample_leads(num, num_attractors)]
+            slots = (self.att_index + num - num_attractors + arange(num_attractors)) % num_attractors
+        # update the attractors that have been still longest with these new positions
+        k = ratios.shape[1]
+        attractors.locations[slots, :k] = self.cube.v_min[:k] + chosen*self.cube.edge_length
+        attractors.active[slots] = True
+        attractors.ages[slots] = 0
+        self.att_index = (self.att_index + num) % num_attractors
+
+    def sample_leads(self, num, num_attractors):
+        """
+        :return: sorted array of which <num_attractors> of <num> placements to make (SP.STIGMERGY_SAMPLING)
+        """
+        if SP.STIGMERGY_SAMPLING == EVENLY:
+            return arange(num_attractors) * num // num_attractors
+        if SP.STIGMERGY_SAMPLING == RANDOM:
+            return sort(self.attractor_rng.choice(num, num_attractors, replace=False))
+        return arange(num - num_attractors, num)
+
+    def get_ratios(self):
+        """
+        Worked out at most once a frame, however many times it is asked for (so don't write to it)
+        :return: (N, 2*DIMS) array of 0-1 proportions of how far each boid is along each axis,
+                 then each boid's velocity as a fraction of max_speed (clamped to +-0.99)
+        """
+        if self.ratios_frame != self.frame:
+            ratios = self.ratios
+            ratios[:, :self.dims] = self.locations - self.v_min
+            ratios[:, :self.dims] /= self.cube.edge_length
+            ratios[:, self.dims:] = self.velocities / SP.MAX_SPEED
+            clamp(ratios, self.ratios_min, 0.99, out=ratios)
+            self.ratios_frame = self.frame
+        return self.ratios
+
+    def get_loc_ratios(self):
+        """
+        :return: (N, DIMS) array of 0-1 proportions of how far each boid is along each axis
+        """
+        return self.get_ratios()[:, :self.dims]
+
+    def get_attractors(self):
+        """
+        :return: ((A, DIMS) array of the location of every attractor, (A,) array of which of them are active)
+        """
+        attractors = self.attractor_set
+        return attractors.locations.astype(self.dtype), attractors.active
+
+    def get_attractor_locations(self):
+        """
+        :return: (A, DIMS) array of the locations of every active attractor
+        """
+        locations, active = self.get_attractors()
+        return locations[active]
+
+    def active_rules(self):
+        """
+        :return: list of the rules that apply to this swarm
+        """
+        # flocks use alignment, swarms do not
+        rules = [self.rules['separation'], self.rules['cohesion']]
+        if SP.IS_FLOCK:
+            rules.append(self.rules['alignment'])
+        return rules
+
+    def calc_v(self):
+        """
+        Calculate every boid's velocity adjustment for the next tick by applying the swarming rules
+        """
+        rules = self.active_rules()
+        for rule in rules:
+            rule.reset(self)
+
+        if SP.RULE_MODE == TOPOLOGICAL:
+            # every boid only pays attention to a fixed number of others, however crowded it gets
+            # separation still needs them to be within its neighbourhood
+            nearest_boids, sq_dists = nearest(self.locations, SP.NEAREST_NEIGHBOURS)
+            for rule in rules:
+                rule.accumulate_nearest(self, nearest_boids, sq_dists)
+        elif JitKernels.backend() == JitKernels.NUMBA:
+            # one compiled pass over every pair does all the rules at once
+            JitKernels.accumulate(self, rules)
+        else:
+            # find every pair of boids near enough for any rule to care about
+            # each rule's neighbourhood is then just a boolean slice of their distances
+            radius = max(rule.radius(self) for rule in rules)
+            if self.tiles.wanted(self.num_boids, self.locations.dtype):
+                # too crowded, or too big to list every pair, so go through the distance matrix a tile at a time
+                self.search_used = TILED
+                for rows, cols, sq_dists, diagonal in self.tiles.tiles(self.locations, radius):
+                    for rule in rules:
+                        rule.accumulate_tile(self, rows, cols, sq_dists, diagonal)
+            else:
+                i, j, sq_dists = self.neighbours.pairs(self.locations, radius)
+                self.search_used = self.neighbours.method
+                self.tiles.seen(len(i), self.num_boids)
+                for rule in rules:
+                    rule.accumulate(self, i, j, sq_dists)
+        self.add_adjustments(rules)
+
+    def add_adjustments(self, rules):
+        """
+        Work out every boid's adjustment from what the rules have accumulated, then add the bonus rules'
+        :param rules: list of Rule, already accumulated
+        """
+        # bonus rules don't need the accumulate stage
+        bonus_rules = [Constraint, Attraction, Flee, Avoidance]
+
+        self.adjustments[:] = 0  # reset adjustment vectors
+        for rule in rules:  # save corrections to the adjustments
+            rule.add_adjustment(self)
+        for rule in bonus_rules:
+            rule.add_adjustment(self)
+
+    def move(self):
+        """
+        Move every boid to its new position using its calculated velocity
+        """
+        velocities = self.velocities
+        velocities += self.adjustments
+
+        # Add a constant velocity in whatever direction
+        # they are moving so they don't ever stop.
+        # Now that we have attractors, this is unnecessary
+        speed = norm(velocities, axis=1)
+        moving = speed > 0
+        boost = random_vector(self.rng, self.num_boids, 0.0, SP.MOTION_CONSTANT).astype(self.dtype)
+        velocities[moving] += velocities[moving] * (boost[moving] / speed[moving])[:, newaxis]
+
+        # limit speed
+        # TODO experiment with turning this off. Other than the boids leaving the cube sometimes, it's fine.
+        speed = norm(velocities, axis=1)
+        fast = speed > SP.MAX_SPEED
+        velocities[fast] *= (SP.MAX_SPEED / speed[fast])[:, newaxis]
+
+        self.locations += velocities
+
+        turning_dist = self.cube.edge_length*SP.TURNING_RATIO/2
+        if SP.BOUNDING_SPHERE:
+            self.turning[:] = norm(self.locations - self.centre, axis=1) >= turning_dist
+        else:
+            self.turning[:] = (np_abs(self.locations - self.centre) >= turning_dist).any(axis=1)
 
     def update(self):
         """
         Update every boid in the swarm and calculate the swarm's centre of mass
         """
-        # position and velocity accumulators
-        p_acc = zeros(DIMS, dtype=float64)
-        v_acc = zeros(DIMS, dtype=float64)
-        atts = self.attractors
-        dist_mat = {}
-        for boid in self.boids:
-            boid.calc_v(self.boids, dist_mat)
-            boid.attractors = atts
-        # for boid in self.boids:  # TODO is this line necessary? (calc all v first or one at a time?)
-            boid.update()
-            p_acc = p_acc + boid.location
-            v_acc = v_acc + boid.velocity
-        # calculate the centre of mass
-        self.c_o_m.set(p_acc / self.num_boids, v_acc / self.num_boids)
+        # a swarm can be just attractors, to view them on their own
+        if self.num_boids:
+            # all velocities are calculated before anyone moves
+            self.calc_v()
+            self.move()
+            # calculate the centre of mass
+            self.c_o_m.set(self.locations.sum(axis=0) / self.num_boids, self.velocities.sum(axis=0) / self.num_boids)
 
         self.update_attractors()
+        self.frame += 1
+        if self.snapshots.wanted:
+            self.snapshots.publish(self, self.frame)
 
     def ua_random(self):
         """ a chance to update each attractor to a random place """
-        for i, attr in enumerate(self.attractors):
-            if random.random() < SP.RAND_ATTRACTOR_CHANGE:
-                att = Attractor(rand_point_in_cube(self.cube, DIMS), self.cube)
-                self.attractors[i] = att
+        self.attractor_set.teleport(SP.RAND_ATTRACTOR_CHANGE)
 
     def ua_path(self):
-        """ step through equation function for each attractor """
-        for attr in self.attractors:
-            attr.step_path_equation()
+        """ step every attractor along its path (all at once) """
+        self.attractor_set.step_paths()
 
     def ua_midi(self):
         """ "this is handled by the callback function place_attractor """
-        for attr in self.attractors:
-            attr.inc_age()
+        self.attractor_set.inc_age()
 
     def get_COM(self):
         """
@@ -583,3 +1292,86 @@ class Swarm(object):
         # TODO make this foolproof
         com = self.c_o_m
         return com
+
+
+class Predators(Swarm):
+    """
+    A swarm that hunts another: every predator just chases the nearest of its prey, which flee from it (see Flee)
+    There are no flocking rules or attractors, as a handful of predators would cost about as much to step as a
+    whole small swarm otherwise
+    """
+    def __init__(self, num_boids, cube, prey, capacity=None):
+        """
+        :param prey: Swarm  the swarm it hunts
+        """
+        super().__init__(num_boids, cube, 0, capacity=capacity)
+        self.update_attractors = lambda: None
+        self.prey = prey
+        self.quarry = zeros((0, DIMS), dtype=self.dtype)  # where the prey were at the start of the tick
+        self.quarry_sq_dists = zeros((num_boids, 0), dtype=self.dtype)   # from every predator to every one of them
+        prey.add_predator(self)
+
+    def __repr__(self):
+        return "Predators: {0} boids hunting a swarm of {1}".format(self.num_boids, self.prey.num_boids)
+
+    def see_prey(self, locations, sq_dists):
+        """
+        Take note of where every one of the prey is, from the prey's see_predators (before anything moves this tick)
+        :param locations: (N, DIMS) array of the prey
+        :param sq_dists: (num_boids, N) array of the squared distance from every predator to each of them
+        """
+        self.quarry = locations.astype(self.dtype)
+        self.quarry_sq_dists = sq_dists
+
+    def population_changed(self):
+        """
+        Catch up with predators having been added or removed, leaving the prey out until they are seen again
+        """
+        super().population_changed()
+        self.quarry = self.quarry[:0]
+
+    def calc_v(self):
+        """
+        Steer every predator towards the nearest of its prey, at top speed until it is near enough to feed
+        """
+        prey = self.quarry
+        if len(prey):
+            nearest_prey = self.quarry_sq_dists.argmin(axis=1)
+            to_prey = prey[nearest_prey] - self.locations
+            dist = sqrt(self.quarry_sq_dists.min(axis=1))
+            self.feeding[:] = dist < SP.FEED_DIST
+            wanted = to_prey * (SP.MAX_SPEED / maximum(dist, SP.FEED_DIST))[:, newaxis]
+            self.adjustments[:] = (wanted - self.velocities) * SP.CHASE_MULTIPLIER
+        else:
+            self.adjustments[:] = 0
+        Flee.add_adjustment(self)
+        Avoidance.add_adjustment(self)
+
+    def move(self):
+        """
+        Move every predator at up to top speed
+        They never stop chasing, so need no boost to keep going, and their prey keeps them in the cube
+        """
+        velocities = self.velocities
+        velocities += self.adjustments
+        speed = sqrt(einsum('ij,ij->i', velocities, velocities))
+        velocities *= (SP.MAX_SPEED / maximum(speed, SP.MAX_SPEED))[:, newaxis]
+        self.locations += velocities
+
+
+def step_world(swarms):
+    """
+    Update every swarm by one tick
+    Stigmergy: the boids of the first (lead) swarm are placed as attractors in every other (follower) swarm
+    :param swarms: list of Swarm, lead swarm first
+    """
+    # get position of every lead boid as ratios before anything moves
+    # the lead swarm's ratios are replaced once it has moved, so they all have to be placed first
+    leads = swarms[0].get_loc_ratios()
+    for swarm in swarms[1:]:
+        swarm.place_attractors(leads)
+    # predators are seen where they were before anything moves too
+    for swarm in swarms:
+        swarm.see_predators()
+    for swarm in swarms:
+        swarm.update()
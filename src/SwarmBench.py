@@ -0,0 +1,284 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+from time import perf_counter
+
+import numpy
+from numpy import array, percentile
+
+import JitKernels
+import Swarm
+from Headless import make_specs
+from Parallel import SwarmPool, build_swarms
+from Parameters import SP, load_config
+
+"""
+Benchmark Swarm.update over a grid of swarm sizes, dimensions, attractors and modes
+Results are written as JSON and can be compared against a stored baseline
+Exits with 1 if any case has regressed, if none of the cases run are in the baseline,
+or if adding a predator costs more than PREDATOR_BUDGET of any case's tick time
+
+Usage (from src):
+    python -m SwarmBench                                  # run the default grid
+    python -m SwarmBench --boids 100,1000 --dims 5        # a smaller grid
+    python -m SwarmBench --update-baseline                # store the results as the new baseline
+"""
+
+# the grid that is run by default (each axis can be overridden from the command line)
+GRID = {
+    'boids': [13, 100, 500],
+    'dims': [3, 5],
+    'attractors': [6, 100],
+    'flock': [0, 1],
+    'attractor_mode': [0, 1],   # 0 = teleportation, 1 = paths
+    'followers': [0, 1],        # stigmergy follower swarms (with as many boids as the lead)
+    'workers': [0],             # processes to step the swarms in (0 = all in this one)
+    'jit': [0, 1],              # rules through the numba kernels (skipped if numba isn't installed)
+    'predators': [0, 1],        # predator swarms chasing the lead swarm (skipped with workers)
+    'obstacles': [0],           # obstacle meshes in the cube (taken in turn from OBSTACLE_MODELS)
+}
+AXES = list(GRID)
+
+WARM_UP_TICKS = 20
+TICKS = 200
+REGRESSION_THRESHOLD = 0.10     # how much slower (as a ratio) a case can be than the baseline before it fails
+PREDATOR_BUDGET = 0.20          # how much of the tick time adding a predator should cost
+BASELINE_PATH = 'bench_baseline.json'
+OBSTACLE_MODELS = ['monkey.obj', 'uv_sphere.obj', 'box.obj']
+
+
+def case_name(case):
+    """
+    :param case: dict of one value for each axis of the grid
+    :return: str key that identifies the case in a results file
+    """
+    return " ".join("{0}={1}".format(axis, case[axis]) for axis in AXES)
+
+
+def time_ticks(swarms, step, ticks, warm_up):
+    """
+    :return: list of how long each tick took, in seconds
+    """
+    for _ in range(warm_up):
+        step(swarms)
+    tick_times = []
+    for _ in range(ticks):
+        start = perf_counter()
+        step(swarms)
+        tick_times.append(perf_counter() - start)
+    return tick_times
+
+
+def time_interleaved(worlds, step, ticks, warm_up):
+    """
+    Time a tick of each world in turn, so that they all run under the same load
+    :param worlds: list of list of Swarm
+    :return: list of how long each tick took, in seconds, for each world
+    """
+    for _ in range(warm_up):
+        for swarms in worlds:
+            step(swarms)
+    tick_times = [[] for _ in worlds]
+    for _ in range(ticks):
+        for swarms, times in zip(worlds, tick_times):
+            start = perf_counter()
+            step(swarms)
+            times.append(perf_counter() - start)
+    return tick_times
+
+
+def run_case(case, ticks=TICKS, warm_up=WARM_UP_TICKS, seed=1):
+    """
+    Build the swarms for one case and time every tick
+    :param case: dict of one value for each axis of the grid
+    :return: dict of the case, its throughput and its per-tick latency percentiles
+    """
+    old_dims, old_flock, old_mode, old_jit = Swarm.DIMS, SP.IS_FLOCK, SP.ATTRACTOR_MODE, SP.JIT
+    Swarm.DIMS, SP.IS_FLOCK, SP.ATTRACTOR_MODE, SP.JIT = (case['dims'], case['flock'], case['attractor_mode'],
+                                                          case['jit'])
+    overhead = None
+    try:
+        Swarm.seed_streams(seed)
+        models = [OBSTACLE_MODELS[i % len(OBSTACLE_MODELS)] for i in range(case['obstacles'])]
+        specs = make_specs(case['boids'], case['attractors'], case['followers'], num_predators=case['predators'],
+                           obstacle_models=models)
+        if case['workers']:
+            with SwarmPool(specs, case['workers']) as pool:
+                tick_times = time_ticks(pool.swarms, pool.step, ticks, warm_up)
+        elif case['predators']:
+            # what the predators cost is timed against the same world without them, a tick of each in turn,
+            # as it can be less than the noise between one run and the next
+            swarms = build_swarms(specs)
+            Swarm.seed_streams(seed)
+            without = build_swarms(specs[:-case['predators']])
+            tick_times, base_times = time_interleaved([swarms, without], Swarm.step_world, ticks, warm_up)
+            overhead = percentile(tick_times, 50) / percentile(base_times, 50) - 1
+        else:
+            tick_times = time_ticks(build_swarms(specs), Swarm.step_world, ticks, warm_up)
+        backend = JitKernels.backend()
+    finally:
+        Swarm.DIMS, SP.IS_FLOCK, SP.ATTRACTOR_MODE, SP.JIT = old_dims, old_flock, old_mode, old_jit
+
+    tick_ms = array(tick_times) * 1000
+    p50, p90, p99 = percentile(tick_ms, [50, 90, 99])
+    result = dict(case)
+    result.update({
+        'name': case_name(case),
+        'backend': backend,
+        'ticks': ticks,
+        'ticks_per_second': ticks / (tick_ms.sum() / 1000),
+        'p50_ms': p50,
+        'p90_ms': p90,
+        'p99_ms': p99,
+        'max_ms': tick_ms.max(),
+        'predator_overhead': overhead,
+    })
+    return result
+
+
+def run_grid(grid, ticks=TICKS, warm_up=WARM_UP_TICKS, seed=1, verbose=True):
+    """
+    :param grid: dict of axis -> list of values
+    :return: list of results, one for every combination of values
+    """
+    results = []
+    for values in itertools.product(*(grid[axis] for axis in AXES)):
+        case = dict(zip(AXES, values))
+        if case['jit'] and JitKernels.numba is None:
+            continue  # it would only time the NumPy engine again
+        if case['predators'] and case['workers']:
+            continue  # predators have to be in the same process as their prey
+        result = run_case(case, ticks, warm_up, seed)
+        if verbose:
+            print("{name:<70} {ticks_per_second:9.1f} ticks/s  p50 {p50_ms:8.3f}ms  p99 {p99_ms:8.3f}ms".format(
+                **result))
+        results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare median tick times against a baseline
+    :param results: list of results from run_grid
+    :param baseline: list of results from an earlier run
+    :param threshold: float how much slower (as a ratio) a case can be before it counts as a regression
+    :return: list of (name, baseline p50, new p50, ratio) for every case that regressed
+    """
+    old = {result['name']: result for result in baseline}
+    regressions = []
+    for result in results:
+        if result['name'] not in old:
+            continue
+        ratio = result['p50_ms'] / old[result['name']]['p50_ms']
+        if ratio > 1 + threshold:
+            regressions.append((result['name'], old[result['name']]['p50_ms'], result['p50_ms'], ratio))
+    return regressions
+
+
+def unmatched(results, baseline):
+    """
+    :param results: list of results from run_grid
+    :param baseline: list of results from an earlier run
+    :return: (names of the baseline's cases that weren't run, names of the cases run that aren't in the baseline)
+    """
+    old = {result['name'] for result in baseline}
+    new = {result['name'] for result in results}
+    return sorted(old - new), sorted(new - old)
+
+
+def predator_overhead(results):
+    """
+    How much adding predators costs each case
+    :param results: list of results from run_grid
+    :return: list of (name, predators, ratio of median tick time to the same world without them - 1)
+    """
+    return [(result['name'], result['predators'], result['predator_overhead'])
+            for result in results if result.get('predator_overhead') is not None]
+
+
+def environment():
+    """ :return: dict describing what the benchmark was run on """
+    return {
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'numba': JitKernels.numba.__version__ if JitKernels.numba is not None else None,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'system': platform.system(),
+    }
+
+
+def int_list(text):
+    return [int(value) for value in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Swarm.update over a grid of configurations")
+    for axis in AXES:
+        parser.add_argument('--' + axis.replace('_', '-'), type=int_list, default=GRID[axis],
+                            help="comma separated values (default {0})".format(",".join(map(str, GRID[axis]))))
+    parser.add_argument('--ticks', type=int, default=TICKS, help="ticks to time for each case")
+    parser.add_argument('--warm-up', type=int, default=WARM_UP_TICKS, help="ticks to run before timing")
+    parser.add_argument('--seed', type=int, default=1, help="random seed for every case")
+    parser.add_argument('--config', default='config.ini', help="config file to load parameters from")
+    parser.add_argument('--output', default='bench_results.json', help="file to write the results to")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="results file to compare against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="ratio a case's median tick time can grow by before it is a regression")
+    parser.add_argument('--update-baseline', action='store_true', help="store these results as the baseline")
+    args = parser.parse_args(argv)
+
+    load_config(args.config)
+    SP.RANDOM_SEED = args.seed
+    print(JitKernels.describe())
+    grid = {axis: getattr(args, axis) for axis in AXES}
+
+    results = run_grid(grid, args.ticks, args.warm_up, args.seed)
+    overheads = predator_overhead(results)
+    over = [(name, cost) for name, _, cost in overheads if cost > PREDATOR_BUDGET]
+    if overheads:
+        print("Adding a predator: median {0:+.0%}, worst {1:+.0%} of tick time ({2} of {3} cases over {4:.0%})".format(
+            sorted(cost for _, _, cost in overheads)[len(overheads) // 2], max(cost for _, _, cost in overheads),
+            len(over), len(overheads), PREDATOR_BUDGET))
+    for name, cost in over:
+        print("OVER BUDGET {0}: a predator costs {1:+.0%} of tick time".format(name, cost))
+    report = {'environment': environment(), 'ticks': args.ticks, 'seed': args.seed, 'results': results}
+    with open(args.output, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+    print("Results written to {0}".format(args.output))
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print("Baseline updated: {0}".format(args.baseline))
+        return 1 if over else 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at {0} to compare against (run with --update-baseline to make one)".format(args.baseline))
+        return 1 if over else 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    missing, added = unmatched(results, baseline['results'])
+    for name in missing:
+        print("NOT RUN {0}: in the baseline but not in this run".format(name))
+    for name in added:
+        print("NEW {0}: not in the baseline, so not compared".format(name))
+    if len(added) == len(results):
+        print("ERROR: none of the {0} cases run are in the baseline at {1}, so nothing was compared "
+              "(run with --update-baseline to make a new one)".format(len(results), args.baseline))
+        return 1
+    regressions = compare(results, baseline['results'], args.threshold)
+    for name, old_p50, new_p50, ratio in regressions:
+        print("REGRESSION {0}: p50 {1:.3f}ms -> {2:.3f}ms ({3:+.0%})".format(name, old_p50, new_p50, ratio - 1))
+    if regressions:
+        return 1
+    print("No regressions beyond {0:.0%} of the baseline in {1} cases".format(args.threshold,
+                                                                             len(results) - len(added)))
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,14 @@
 import Swarm
+import JitKernels
+import Parallel
 from SwarmRender import Window
 import pyglet
 import rtmidi
 from Interpreters import *
 
-import random
 import Scales
-import configparser
 import Parameters
+from Parameters import load_config
 from InStream import InStream
 
 from numpy import array
@@ -18,39 +19,6 @@ Main method for running the swarm simulation
 """
 
 
-def load_config():
-    config = configparser.ConfigParser()
-    # TODO error catching
-    config.read('config.ini')
-
-    Parameters.DP.UPDATE_RATE = int(config['DEFAULT']['UPDATE_RATE'])
-
-    seed = int(config['SWARM']['RANDOM_SEED'])
-    if seed == -1:
-        seed = random.randint(1, 1000000)
-    Parameters.SP.RANDOM_SEED = seed
-    Parameters.SP.IS_FLOCK = int(config['SWARM']['IS_FLOCK'])
-    Parameters.SP.FEEDING = int(config['SWARM']['FEEDING'])
-    Parameters.SP.FEED_DIST = float(config['SWARM']['FEED_DIST'])
-    Parameters.SP.MAX_SPEED = float(config['SWARM']['MAX_SPEED'])
-    Parameters.SP.RAND_POINT_SD = float(config['SWARM']['RAND_POINT_SD'])
-    Parameters.SP.REPULSION_POINT = float(config['SWARM']['REPULSION_POINT'])
-    Parameters.SP.COHESION_NEIGHBOURHOOD = float(config['SWARM']['COHESION_NEIGHBOURHOOD'])
-    Parameters.SP.ALIGNMENT_NEIGHBOURHOOD = float(config['SWARM']['ALIGNMENT_NEIGHBOURHOOD'])
-    Parameters.SP.SEPARATION_NEIGHBOURHOOD = float(config['SWARM']['SEPARATION_NEIGHBOURHOOD'])
-    Parameters.SP.COHESION_MULTIPLIER = float(config['SWARM']['COHESION_MULTIPLIER'])
-    Parameters.SP.ALIGNMENT_MULTIPLIER = float(config['SWARM']['ALIGNMENT_MULTIPLIER'])
-    Parameters.SP.SEPARATION_MULTIPLIER = float(config['SWARM']['SEPARATION_MULTIPLIER'])
-    Parameters.SP.ATTRACTION_MULTIPLIER = float(config['SWARM']['ATTRACTION_MULTIPLIER'])
-    Parameters.SP.CONSTRAINT_MULTIPLIER = float(config['SWARM']['CONSTRAINT_MULTIPLIER'])
-    Parameters.SP.TURNING_RATIO = float(config['SWARM']['TURNING_RATIO'])
-    Parameters.SP.RAND_ATTRACTOR_CHANGE = float(config['SWARM']['RAND_ATTRACTOR_CHANGE'])
-    Parameters.SP.ATTRACTOR_MODE = int(config['SWARM']['ATTRACTOR_MODE'])
-    Parameters.SP.ATTRACTORS_NOTICED = int(config['SWARM']['ATTRACTORS_NOTICED'])
-    Parameters.SP.MOTION_CONSTANT = float(config['SWARM']['MOTION_CONSTANT'])
-    Parameters.SP.BOUNDING_SPHERE = int(config['SWARM']['BOUNDING_SPHERE'])
-
-
 def start_interp(interp, tempo=None, scale=None, preset=None, instrument=None):
     if preset:
         preset_path = "./presets/{}.json".format(preset)
@@ -69,6 +37,9 @@ def main(out_port, in_port):
 
     # LOAD PARAMS FROM CONFIG
     load_config()
+    Swarm.seed_streams()
+    print("Random seed: {0}".format(Parameters.SP.RANDOM_SEED))
+    print(JitKernels.describe())
 
     # DEFINE BOUNDING BOX(ES)
     cube_min = array([10, 50, 7, 0, 0])
@@ -79,14 +50,25 @@ def main(out_port, in_port):
 
     # MAKE SWARM OBJECTS
     # TODO make the 'follow' implicit
-    # format:       swarm,                    channel
+    # format:       swarm,                            channel
     swarm_data = [
-                    (Swarm.Swarm(13, cube, 6), 3),
-                    # (Swarm.Swarm(7, cube, follow=7), 1),
-                    # (Swarm.Swarm(15, cube3, follow=12), 2),
-                    # (Swarm.Swarm(4, cube2, follow=7), 9)
+                    (Parallel.SwarmSpec(13, cube, 6), 3),
+                    # (Parallel.SwarmSpec(7, cube, follow=7), 1),
+                    # (Parallel.SwarmSpec(15, cube3, follow=12), 2),
+                    # (Parallel.SwarmSpec(4, cube2, follow=7), 9)
     ]
-    swarms = list(map(lambda x: x[0], swarm_data))
+    specs = list(map(lambda x: x[0], swarm_data))
+    if Parameters.SP.WORKERS:
+        # step the swarms in worker processes
+        pool = Parallel.SwarmPool(specs, Parameters.SP.WORKERS)
+        swarms, step = pool.swarms, pool.step
+    else:
+        swarms, step = Parallel.build_swarms(specs), Swarm.step_world
+        pool = None
+        if Parameters.SP.SLAB_WORKERS:
+            # split the lead swarm between worker processes
+            pool = Parallel.SlabPool(swarms[0], Parameters.SP.SLAB_WORKERS)
+    swarm_data = [(swarm, channel) for swarm, (_, channel) in zip(swarms, swarm_data)]
 
     # SET UP MIDI
     midiout = rtmidi.MidiOut()
@@ -126,7 +108,8 @@ def main(out_port, in_port):
         h = 1080
 
     # creates the window and sets its properties
-    Window(swarms, interps, ren_att, config=config, width=w, height=h, caption='Murmurations', resizable=True)
+    Window(swarms, interps, ren_att, step=step, config=config, width=w, height=h, caption='Murmurations',
+           resizable=True)
 
     # start the application
     pyglet.app.run()
@@ -139,6 +122,8 @@ def main(out_port, in_port):
     if in_stream:
         in_stream.done = True
         in_stream.join()
+    if pool:
+        pool.close()
     print("Exiting")
 
 if __name__ == '__main__':
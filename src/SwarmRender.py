@@ -10,10 +10,8 @@ import os
 import math
 from copy import deepcopy
 from Parameters import DP, SP
-from numpy import zeros, float64
 
-
-from Swarm import normalise
+from Swarm import normalise, step_world
 """
 Render the swarm objects
 Contains render methods for the displayable classes
@@ -54,7 +52,7 @@ class World:
     Collection of OBJ models within the larger simulation.
     """
 
-    def __init__(self, swarms, coords, models, rnd_att, background_color=sky):
+    def __init__(self, swarms, coords, models, rnd_att, background_color=sky, step=step_world):
 
         # turn off attractor rendering
         self.render_attractors = rnd_att
@@ -63,16 +61,11 @@ class World:
         self.models = models
 
         self.swarms = swarms
+        self.step = step  # steps every swarm by one tick (e.g. Parallel.SwarmPool.step)
         self.cubes = set()
         for swarm in swarms:
             self.cubes.add(swarm.cube)
 
-        # stigmergy setup:
-        if swarms[0].boids:  # this line is purely so it is possible to view the attractors on their own if desired
-            self.num_leading_boids = len(swarms[0].boids)
-            self.num_dims = len(swarms[0].boids[0].location)
-            self.leads = [zeros(self.num_dims, dtype=float64)]*self.num_leading_boids
-
         # make the objects for the cube
         self.boxes = []
         for cube in self.cubes:
@@ -85,6 +78,17 @@ class World:
             box_model.scale = cube.edge_length/2
             self.boxes.append(box_model)
 
+        # and for any obstacles in them (drawn with the models they were baked from)
+        self.obstacle_models = []
+        for cube in self.cubes:
+            if cube.field is None:
+                continue
+            for name, centre, scale in cube.field.models():
+                obstacle_model = OBJModel(path=os.path.join('obj', name))
+                obstacle_model.x, obstacle_model.y, obstacle_model.z = list(centre)
+                obstacle_model.scale = scale
+                self.obstacle_models.append(obstacle_model)
+
         self.swarm_models = []
         for swarm in self.swarms:
             colour = rand_colour()
@@ -94,9 +98,11 @@ class World:
             attractor_size = boid_size * 0.2
 
             boid_models = []
+            # there is a model for every slot, but only the boids alive have a location to start it at
             for boid in swarm.boids:
                 boid_model = deepcopy(self.models[PYRAMID])
-                boid_model.x, boid_model.y, boid_model.z = list(boid.location)[:3]
+                if boid.alive:
+                    boid_model.x, boid_model.y, boid_model.z = list(boid.location)[:3]
                 boid_model.color = colour
                 boid_model.scale = boid_size
                 boid_models.append(boid_model)
@@ -140,11 +146,15 @@ class World:
 
         for box in self.boxes:
             self.render_model(box, fill=False)
+        for obstacle in self.obstacle_models:
+            self.render_model(obstacle)
 
-        # TODO Note: won't account for changing number of boids if that is ever implemented
+        # there is a model for every slot in the swarm, so boids coming and going don't need new ones
         for i, (boids_m, atts) in enumerate(self.swarm_models):
             swarm = self.swarms[i]
             for j, boid_m in enumerate(boids_m):
+                if not swarm.boids[j].alive:
+                    continue
 
                 # experimental: invert colour if feeding
                 # if swarm.boids[j].feeding:
@@ -233,20 +243,7 @@ class World:
     def update(self):
         """ main update loop of the entire simulation is hidden way down here """
 
-        for i, swarm in enumerate(self.swarms):
-            # stigmergy!
-            if i == 0:
-                # LEAD SWARM:
-                # get position of every boid as ratios
-                for j, boid in enumerate(swarm.boids):
-                    self.leads[j] = boid.get_loc_ratios()
-            else:
-                # FOLLOWER SWARMS:
-                # set leading swarm positions as the attractors in followers
-                for att in self.leads:
-                    swarm.place_attractor(att)
-                pass
-            swarm.update()
+        self.step(self.swarms)
 
 
 class OBJModel:
@@ -316,7 +313,7 @@ class Window(pyglet.window.Window):
     Takes care of all the viewing functionality
     """
 
-    def __init__(self, swarms, interps, ren_att, *args, ** kwargs):
+    def __init__(self, swarms, interps, ren_att, *args, step=step_world, **kwargs):
         super().__init__(*args, **kwargs)
 
         # Load models from files
@@ -328,7 +325,7 @@ class Window(pyglet.window.Window):
         # # current cube to be looking at
         self.cube_index = 0
 
-        self.world = World(swarms, [0, 0, -DIST_BACK], self.models, ren_att)
+        self.world = World(swarms, [0, 0, -DIST_BACK], self.models, ren_att, step=step)
 
         # TODO work out how to display text:
         self.label = pyglet.text.Label('Hello, world',
@@ -339,9 +336,6 @@ class Window(pyglet.window.Window):
 
         self.recording = False
 
-        # if SP.RANDOM_SEED != SP.TRUE_RANDOM:
-        #     random.seed(SP.RANDOM_SEED)  # for repeatability
-
         @self.event
         def on_resize(width, height):
             # sets the viewport
@@ -0,0 +1,527 @@
+"""
+Regression checks for the swarming rules against the original per-boid loop
+Run from src with: python -m pytest -q
+"""
+
+import os
+from math import sin, cos
+
+import pytest
+from numpy import array, zeros, argmin, arange, stack, meshgrid, minimum, clip, allclose, array_equal, argsort, sort, inf
+from numpy.linalg import norm
+from numpy.random import default_rng
+
+import JitKernels
+import Neighbours
+import Obstacles
+import Parallel
+import Swarm
+from Swarm import LATEST, EVENLY, RANDOM
+from Parameters import SP, load_config
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')
+OBJ_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'obj')
+EDGE = 40.0
+SEED = 7
+
+
+@pytest.fixture(autouse=True)
+def parameters():
+    """ every test starts from config.ini, as the tests change SP """
+    load_config(CONFIG)
+    SP.IS_FLOCK = 1
+    SP.JIT = 0
+    Swarm.seed_streams(SEED)
+
+
+def make_swarm(num_boids=80, num_attractors=6):
+    """
+    :return: Swarm with its boids clumped around the centre, so every rule has neighbours to work with
+    """
+    cube = Swarm.Cube(zeros(Swarm.DIMS), EDGE)
+    swarm = Swarm.Swarm(num_boids, cube, num_attractors)
+    rng = default_rng(SEED)
+    swarm.locations[:] = swarm.centre + rng.normal(0.0, 6.0, swarm.locations.shape)
+    swarm.turning[:] = rng.random(num_boids) < 0.3
+    swarm.ratios_frame = None
+    return swarm
+
+
+def naive_adjustments(swarm, k=None):
+    """
+    The rules one boid at a time, as Boid.calc_v used to apply them
+    :param k: int   only look at each boid's k nearest others, as in topological mode (defaults to every boid in range)
+    :return: ((N, DIMS) adjustments, (N,) feeding)
+    """
+    locations, velocities, cube = swarm.locations, swarm.velocities, swarm.cube
+    attractors = swarm.get_attractor_locations()
+    threats = getattr(swarm, 'threats', zeros((0, Swarm.DIMS)))
+    adjustments = zeros(locations.shape)
+    feeding = zeros(len(locations), dtype=bool)
+    # topological neighbours are followed however far away they are, except by separation
+    cohesion_radius = inf if k else SP.COHESION_NEIGHBOURHOOD * cube.edge_length
+    alignment_radius = inf if k else SP.ALIGNMENT_NEIGHBOURHOOD * cube.edge_length
+    for b, (location, velocity) in enumerate(zip(locations, velocities)):
+        cohesion, alignment, separation = zeros(Swarm.DIMS), zeros(Swarm.DIMS), zeros(Swarm.DIMS)
+        num_c = num_a = num_s = 0
+        others = range(len(locations))
+        if k:
+            others = [b] + [o for o in argsort(norm(locations - location, axis=1)) if o != b][:k]
+        for o in others:
+            other, other_velocity = locations[o], velocities[o]
+            distance = norm(location - other)
+            if o != b and distance < cohesion_radius:
+                cohesion += other
+                num_c += 1
+            if o != b and distance < alignment_radius:
+                alignment += other_velocity
+                num_a += 1
+            if distance < SP.SEPARATION_NEIGHBOURHOOD * cube.edge_length:
+                if distance > 0:
+                    separation += (location - other) / distance**2
+                num_s += 1
+        if norm(separation) > 0:
+            adjustments[b] += (separation / num_s - velocity) * SP.SEPARATION_MULTIPLIER
+        if num_c:
+            adjustments[b] += (cohesion / num_c - location - velocity) * SP.COHESION_MULTIPLIER
+        if num_a:
+            adjustments[b] += (alignment / num_a - velocity) * SP.ALIGNMENT_MULTIPLIER
+
+        if swarm.turning[b]:
+            adjustments[b] += (swarm.centre - location) * SP.CONSTRAINT_MULTIPLIER
+
+        ratio = clip((location - cube.v_min) / cube.edge_length, 0.0, 0.99)[min(4, Swarm.DIMS - 1)]
+        att_mul = -SP.ATTRACTION_MULTIPLIER if ratio < SP.REPULSION_POINT else SP.ATTRACTION_MULTIPLIER
+        pulls = sorted((norm(attractor - location), attractor) for attractor in attractors)
+        feeding[b] = any(dist < SP.FEED_DIST for dist, _ in pulls)
+        for dist, attractor in pulls[:SP.ATTRACTORS_NOTICED]:
+            adjustments[b] += (attractor - location - velocity) * att_mul / dist
+
+        flee, num_f = zeros(Swarm.DIMS), 0
+        for threat in threats:
+            away = location - threat
+            if norm(away) < SP.PREDATOR_NEIGHBOURHOOD * cube.edge_length:
+                num_f += 1
+                if norm(away) > 0:
+                    flee += away / (away @ away)
+        if num_f:
+            adjustments[b] += flee / num_f * SP.FLEE_MULTIPLIER
+    return adjustments, feeding
+
+
+def check_against_naive(swarm, ticks=4):
+    """
+    Step the swarm, checking every tick's adjustments against the per-boid loop
+    A few ticks, so anything kept from one tick to the next gets used
+    """
+    for _ in range(ticks):
+        adjustments, feeding = naive_adjustments(swarm)
+        swarm.update()
+        assert allclose(swarm.adjustments, adjustments)
+        assert array_equal(swarm.feeding, feeding)
+
+
+def test_rules_match_naive_loop():
+    SP.NEIGHBOUR_SEARCH = Neighbours.BRUTE_FORCE
+    SP.VERLET_SKIN = 0
+    check_against_naive(make_swarm())
+
+
+def test_spatial_hash_matches_naive_loop():
+    SP.NEIGHBOUR_SEARCH = Neighbours.SPATIAL_HASH
+    SP.VERLET_SKIN = 0
+    check_against_naive(make_swarm())
+
+
+def test_auto_search_picks_hash_for_small_neighbourhoods():
+    search = Neighbours.NeighbourSearch(Swarm.Cube(zeros(Swarm.DIMS), EDGE))
+    assert search.choose(1000, 5, 0.4 * EDGE) == Neighbours.BRUTE_FORCE
+    assert search.choose(1000, 5, 0.25 * EDGE) == Neighbours.SPATIAL_HASH
+    assert search.choose(100, 5, 0.25 * EDGE) == Neighbours.BRUTE_FORCE
+
+
+@pytest.mark.parametrize('method', [Neighbours.BRUTE_FORCE, Neighbours.SPATIAL_HASH])
+def test_verlet_list_matches_naive_loop(method):
+    SP.NEIGHBOUR_SEARCH = method
+    SP.VERLET_SKIN = 0.1
+    swarm = make_swarm()
+    check_against_naive(swarm, ticks=6)
+    # the pairs were reused for some of the ticks
+    assert swarm.neighbours.rebuilds < swarm.neighbours.ticks
+
+
+def test_tiles_match_naive_loop():
+    SP.NEIGHBOUR_SEARCH = Neighbours.TILED
+    SP.TILE_MEMORY = 0.01   # several tiles across even this few boids
+    swarm = make_swarm()
+    check_against_naive(swarm)
+    assert swarm.search_used == Neighbours.TILED
+
+
+def test_auto_search_reports_the_path_used():
+    SP.NEIGHBOUR_SEARCH = Neighbours.AUTO
+    swarm = make_swarm()
+    assert "not run yet" in swarm.describe()
+    swarm.update()
+    # the clumped swarm is crowded, so tiles are used ahead of the pair list
+    assert swarm.tiles.pair_density > Neighbours.DENSE_PAIRS
+    assert swarm.search_used == Neighbours.TILED
+    assert "dense tiles (auto" in swarm.describe()
+    # once spread thin, auto goes back to listing pairs
+    swarm.locations[:] = swarm.centre + 10 * (swarm.locations - swarm.centre)
+    swarm.update()
+    swarm.update()
+    assert swarm.search_used == swarm.neighbours.method != Neighbours.TILED
+    assert "dense tiles" not in swarm.describe()
+
+
+def test_topological_matches_naive_loop():
+    SP.RULE_MODE = Neighbours.TOPOLOGICAL
+    swarm = make_swarm()
+    for _ in range(3):
+        adjustments, feeding = naive_adjustments(swarm, k=SP.NEAREST_NEIGHBOURS)
+        swarm.update()
+        assert allclose(swarm.adjustments, adjustments)
+
+
+def test_attractors_can_be_ignored():
+    SP.ATTRACTORS_NOTICED = 0
+    swarm = make_swarm()
+    swarm.attractor_set.locations[:2] = swarm.locations[:2]
+    check_against_naive(swarm, ticks=2)
+    assert swarm.feeding.any()
+
+
+def check_attractor_index(swarm, step, ticks=20):
+    """
+    Step the world, checking an index's nearest attractors to the swarm against every attractor each tick
+    :return: list of how many boids the index looked up again each tick, after it was first built
+    """
+    index = Neighbours.AttractorIndex()
+    lookups = []
+    for _ in range(ticks):
+        step()
+        before = index.lookups
+        attractors, active = swarm.get_attractors()
+        _, sq_dists = index.nearest(swarm.locations, attractors, 2, active)
+        _, expected = Neighbours.nearest_between(swarm.locations, attractors[active], 2)
+        assert allclose(sort(sq_dists, axis=1), sort(expected, axis=1))
+        lookups.append(index.lookups - before)
+    # it never had to give up and check every attractor
+    assert index.resting == 0
+    return lookups[1:]
+
+
+def test_attractor_index_keeps_up_with_lead_boids(monkeypatch):
+    monkeypatch.setattr(Neighbours, 'ATTRACTOR_INDEX_MIN', 256)
+    SP.MAX_SPEED = 0.1
+    cube = Swarm.Cube(zeros(Swarm.DIMS), EDGE)
+    lead = Swarm.Swarm(600, cube, 6)
+    follower = Swarm.Swarm(200, cube, follow=600)
+    lookups = check_attractor_index(follower, lambda: Swarm.step_world([lead, follower]))
+    assert max(lookups) < follower.num_boids / 2
+
+
+def test_attractor_index_measures_placed_attractors():
+    SP.ATTRACTOR_MODE = 2
+    SP.MAX_SPEED = 0.1
+    swarm = make_swarm(200, 1100)
+    rng = default_rng(SEED)
+    swarm.place_attractors(rng.random((1100, Swarm.DIMS)))
+
+    def step():
+        swarm.place_attractor(rng.random(Swarm.DIMS))
+        swarm.update()
+    # a new attractor only sends the boids it could be nearest to back to brute force
+    lookups = check_attractor_index(swarm, step)
+    assert max(lookups) < swarm.num_boids / 4
+
+
+def test_pool_matches_serial():
+    cube = Swarm.Cube(zeros(Swarm.DIMS), EDGE)
+    specs = [Parallel.SwarmSpec(40, cube, 6), Parallel.SwarmSpec(30, cube, follow=10)]
+    serial = Parallel.build_swarms(specs)
+    for _ in range(5):
+        Swarm.step_world(serial)
+    Swarm.seed_streams(SEED)
+    with Parallel.SwarmPool(specs, workers=2) as pool:
+        for _ in range(5):
+            pool.step()
+        for alone, pooled in zip(serial, pool.swarms):
+            assert array_equal(alone.locations, pooled.locations)
+            assert array_equal(alone.velocities, pooled.velocities)
+
+
+@pytest.mark.parametrize('neighbourhood, split', [(0.5, Parallel.ROWS), (0.15, Parallel.SLABS)])
+def test_slabs_match_serial(neighbourhood, split):
+    SP.COHESION_NEIGHBOURHOOD = SP.ALIGNMENT_NEIGHBOURHOOD = neighbourhood
+    SP.SEPARATION_NEIGHBOURHOOD = min(SP.SEPARATION_NEIGHBOURHOOD, neighbourhood)
+    alone = make_swarm(200)
+    Swarm.seed_streams(SEED)
+    shared = make_swarm(200)
+    with Parallel.SlabPool(shared, workers=2) as pool:
+        for _ in range(3):
+            alone.calc_v()
+            shared.calc_v()
+            assert pool.split == split
+            assert allclose(alone.adjustments, shared.adjustments)
+            assert array_equal(alone.feeding, shared.feeding)
+            alone.move()
+            shared.locations[:] = alone.locations
+            shared.velocities[:] = alone.velocities
+            shared.turning[:] = alone.turning
+            alone.ratios_frame = shared.ratios_frame = None
+
+
+def test_jit_matches_numpy():
+    if JitKernels.numba is None:
+        pytest.skip("numba is not installed")
+    swarm = make_swarm()
+    SP.JIT = 1
+    swarm.calc_v()
+    compiled = swarm.adjustments.copy()
+    SP.JIT = 0
+    swarm.calc_v()
+    assert allclose(compiled, swarm.adjustments)
+
+
+def test_jit_falls_back_to_numpy():
+    SP.JIT = 1
+    expected = JitKernels.NUMPY if JitKernels.numba is None else JitKernels.NUMBA
+    assert JitKernels.backend() == expected
+    SP.JIT = 0
+    assert JitKernels.backend() == JitKernels.NUMPY
+    reason = "numba is not installed" if JitKernels.numba is None else "JIT is off"
+    assert reason in JitKernels.describe()
+
+
+def test_snapshots_only_published_once_read():
+    swarm = make_swarm()
+    swarm.update()
+    assert swarm.snapshots.latest.frame == 0
+    swarm.snapshots.population()
+    swarm.update()
+    frame, ratios, feeding = swarm.snapshots.swarm()
+    assert frame == swarm.frame
+    assert array_equal(ratios, swarm.get_ratios())
+    assert array_equal(feeding, swarm.feeding)
+    assert array_equal(swarm.snapshots.boid(3)[0], swarm.get_ratios()[3])
+
+
+def test_snapshot_read_retries_when_the_swarm_moves_on():
+    swarm = make_swarm()
+    swarm.snapshots.wanted = True
+    swarm.update()
+    copies = []
+
+    def copy(snapshot):
+        copies.append(snapshot.frame)
+        if len(copies) == 1:
+            # two ticks finish part way through the copy, so the buffer being read is written over
+            swarm.update()
+            swarm.update()
+        return snapshot.ratios[:snapshot.num_boids].copy()
+    frame, ratios = swarm.snapshots.read(copy)
+    assert len(copies) == 2
+    assert frame == swarm.frame
+    assert array_equal(ratios, swarm.get_ratios())
+
+
+def path_point(attractors, a, t):
+    """
+    One attractor's path worked out a dimension at a time, as each Attractor used to
+    :return: (DIMS,) array of the point t along attractor a's path
+    """
+    trigs = [sin if phase == 0 else cos for phase in attractors.phases[a]]
+    point = [coeff * trig(freq * t) for coeff, trig, freq in zip(attractors.coeffs[a], trigs, attractors.freqs[a])]
+    cube = attractors.cube
+    return array(point) * 0.4 * cube.edge_length + cube.centre
+
+
+def test_paths_match_direct_evaluation():
+    cube = Swarm.Cube(zeros(Swarm.DIMS), EDGE)
+    attractors = Swarm.AttractorSet(20, cube, default_rng(SEED))
+    for _ in range(10):
+        t = attractors.t.copy()
+        attractors.step_paths()
+        for a in range(len(attractors)):
+            assert allclose(attractors.locations[a], path_point(attractors, a, t[a]))
+
+
+def test_path_table_matches_stepping_each_tick():
+    cube = Swarm.Cube(zeros(Swarm.DIMS), EDGE)
+    sets = []
+    # SP is read as they step, so it is set for each in turn
+    for table in (0, 8):
+        SP.PATH_TABLE = table
+        sets.append((table, Swarm.AttractorSet(20, cube, default_rng(SEED))))
+    (_, stepped), (_, tabled) = sets
+    # enough ticks to go through the table a few times, with attractors teleporting part way through it
+    for _ in range(30):
+        for table, attractors in sets:
+            SP.PATH_TABLE = table
+            attractors.step_paths()
+            attractors.teleport(0.05)
+        assert allclose(stepped.locations, tabled.locations)
+
+
+def test_attractors_placed_from_snapshot_ratios():
+    lead = make_swarm(6)
+    lead.snapshots.population()
+    lead.update()
+    follower = make_swarm(10, 6)
+    # whole snapshot rows, velocities and all
+    _, ratios, _ = lead.snapshots.swarm()
+    follower.place_attractors(ratios)
+    assert allclose(follower.attractor_set.locations, lead.locations)
+
+
+def test_bulk_placement_matches_placing_in_turn():
+    leads = default_rng(SEED).random((15, Swarm.DIMS))
+    bulk, one_by_one = make_swarm(10, 6), make_swarm(10, 6)
+    bulk.att_index = one_by_one.att_index = 4
+    bulk.place_attractors(leads)
+    for ratios in leads:
+        one_by_one.place_attractor(ratios)
+    assert allclose(bulk.attractor_set.locations, one_by_one.attractor_set.locations)
+    assert bulk.att_index == one_by_one.att_index
+
+
+@pytest.mark.parametrize('sampling, expected', [(LATEST, list(range(9, 15))), (EVENLY, [0, 2, 5, 7, 10, 12]),
+                                                (RANDOM, None)])
+def test_stigmergy_sampling_picks_distinct_leads(sampling, expected):
+    SP.STIGMERGY_SAMPLING = sampling
+    leads = default_rng(SEED).random((15, Swarm.DIMS))
+    swarm = make_swarm(10, 6)
+    swarm.place_attractors(leads)
+    placed = (swarm.attractor_set.locations - swarm.cube.v_min) / swarm.cube.edge_length
+    # which lead each attractor was placed from
+    sources = [int(argmin(norm(leads - ratios, axis=1))) for ratios in placed]
+    assert allclose(placed, leads[sources])
+    assert len(set(sources)) == len(sources)
+    if expected is not None:
+        assert sorted(sources) == expected
+
+
+def test_spawned_swarm_matches_fresh_one():
+    SP.ATTRACTOR_MODE = 2   # the attractors stay put, so the two swarms can share them
+    SP.SPARE_BOIDS = 20
+    swarm = make_swarm(60)
+    for tick in range(6):
+        swarm.update()
+        for _ in range(3):
+            swarm.spawn()
+        for id in (tick, 2*tick + 5):
+            swarm.despawn(id)
+    fresh = make_swarm(swarm.num_boids)
+    for key in ('locations', 'velocities', 'turning'):
+        getattr(fresh, key)[:] = getattr(swarm, key)
+    fresh.attractor_set.locations[:] = swarm.attractor_set.locations
+    fresh.attractor_set.active[:] = swarm.attractor_set.active
+    fresh.ratios_frame = None
+    swarm.calc_v()
+    fresh.calc_v()
+    assert allclose(swarm.adjustments, fresh.adjustments)
+    assert allclose(swarm.adjustments, naive_adjustments(swarm)[0])
+
+
+def test_shared_swarm_cannot_change_size():
+    SP.SPARE_BOIDS = 4
+    swarm = make_swarm(50)
+    with Parallel.SlabPool(swarm, workers=1):
+        with pytest.raises(RuntimeError):
+            swarm.spawn()
+        with pytest.raises(RuntimeError):
+            swarm.despawn(3)
+    assert swarm.spawn() is not None
+
+
+def make_hunt(num_predators=3):
+    """
+    :return: (prey, predators) with the predators among the prey, one of them right on top of a boid
+    """
+    prey = make_swarm()
+    predators = Swarm.Predators(num_predators, prey.cube, prey)
+    predators.locations[:] = prey.locations[:num_predators] + 2.0
+    predators.locations[0] = prey.locations[5]
+    return prey, predators
+
+
+def test_flee_matches_naive_loop():
+    prey, predators = make_hunt()
+    for _ in range(4):
+        for swarm in (prey, predators):
+            swarm.see_predators()
+        adjustments, feeding = naive_adjustments(prey)
+        prey.update()
+        predators.update()
+        assert allclose(prey.adjustments, adjustments)
+        assert array_equal(prey.feeding, feeding)
+
+
+def test_predators_chase_nearest_prey():
+    prey, predators = make_hunt()
+    for _ in range(4):
+        for swarm in (prey, predators):
+            swarm.see_predators()
+        # the distances shared from the prey's side are the predators' own
+        assert allclose(predators.quarry_sq_dists, Neighbours.cross_sq_distances(predators.locations, prey.locations))
+        expected = []
+        for location, velocity in zip(predators.locations, predators.velocities):
+            dist, target = min((norm(other - location), o) for o, other in enumerate(prey.locations))
+            wanted = (prey.locations[target] - location) * SP.MAX_SPEED / max(dist, SP.FEED_DIST)
+            expected.append(((wanted - velocity) * SP.CHASE_MULTIPLIER, dist < SP.FEED_DIST))
+        prey.update()
+        predators.update()
+        for p, (adjustment, feeding) in enumerate(expected):
+            assert allclose(predators.adjustments[p], adjustment)
+            assert predators.feeding[p] == feeding
+
+
+def grid_points(field):
+    """ :return: (R, R, R, 3) array of where each of the field's grid points is """
+    axis = field.origin[:, None] + field.spacing * arange(field.resolution)
+    return stack(meshgrid(*axis, indexing='ij'), axis=-1)
+
+
+def test_obstacle_field_bakes_nearest_surface(tmp_path):
+    cube = Swarm.Cube(zeros(Swarm.DIMS), EDGE)
+    obstacles = [Obstacles.Sphere([12, 20, 20], 5), Obstacles.Box([28, 20, 20], 4)]
+    field = Obstacles.ObstacleField(cube, obstacles, resolution=17, cache_dir=str(tmp_path))
+    points = grid_points(field).reshape(-1, 3)
+    expected = minimum(obstacles[0].signed_distance(points), obstacles[1].signed_distance(points))
+    assert allclose(field.values[..., 0].ravel(), expected)
+    # a mesh of the box bakes the same distances as the box itself
+    box = Obstacles.Box([20, 20, 20], 6)
+    mesh = Obstacles.Mesh('box.obj', box.centre, box.half_size, obj_dir=OBJ_DIR)
+    assert allclose(mesh.signed_distance(points), box.signed_distance(points))
+
+
+def test_obstacle_field_is_cached(tmp_path):
+    cube = Swarm.Cube(zeros(Swarm.DIMS), EDGE)
+    obstacles = [Obstacles.Sphere([20, 20, 20], 5)]
+    baked = Obstacles.ObstacleField(cube, obstacles, resolution=9, cache_dir=str(tmp_path))
+    loaded = Obstacles.ObstacleField(cube, obstacles, resolution=9, cache_dir=str(tmp_path))
+    assert not baked.cached and loaded.cached
+    assert array_equal(baked.values, loaded.values)
+    # anything that changes the grid is baked again
+    moved = Obstacles.ObstacleField(cube, [Obstacles.Sphere([20, 20, 21], 5)], resolution=9, cache_dir=str(tmp_path))
+    finer = Obstacles.ObstacleField(cube, obstacles, resolution=11, cache_dir=str(tmp_path))
+    assert not moved.cached and not finer.cached
+
+
+def test_obstacle_field_samples_trilinearly(tmp_path):
+    cube = Swarm.Cube(zeros(Swarm.DIMS), EDGE)
+    field = Obstacles.ObstacleField(cube, [Obstacles.Sphere([20, 20, 20], 5)], resolution=9, cache_dir='')
+    # trilinear interpolation gets a linear function exactly, between the grid points as well as on them
+    slope = array([0.5, -1.0, 2.0])
+    field.values[..., 0] = grid_points(field) @ slope + 3.0
+    field.values[..., 1:] = slope
+    field.flat_values = field.values.reshape(-1, 4)
+    locations = default_rng(SEED).random((50, Swarm.DIMS)) * EDGE
+    distances, gradients = field.sample(locations)
+    assert allclose(distances, locations[:, :3] @ slope + 3.0)
+    assert allclose(gradients, slope)
+    # past the edge of the grid, the nearest edge is used
+    distances, _ = field.sample(array([[-5.0, 0, 0, 0, 0], [EDGE + 5, EDGE, EDGE, 0, 0]]))
+    assert allclose(distances, [3.0, EDGE * slope.sum() + 3.0])